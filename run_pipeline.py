@@ -1,6 +1,9 @@
 import argparse
+import os
 import sys
 
+from src.scripts.run_benchmark import main as run_benchmark
+from src.scripts.run_coverage import main as run_coverage
 from src.scripts.run_era5_pipeline import main as run_era5
 from src.scripts.run_floodscan_pipeline import main as run_floodscan
 from src.scripts.run_imerg_pipeline import main as run_imerg
@@ -26,6 +29,78 @@ def create_base_parser():
         action="store_true",
         help="Whether to check for existing raw data",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to spread independent dates or years across",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Overlap downloading, processing and uploading of consecutive dates",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Number of raw inputs to download ahead when streaming",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.getenv("RAW_CACHE_DIR"),
+        help="Directory of a persistent cache for raw files downloaded from storage",
+    )
+    parser.add_argument(
+        "--cache-size-gb",
+        type=float,
+        default=50,
+        help="Size budget of the raw cache, beyond which old files are evicted",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Reprocess and upload outputs even if their inputs are unchanged",
+    )
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        help="Encode COGs in memory and upload them without writing them to disk",
+    )
+    parser.add_argument(
+        "--memory-threshold-mb",
+        type=float,
+        default=256,
+        help="Size of output arrays above which COGs are encoded on disk instead",
+    )
+    parser.add_argument(
+        "--download-concurrency",
+        type=int,
+        default=8,
+        help="Number of ranged requests used in parallel to download a raw blob",
+    )
+    parser.add_argument(
+        "--download-chunk-mb",
+        type=float,
+        default=32,
+        help="Size of the ranged requests used to download raw blobs",
+    )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Omit empty blocks from the COGs (SPARSE_OK) and record each COG's sparsity",
+    )
+    parser.add_argument(
+        "--write-workers",
+        type=int,
+        default=4,
+        help="Number of COGs written in parallel from one raw input",
+    )
+    parser.add_argument(
+        "--reconcile-manifest",
+        action="store_true",
+        help="Rebuild the manifest of processed files from a full listing and exit",
+    )
     return parser
 
 
@@ -34,8 +109,9 @@ def main():
     main_parser = argparse.ArgumentParser()
     main_parser.add_argument(
         "pipeline",
-        choices=["era5", "floodscan", "imerg", "seas5"],
-        help="Pipeline to run",
+        choices=["era5", "floodscan", "imerg", "seas5", "coverage", "benchmark"],
+        help="Pipeline to run, `coverage` to check the coverage of pipelines, or "
+        "`benchmark` to compare COG encoding profiles",
     )
 
     args, remaining_args = main_parser.parse_known_args()
@@ -49,6 +125,10 @@ def main():
         run_imerg(base_parser)
     elif args.pipeline == "seas5":
         run_seas5(base_parser)
+    elif args.pipeline == "coverage":
+        run_coverage(base_parser)
+    elif args.pipeline == "benchmark":
+        run_benchmark(base_parser)
     else:
         raise ValueError(f"Unknown pipeline: {args.pipeline}")
 
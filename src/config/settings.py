@@ -10,6 +10,11 @@ SAS_TOKEN_PROD = os.getenv("DSCI_AZ_BLOB_PROD_SAS_WRITE")
 CONTAINER_RASTER = os.getenv("CONTAINER_RASTER")
 STORAGE_ACCOUNT_DEV = os.getenv("STORAGE_ACCOUNT_DEV")
 STORAGE_ACCOUNT_PROD = os.getenv("STORAGE_ACCOUNT_PROD")
+# Optional overrides of the storage account connection (eg. for Azurite)
+STORAGE_CONNECTION_STRING_DEV = os.getenv("STORAGE_CONNECTION_STRING_DEV")
+STORAGE_CONNECTION_STRING_PROD = os.getenv("STORAGE_CONNECTION_STRING_PROD")
+STORAGE_ENDPOINT_DEV = os.getenv("STORAGE_ENDPOINT_DEV")
+STORAGE_ENDPOINT_PROD = os.getenv("STORAGE_ENDPOINT_PROD")
 
 
 def load_pipeline_config(pipeline_name):
@@ -6,7 +6,8 @@ import xarray as xr
 from dateutil.relativedelta import relativedelta
 
 from ..utils import raster_utils
-from .pipeline import Pipeline
+from ..utils.grib_utils import iter_group_means
+from .pipeline import WRITE_WORKERS, Pipeline
 
 
 class ERA5Pipeline(Pipeline):
@@ -20,24 +21,50 @@ class ERA5Pipeline(Pipeline):
             metadata=kwargs["metadata"],
             coverage=kwargs["coverage"],
             use_cache=kwargs["use_cache"],
+            workers=kwargs.get("workers", 1),
+            stream=kwargs.get("stream", False),
+            prefetch=kwargs.get("prefetch", 2),
+            raw_cache_dir=kwargs.get("raw_cache_dir"),
+            raw_cache_size_gb=kwargs.get("raw_cache_size_gb", 50),
+            force=kwargs.get("force", False),
+            in_memory=kwargs.get("in_memory", False),
+            memory_threshold_mb=kwargs.get("memory_threshold_mb", 256),
+            download_concurrency=kwargs.get("download_concurrency", 8),
+            download_chunk_mb=kwargs.get("download_chunk_mb", 32),
+            cog_profile=kwargs.get("cog"),
+            sparse=kwargs.get("sparse", False),
+            write_workers=kwargs.get("write_workers", WRITE_WORKERS),
         )
         self.backfill = kwargs["backfill"]
         self.is_update = is_update
         self.start_year = start_year
         self.end_year = end_year
         self.client = cdsapi.Client()
+        # "cfgrib" opens whole GRIB files, "eccodes" streams their messages
+        self.grib_decoder = kwargs.get("grib_decoder", "cfgrib")
 
-    def _generate_raw_filename(self, year, month=None):
-        fname_suffix = f"{month:02d}" if month else "all"
+    def _generate_raw_filename(self, year, month=None, months=None):
+        months = self._request_months(month, months)
+        if months == list(range(1, 13)):
+            fname_suffix = "all"
+        else:
+            fname_suffix = "_".join(f"{m:02d}" for m in months)
         return f"tp_reanalysis_monthly_{year}_{fname_suffix}.grib"
 
+    @staticmethod
+    def _request_months(month=None, months=None):
+        """Months of a request: `month`, `months`, or all months of the year."""
+        if month:
+            return [month]
+        return sorted(months) if months else list(range(1, 13))
+
     def _generate_processed_filename(self, date):
         return f"precip_reanalysis_v{date}.tif"
 
-    def query_api(self, year, month=None):
-        filename = self._generate_raw_filename(year, month)
-        # Download all months in the year unless a month is provided
-        months = [f"{month:02d}"] if month else [f"{d:02d}" for d in range(1, 13)]
+    def query_api(self, year, month=None, months=None):
+        filename = self._generate_raw_filename(year, month, months)
+        # Download all months in the year unless a month or months are provided
+        months = [f"{m:02d}" for m in self._request_months(month, months)]
         data_request = {
             "data_format": "grib",
             "variable": "total_precipitation",
@@ -55,15 +82,22 @@ class ERA5Pipeline(Pipeline):
         return filename
 
     def process_data(self, raw_filename):
+        if self.grib_decoder == "eccodes":
+            return self.stream_data(raw_filename)
+
         raw_file_path = self.local_raw_dir / raw_filename
-        ds = xr.open_dataset(
-            raw_file_path,
-            engine="cfgrib",
-            drop_variables=["surface", "number"],
-            backend_kwargs=dict(
-                time_dims=("valid_time", "forecastMonth"), indexpath=("")
-            ),
-        )
+        with self.cfgrib_indexpath(raw_file_path) as indexpath:
+            # Lazy, so that the file is decoded once for all the months, see
+            # `save_processed_outputs`
+            ds = xr.open_dataset(
+                raw_file_path,
+                engine="cfgrib",
+                chunks={},
+                drop_variables=["surface", "number"],
+                backend_kwargs=dict(
+                    time_dims=("valid_time", "forecastMonth"), indexpath=indexpath
+                ),
+            )
         # Need to expand if there's only one valid_time value
         # ie. we've only gotten data from a single month
         try:
@@ -75,17 +109,65 @@ class ERA5Pipeline(Pipeline):
         pub_dates = ds.valid_time.values
         ds = ds.rename({"tp": "total precipitation", "latitude": "y", "longitude": "x"})
         ds = raster_utils.change_longitude_range(ds, "x")
+        ds = ds * 1000  # Convert from meters to mm
+        ds = ds.rio.write_crs("EPSG:4326", inplace=False)
 
+        outputs = []
         for date in pub_dates:
             date_valid = pd.Timestamp(date)
             self.metadata["year_valid"] = date_valid.year
             self.metadata["month_valid"] = date_valid.month
             ds_sel = ds.sel({"valid_time": date})
-            ds_sel = ds_sel * 1000  # Convert from meters to mm
-            ds_sel = ds_sel.rio.write_crs("EPSG:4326", inplace=False)
+            ds_sel.attrs = dict(self.metadata)
 
             filename = self._generate_processed_filename(date_valid.strftime("%Y-%m-%d"))
-            self.save_processed_data(ds_sel, filename)
+            outputs.append((ds_sel, filename, None))
+        self.save_processed_outputs(outputs)
+
+    def stream_data(self, raw_filename):
+        """
+        Process a GRIB file message by message with ecCodes, saving each
+        month as soon as it is read instead of opening the file whole.
+        """
+        raw_file_path = self.local_raw_dir / raw_filename
+        for (validity_date,), da in iter_group_means(raw_file_path, ("validityDate",)):
+            date_valid = pd.to_datetime(str(validity_date), format="%Y%m%d")
+            self.metadata["year_valid"] = date_valid.year
+            self.metadata["month_valid"] = date_valid.month
+            ds = (da * 1000).astype("float32")  # Convert from meters to mm
+            ds = ds.to_dataset(name="total precipitation")
+            ds = ds.rename({"latitude": "y", "longitude": "x"})
+            ds = raster_utils.change_longitude_range(ds, "x")
+            ds = ds.rio.write_crs("EPSG:4326", inplace=False)
+
+            filename = self._generate_processed_filename(date_valid.strftime("%Y-%m-%d"))
+            self.save_processed_data(ds, filename)
+
+    def _process_work_unit(self, raw_filename, unit):
+        self.process_data(raw_filename)
+
+    def _unit_outputs(self, unit):
+        months = self._request_months(unit.get("month"), unit.get("months"))
+        return [
+            self._generate_processed_filename(f"{unit['year']}-{month:02d}-01")
+            for month in months
+        ]
+
+    def _plan_backfill(self, missing_dates):
+        """
+        Work units to backfill `missing_dates`, with a single CDS request (and
+        raw file) per year for all the missing months of that year.
+        """
+        months_by_year = {}
+        for missing_date in missing_dates:
+            months_by_year.setdefault(missing_date.year, set()).add(missing_date.month)
+        units = []
+        for year, months in sorted(months_by_year.items()):
+            if len(months) == 1:
+                units.append({"year": year, "month": months.pop()})
+            else:
+                units.append({"year": year, "months": sorted(months)})
+        return units
 
     def run_pipeline(self):
         last_month = datetime.today() - relativedelta(months=1)
@@ -94,36 +176,42 @@ class ERA5Pipeline(Pipeline):
 
         self.logger.info(f"Running ERA5 pipeline in {self.mode} mode...")
 
+        if self.is_update:
+            units = [{"year": last_month_year, "month": last_month_month}]
+        else:
+            units = []
+            for year in range(self.start_year, self.end_year + 1):
+                if year == last_month_year:
+                    units += [
+                        {"year": year, "month": month}
+                        for month in range(1, last_month_month + 1)
+                    ]
+                else:
+                    units.append({"year": year})
+
         if self.backfill:
             self.logger.info("Checking for missing data and backfilling if needed...")
             missing_dates, coverage_pct = self.check_coverage()
             self.print_coverage_report()
-            if missing_dates:
-                for missing_date in missing_dates:
-                    self.logger.debug(f"Getting data for {missing_date}...")
-                    raw_filename = self.get_raw_data(
-                        year=missing_date.year, month=missing_date.month
-                    )
-                    self.process_data(raw_filename)
+            # Months processed below anyway aren't backfilled separately
+            covered = {
+                (unit["year"], month)
+                for unit in units
+                for month in self._request_months(unit.get("month"))
+            }
+            backfill_units = self._plan_backfill(
+                date for date in missing_dates if (date.year, date.month) not in covered
+            )
+            if backfill_units:
+                self.run_work_units(backfill_units)
 
         # Run for the latest available date
         if self.is_update:
             self.logger.info("Retrieving ERA5 data from last month...")
-            raw_filename = self.get_raw_data(
-                year=last_month_year, month=last_month_month
-            )
-            self.process_data(raw_filename)
-
         else:
             self.logger.info(
                 f"Retrieving ERA5 data from {self.start_year} to {self.end_year}..."
             )
-            for year in range(self.start_year, self.end_year + 1):
-                if year == last_month_year:
-                    for month in range(1, last_month_month + 1):
-                        raw_filename = self.get_raw_data(year=year, month=month)
-                        self.process_data(raw_filename)
-                else:
-                    raw_filename = self.get_raw_data(year=year)
-                    self.process_data(raw_filename)
+        self.run_work_units(units)
+        self.finish_run()
         self.logger.info("Completed ERA5 update.")
@@ -1,25 +1,42 @@
+import itertools
+import json
 import os
-import re
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pathlib import Path
 from zipfile import ZipFile
 
 import pandas as pd
 import requests
 import rioxarray as rxr
 import xarray as xr
+from numcodecs import Blosc
+from rasterio.io import MemoryFile
 
-from ..utils.azure_utils import blob_client, download_from_azure
+from ..utils import coverage_utils
+from ..utils.azure_utils import blob_filesystem, download_from_azure
+from ..utils.baseline_utils import DayOfYearAccumulator, ordered_bounded_map
 from ..utils.date_utils import (
     DATE_FORMAT,
     create_date_range,
     get_datetime_from_filename,
+    greedy_window_cover,
 )
 from ..utils.raster_utils import invert_lat_lon
-from .pipeline import Pipeline
+from ..utils.zip_utils import RemoteZip
+from .pipeline import WRITE_WORKERS, Pipeline
 
 SFED = "SFED"
 MFED = "MFED"
+# Number of days in each zip of recent data, named after its last day
+ZIP_WINDOW_DAYS = 90
+ZIP_DOWNLOAD_WORKERS = 4
+# Number of daily grids fetched concurrently for the baseline
+BASELINE_FETCH_WORKERS = 8
+# Raw folder of the per-year baseline sums, see `_baseline_sums_for_year`
+BASELINE_SUMS_FOLDER = "baseline_sums"
 
 
 class FloodScanPipeline(Pipeline):
@@ -37,6 +54,19 @@ class FloodScanPipeline(Pipeline):
             metadata=kwargs["metadata"],
             coverage=kwargs["coverage"],
             use_cache=kwargs["use_cache"],
+            workers=kwargs.get("workers", 1),
+            stream=kwargs.get("stream", False),
+            prefetch=kwargs.get("prefetch", 2),
+            raw_cache_dir=kwargs.get("raw_cache_dir"),
+            raw_cache_size_gb=kwargs.get("raw_cache_size_gb", 50),
+            force=kwargs.get("force", False),
+            in_memory=kwargs.get("in_memory", False),
+            memory_threshold_mb=kwargs.get("memory_threshold_mb", 256),
+            download_concurrency=kwargs.get("download_concurrency", 8),
+            download_chunk_mb=kwargs.get("download_chunk_mb", 32),
+            cog_profile=kwargs.get("cog"),
+            sparse=kwargs.get("sparse", False),
+            write_workers=kwargs.get("write_workers", WRITE_WORKERS),
         )
 
         self.start_date = datetime.strptime(kwargs["start_date"], DATE_FORMAT)
@@ -44,9 +74,26 @@ class FloodScanPipeline(Pipeline):
         self.is_update = kwargs["is_update"]
         self.backfill = kwargs["backfill"]
         self.baseline_update = kwargs["baseline_update"]
+        # Reuse persisted per-year baseline sums instead of recomputing them
+        self.baseline_incremental = kwargs.get("baseline_incremental", False)
         self.version = kwargs["version"]
         self.sfed_historical = kwargs["sfed_historical"]
         self.mfed_historical = kwargs["mfed_historical"]
+        self.historical_zarr = kwargs.get("historical_zarr")
+        # Read members of the 90-day zips in blob storage with range requests
+        # instead of downloading the zips, see `get_historical_90days_zipped_files`
+        self.range_read = kwargs.get("range_read", False)
+        # Lazy handles of the historical NetCDFs, see `_open_historical_data`
+        self._historical_data = {}
+        # Indexes of the 90-day zips and identities of the GeoTIFFs read from
+        # them, see `_zip_members` and `_zip_member_path`
+        self._zip_indexes = {}
+        self._zip_member_identities = {}
+        # In-memory GeoTIFFs read from remote zips, by `/vsimem/` path
+        self._member_files = {}
+        # Latest 90-day zips fetched from AER, see `_fetch_latest_archives`
+        self._latest_archives = None
+        self._archives_lock = threading.Lock()
         self.sfed_base_url = os.getenv("FLOODSCAN_SFED_URL")
         self.mfed_base_url = os.getenv("FLOODSCAN_MFED_URL")
 
@@ -59,25 +106,71 @@ class FloodScanPipeline(Pipeline):
     def _generate_baseline_filename(self, date):
         return f"baseline_v{date.strftime(DATE_FORMAT)}_v0{self.version}r01.nc4"
 
+    def _generate_baseline_sums_filename(self, year):
+        return f"baseline_sums_{year}_v0{self.version}r01.nc4"
+
     def get_geotiff_from_daily_90_days_file(self, filepath, date):
-        with ZipFile(filepath, "r") as zipobj:
-            filenames = zipobj.namelist()
-            latest_date = get_datetime_from_filename(max(filenames))
-            for file in filenames:
-                if file.endswith(".tif"):
-                    file_date = get_datetime_from_filename(file).date()
-                    if file_date == date:
-                        try:
-                            full_path = zipobj.extract(file, os.path.dirname(filepath))
-                            tif_filename = os.path.basename(
-                                shutil.move(full_path, os.path.dirname(filepath))
-                            )
-                            return tif_filename, latest_date
-                        except Exception as e:
-                            self.logger.info(f"Failed to extract {file}: {e}")
-                        break
-            self.logger.warning(f"Geotiff from {date} not present")
-            return None, latest_date
+        """
+        Find the GeoTIFF of `date` in a 90-day zip, without extracting it.
+
+        Returns:
+            (tuple): The `ZipInfo` of the GeoTIFF (None if the zip doesn't
+            have `date`) and the latest date in the zip
+        """
+        members = self._zip_members(filepath)
+        latest_date = max(members)
+        for file_date, info in members.items():
+            if file_date.date() == date:
+                return info, latest_date
+        self.logger.info(f"No data for {date} in {filepath}")
+        return None, latest_date
+
+    def _zip_members(self, filepath):
+        """
+        Index of the daily GeoTIFFs in a 90-day zip by date, read from its
+        central directory once per run. `filepath` is a local path or a
+        `RemoteZip`.
+        """
+        if isinstance(filepath, RemoteZip):
+            key = (filepath.path,)
+            infos = filepath.members.values()
+        else:
+            stat = os.stat(filepath)
+            key = (str(filepath), stat.st_size, stat.st_mtime_ns)
+            infos = None
+        if key not in self._zip_indexes:
+            if infos is None:
+                with ZipFile(filepath, "r") as zipobj:
+                    infos = zipobj.infolist()
+            self._zip_indexes[key] = {
+                get_datetime_from_filename(info.filename): info
+                for info in infos
+                if info.filename.endswith(".tif")
+            }
+        return self._zip_indexes[key]
+
+    def _zip_member_path(self, filepath, info):
+        """
+        GDAL `/vsizip/` path of a GeoTIFF in a zip, so that it can be read in
+        place. The member's CRC and size identify it when fingerprinting.
+
+        Members of a `RemoteZip` are fetched with range requests and kept in
+        a `/vsimem/` file until `_release_zip_members`.
+        """
+        if isinstance(filepath, RemoteZip):
+            memfile = MemoryFile(filepath.read(info.filename), ext=".tif")
+            path = memfile.name
+            self._member_files[path] = memfile
+        else:
+            path = f"/vsizip/{Path(filepath).resolve()}/{info.filename}"
+        self._zip_member_identities[path] = f"{info.CRC:08x}-{info.file_size}"
+        return path
+
+    def _release_zip_members(self, paths):
+        for path in paths:
+            memfile = self._member_files.pop(path, None)
+            if memfile is not None:
+                memfile.close()
 
     def get_historical_nc_files(self):
         sfed_local_file_path = self.local_raw_dir / self.sfed_historical
@@ -88,14 +181,10 @@ class FloodScanPipeline(Pipeline):
 
         # Download historical netcdf files for 1998-2023
         try:
-            if download_from_azure(
-                blob_service_client=self.blob_service_client,
-                container_name=self.container_name,
+            if self._download_raw(
                 blob_path=self.raw_path / self.sfed_historical,
                 local_file_path=sfed_local_file_path,
-            ) and download_from_azure(
-                blob_service_client=self.blob_service_client,
-                container_name=self.container_name,
+            ) and self._download_raw(
                 blob_path=self.raw_path / self.mfed_historical,
                 local_file_path=mfed_local_file_path,
             ):
@@ -107,14 +196,15 @@ class FloodScanPipeline(Pipeline):
         return None
 
     def _get_90_days_filenames_for_dates(self, dates):
-        filenames = []
-
+        """
+        Choose the 90-day zips to download for `dates`. Each zip is named
+        after the last of the 90 days it covers, and a small set of zips that
+        covers all dates is chosen with greedy set cover.
+        """
         if self.mode != "local":
             existing_files = [
                 x.name
-                for x in blob_client(self.mode)
-                .get_container_client(self.container_name)
-                .list_blobs(
+                for x in self.container_client.list_blobs(
                     name_starts_with=self.raw_path.as_posix() + "/aer_floodscan"
                 )
             ]
@@ -122,161 +212,245 @@ class FloodScanPipeline(Pipeline):
         else:
             existing_files = os.listdir(self.local_raw_dir)
 
-        for existing_filename in existing_files:
-            date_from_file = get_datetime_from_filename(existing_filename)
-            if date_from_file in dates:
-                filenames.append(
-                    {
-                        SFED: self._generate_raw_filename(date_from_file, SFED),
-                        MFED: self._generate_raw_filename(date_from_file, MFED),
-                    }
-                )
-
-        if not filenames:
-            existing_filename = existing_files[0]
-            date_from_file = get_datetime_from_filename(existing_filename)
-            filenames.append(
-                {
-                    SFED: self._generate_raw_filename(date_from_file, SFED),
-                    MFED: self._generate_raw_filename(date_from_file, MFED),
-                }
+        # Index the zips available for both bands by the last date they cover
+        names = {os.path.basename(filename) for filename in existing_files}
+        window_ends = [
+            date
+            for date in {
+                get_datetime_from_filename(name)
+                for name in names
+                if name.endswith(".zip")
+            }
+            if self._generate_raw_filename(date, SFED) in names
+            and self._generate_raw_filename(date, MFED) in names
+        ]
+
+        chosen, uncovered = greedy_window_cover(dates, window_ends, ZIP_WINDOW_DAYS)
+        if uncovered:
+            self.logger.warning(
+                f"No 90-day zip covers {len(uncovered)} dates, from "
+                f"{uncovered[0].date()} to {uncovered[-1].date()}"
             )
+        self.logger.info(f"{len(chosen)} 90-day zips cover {len(dates)} dates")
 
-        return filenames
+        return [
+            {
+                SFED: self._generate_raw_filename(date, SFED),
+                MFED: self._generate_raw_filename(date, MFED),
+            }
+            for date in chosen
+        ]
 
     def get_historical_90days_zipped_files(self, dates):
         filename_list = self._get_90_days_filenames_for_dates(dates=dates)
-        zipped_files_path = []
-
-        for zipped_filename in filename_list:
-            sfed_filename = zipped_filename[SFED]
-            mfed_filename = zipped_filename[MFED]
-            sfed_local_file_path = self.local_raw_dir / sfed_filename
-            mfed_local_file_path = self.local_raw_dir / mfed_filename
-
-            if self.mode != "local":
+        zipped_files_path = [
+            {band: self.local_raw_dir / filenames[band] for band in (SFED, MFED)}
+            for filenames in filename_list
+        ]
+
+        if self.mode != "local" and self.range_read:
+            # Only the central directories and the needed members are fetched
+            fs = blob_filesystem(self.mode)
+            remote = []
+            for filenames in filename_list:
                 try:
-                    download_from_azure(
-                        blob_service_client=self.blob_service_client,
-                        container_name=self.container_name,
-                        blob_path=self.raw_path / sfed_filename,
-                        local_file_path=sfed_local_file_path,
-                    )
-                    download_from_azure(
-                        blob_service_client=self.blob_service_client,
-                        container_name=self.container_name,
-                        blob_path=self.raw_path / mfed_filename,
-                        local_file_path=mfed_local_file_path,
+                    remote.append(
+                        {
+                            band: RemoteZip(
+                                fs,
+                                f"{self.container_name}/{self.raw_path / filenames[band]}",
+                            )
+                            for band in (SFED, MFED)
+                        }
                     )
+                except Exception as err:
+                    self.logger.error(f"Failed reading {filenames}: {err}")
+            zipped_files_path = remote
 
-                    zipped_files_path.append(
-                        {SFED: sfed_local_file_path, MFED: mfed_local_file_path}
-                    )
+        elif self.mode != "local":
+
+            def download(filename):
+                if not self._download_raw(
+                    blob_path=self.raw_path / filename,
+                    local_file_path=self.local_raw_dir / filename,
+                ):
+                    raise FileNotFoundError(f"Failed downloading {filename}")
+
+            # The zips are independent, so download them all at once
+            with ThreadPoolExecutor(max_workers=ZIP_DOWNLOAD_WORKERS) as executor:
+                futures = [
+                    [
+                        executor.submit(download, filenames[band])
+                        for band in (SFED, MFED)
+                    ]
+                    for filenames in filename_list
+                ]
+            downloaded = []
+            for paths, pair in zip(zipped_files_path, futures):
+                try:
+                    for future in pair:
+                        future.result()
+                    downloaded.append(paths)
                 except Exception as err:
                     self.logger.error(f"Failed downloading: {err}")
-            else:
-                zipped_files_path.append(
-                    {SFED: sfed_local_file_path, MFED: mfed_local_file_path}
-                )
+            zipped_files_path = downloaded
 
         return zipped_files_path
 
-    def _unzip_90days_file(self, file_to_unzip, dates):
-        unzipped_files = []
-        try:
-            with ZipFile(file_to_unzip, "r") as zipobj:
-                for filename in zipobj.namelist():
-                    if os.path.basename(filename):
-                        date = get_datetime_from_filename(filename)
-                        if date in dates:
-                            date_str = re.search("([0-9]{4}[0-9]{2}[0-9]{2})", filename)
-                            new_filename = os.path.basename(
-                                filename.replace(
-                                    date_str[0], date.strftime(DATE_FORMAT)
-                                )
-                            )
-                            try:
-                                full_path = zipobj.extract(filename, self.local_raw_dir)
-                                new_full_path = os.path.join(
-                                    os.path.dirname(full_path), new_filename
-                                )
-                                os.rename(full_path, new_full_path)
-                                unzipped_files.append(
-                                    os.path.basename(
-                                        shutil.move(new_full_path, self.local_raw_dir)
-                                    )
-                                )
-                            except FileExistsError:
-                                self.logger.warning(
-                                    f"File already exists: {new_filename}"
-                                )
-                            except Exception as e:
-                                self.logger.error(f"Failed to extract: {e}")
-
-            return unzipped_files
-        except Exception as e:
-            self.logger.error(f"Failed to extract: {e}")
+    def _open_historical_data(self, source, band_type):
+        """
+        Open a band of the historical archive lazily, once per process.
+
+        `source` is either a historical NetCDF, opened with dask chunks of one
+        day and with its time axis decoded once, or the name of the Zarr
+        mirror of the archive (see `convert_historical_to_zarr`). Either way,
+        each date is a cheap slice of the same handle. Handles are keyed by
+        process, as forked workers can't share the parent's open files.
+        """
+        key = (os.getpid(), str(source), band_type)
+        if key not in self._historical_data:
+            if str(source) == self.historical_zarr:
+                da = self._open_historical_zarr()[band_type]
+            else:
+                ds = xr.open_dataset(source, chunks={"time": 1, "lat": -1, "lon": -1})
+                ds = ds.transpose("time", "lat", "lon")
+                if not ds["time"].dtype == "<M8[ns]":
+                    ds["time"] = pd.to_datetime(
+                        ds.indexes["time"].strftime(DATE_FORMAT), format=DATE_FORMAT
+                    ).as_unit("ns")
+                da = ds[band_type + "_AREA"].rename(band_type)
+                da = invert_lat_lon(da.rename({"lon": "x", "lat": "y"}))
+            self._historical_data[key] = da
+        return self._historical_data[key]
+
+    def _historical_zarr_store(self):
+        """Location of the Zarr mirror: a local path, or an fsspec mapper."""
+        if self.mode == "local":
+            return self.local_raw_dir / self.historical_zarr
+        return blob_filesystem(self.mode).get_mapper(
+            f"{self.container_name}/{(self.raw_path / self.historical_zarr).as_posix()}"
+        )
+
+    def _open_historical_zarr(self):
+        return xr.open_zarr(self._historical_zarr_store(), consolidated=True)
+
+    def historical_zarr_exists(self):
+        if not self.historical_zarr:
+            return False
+        store = self._historical_zarr_store()
+        if self.mode == "local":
+            return (store / ".zmetadata").exists()
+        return ".zmetadata" in store
+
+    def convert_historical_to_zarr(self):
+        """
+        Convert the historical SFED and MFED NetCDFs into a single Zarr store
+        under the raw path, with one compressed chunk per day and consolidated
+        metadata, so that single dates can be read without downloading the
+        whole archive.
+
+        The store records the identity of the NetCDFs it was converted from,
+        so outputs processed from it keep the same fingerprint.
+        """
+        self.logger.info(f"Converting the historical archive to {self.historical_zarr}")
+        sfed_path, mfed_path = self.get_historical_nc_files()
+        self._set_raw_inputs((sfed_path, mfed_path))
+
+        ds = xr.merge(
+            [
+                self._open_historical_data(sfed_path, SFED),
+                self._open_historical_data(mfed_path, MFED),
+            ]
+        ).chunk({"time": 1, "y": -1, "x": -1})
+        compressor = Blosc(cname="zstd", clevel=5, shuffle=Blosc.BITSHUFFLE)
+        for band in ds.data_vars:
+            ds[band].encoding = {"compressor": compressor}
+        ds.attrs = {"source_identity": json.dumps(self._raw_identity)}
+
+        ds.to_zarr(self._historical_zarr_store(), mode="w", consolidated=True)
+        self.logger.info(f"Converted {ds.sizes['time']} days to {self.historical_zarr}")
+
+    def _set_raw_inputs(self, raw_data):
+        if raw_data == (self.historical_zarr, self.historical_zarr):
+            # Outputs keep the identity of the NetCDFs the mirror was made from
+            source_identity = self._open_historical_zarr().attrs.get("source_identity")
+            self._raw_identity = (
+                json.loads(source_identity) if source_identity else None
+            )
+            return
+        if isinstance(raw_data, tuple) and all(
+            item in self._zip_member_identities for item in raw_data
+        ):
+            self._raw_identity = [
+                self._zip_member_identities[item] for item in raw_data
+            ]
+            return
+        super()._set_raw_inputs(raw_data)
 
     def process_historical_data(self, filepath, date, band_type):
         self.logger.info(f"Processing historical {band_type} data from {date}")
 
-        with xr.open_dataset(filepath) as ds:
-            ds = ds.transpose("time", "lat", "lon")
-            if not ds["time"].dtype == "<M8[ns]":
-                ds["time"] = pd.to_datetime(
-                    [pd.Timestamp(t.strftime(DATE_FORMAT)) for t in ds["time"].values]
-                )
+        da = self._open_historical_data(filepath, band_type)
+        da = da.sel({"time": date}).squeeze(drop=True)
 
-            ds_sel = ds.sel({"time": date})
-            ds_sel = ds_sel.rename({band_type + "_AREA": band_type})
-            da = ds_sel[band_type]
-            da = da.rename({"lon": "x", "lat": "y"}).squeeze(drop=True)
+        self.metadata["date_valid"] = date.day
+        self.metadata["year_valid"] = date.year
+        self.metadata["month_valid"] = date.month
 
-            self.metadata["date_valid"] = date.day
-            self.metadata["year_valid"] = date.year
-            self.metadata["month_valid"] = date.month
-
-            da.attrs = self.metadata
-            da = invert_lat_lon(da)
-            da = da.rio.write_crs("EPSG:4326", inplace=False)
+        da.attrs = dict(self.metadata)
+        da = da.rio.write_crs("EPSG:4326", inplace=False)
 
         return da
 
     def process_historical_zipped_data(self, zipped_filepaths, dates):
-        unzipped_sfed = []
-        unzipped_mfed = []
+        remaining = set(dates)
 
         for filepath in zipped_filepaths:
-            self.logger.info(
-                f"Unzipping data from from {filepath[SFED]} and {filepath[MFED]} to {self.local_raw_dir}"
-            )
+            self.logger.info(f"Reading data from {filepath[SFED]} and {filepath[MFED]}")
 
             try:
-                unzipped_sfed += self._unzip_90days_file(filepath[SFED], dates)
-                unzipped_mfed += self._unzip_90days_file(filepath[MFED], dates)
-
-                if len(dates) == len(unzipped_sfed):
-                    break
+                sfed_members = self._zip_members(filepath[SFED])
+                mfed_members = self._zip_members(filepath[MFED])
             except Exception as err:
                 self.logger.error(
-                    f"Failed to extract {filepath[SFED]} or {filepath[MFED]}: {err}"
+                    f"Failed to read {filepath[SFED]} or {filepath[MFED]}: {err}"
                 )
+                continue
+
+            # All the dates of a zip are saved in a single pass
+            zip_dates = sorted(remaining & sfed_members.keys() & mfed_members.keys())
+            members = [
+                (
+                    self._zip_member_path(filepath[SFED], sfed_members[date]),
+                    self._zip_member_path(filepath[MFED], mfed_members[date]),
+                )
+                for date in zip_dates
+            ]
+            self.logger.info(f"Processing historical data from {len(zip_dates)} dates")
+            try:
+                self.combine_bands(
+                    [
+                        self._read_zip_bands(sfed, mfed, date)
+                        for date, (sfed, mfed) in zip(zip_dates, members)
+                    ]
+                )
+            except Exception as err:
+                # The other zips still run, and `finish_run` fails the run
+                self._failed_units.append(
+                    {"unit": {"dates": zip_dates}, "success": False, "error": str(err)}
+                )
+            finally:
+                self._release_zip_members([path for pair in members for path in pair])
+            remaining.difference_update(zip_dates)
 
-        unzipped_files = list(zip(unzipped_sfed, unzipped_mfed))
-
-        for file in unzipped_files:
-            date = get_datetime_from_filename(file[0])
-            self.logger.info(f"Processing historical {SFED} data from {date}")
-            sfed_da = self.process_data(file[0], band_type=SFED)
-
-            self.logger.info(f"Processing historical {MFED} data from {date}")
-            mfed_da = self.process_data(file[1], band_type=MFED)
-            self.combine_bands(sfed_da, mfed_da, date=date)
+            if not remaining:
+                break
 
+        self.flush_manifest()
         self._cleanup_local()
 
     def _cleanup_local(self):
-        """Cleans up everything in the local directory that isn't a 90-day zip or a historical .nc file"""
+        """Cleans up everything in the local directory that isn't a 90-day zip or a historical .nc file or Zarr store"""
         if self.mode == "local":
             for file in os.listdir(self.local_raw_dir):
                 file_path = self.local_raw_dir / file
@@ -286,7 +460,7 @@ class FloodScanPipeline(Pipeline):
                     os.remove(file_path)
             for item in os.listdir(self.local_raw_dir):
                 item_path = self.local_raw_dir / item
-                if item_path.is_dir():
+                if item_path.is_dir() and item != self.historical_zarr:
                     shutil.rmtree(item_path)
 
     def _update_name_if_necessary(self, raw_filename, band_type, latest_date):
@@ -298,61 +472,90 @@ class FloodScanPipeline(Pipeline):
             os.rename(raw_filename, new_filename)
             return new_filename
         else:
-            return self.local_raw_dir / raw_filename
+            return raw_filename
 
-    def query_api(self, date):
-        yesterday = datetime.today() - pd.DateOffset(days=1)
-        sfed_raw_filename = self._generate_raw_filename(yesterday, SFED)
-        mfed_raw_filename = self._generate_raw_filename(yesterday, MFED)
+    def _fetch_latest_archives(self):
+        """
+        Download the latest 90-day zips of both bands from AER, name them
+        after the last day they cover and save them to the raw path.
 
-        try:
-            sfed_result = requests.get(self.sfed_base_url)
-            mfed_result = requests.get(self.mfed_base_url)
-            sfed_result.raise_for_status()
-            mfed_result.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            self.logger.error(f"Failed downloading: {err}")
-            return None
+        The zips are memoised for the run, so that all dates in their window
+        (eg. when backfilling) come from a single download and upload.
 
-        sfed_filepath = self.local_raw_dir / sfed_raw_filename
-        with open(sfed_filepath, "wb") as sfed:
-            sfed.write(sfed_result.content)
+        Returns:
+            (dict): Local paths of the zips by band, or None if the download
+            failed
+        """
+        with self._archives_lock:
+            if self._latest_archives is not None:
+                return self._latest_archives
 
-        mfed_filepath = self.local_raw_dir / mfed_raw_filename
-        with open(mfed_filepath, "wb") as mfed:
-            mfed.write(mfed_result.content)
+            yesterday = datetime.today() - pd.DateOffset(days=1)
+            try:
+                sfed_result = requests.get(self.sfed_base_url)
+                mfed_result = requests.get(self.mfed_base_url)
+                sfed_result.raise_for_status()
+                mfed_result.raise_for_status()
+            except requests.exceptions.HTTPError as err:
+                self.logger.error(f"Failed downloading: {err}")
+                return None
+
+            archives = {}
+            for band_type, result in ((SFED, sfed_result), (MFED, mfed_result)):
+                filepath = self.local_raw_dir / self._generate_raw_filename(
+                    yesterday, band_type
+                )
+                with open(filepath, "wb") as f:
+                    f.write(result.content)
+                latest_date = max(self._zip_members(filepath))
+                archives[band_type] = self._update_name_if_necessary(
+                    filepath, band_type, latest_date
+                )
 
-        sfed_unzipped, sfed_latest_date = self.get_geotiff_from_daily_90_days_file(
-            sfed_filepath, date
-        )
-        mfed_unzipped, mfed_latest_date = self.get_geotiff_from_daily_90_days_file(
-            mfed_filepath, date
-        )
+            # Saving the latest zipped files for SFED and MFED
+            self.save_raw_data(os.path.basename(archives[SFED]))
+            self.save_raw_data(os.path.basename(archives[MFED]))
+
+            self._latest_archives = archives
+            return archives
 
-        if not sfed_unzipped or not mfed_unzipped:
+    def _latest_archive_dates(self):
+        """Dates that both of the latest 90-day zips have, see `_fetch_latest_archives`"""
+        archives = self._fetch_latest_archives()
+        if not archives:
+            return set()
+        sfed_dates = self._zip_members(archives[SFED]).keys()
+        mfed_dates = self._zip_members(archives[MFED]).keys()
+        return {pd.Timestamp(date) for date in sfed_dates & mfed_dates}
+
+    def query_api(self, date):
+        archives = self._fetch_latest_archives()
+        if not archives:
             return None, None
 
-        sfed_raw_path = self._update_name_if_necessary(
-            sfed_filepath, SFED, sfed_latest_date
-        )
-        mfed_raw_path = self._update_name_if_necessary(
-            mfed_filepath, MFED, mfed_latest_date
-        )
+        sfed_member, _ = self.get_geotiff_from_daily_90_days_file(archives[SFED], date)
+        mfed_member, _ = self.get_geotiff_from_daily_90_days_file(archives[MFED], date)
 
-        # Saving the latest zipped files for SFED and MFED
-        self.save_raw_data(os.path.basename(sfed_raw_path))
-        self.save_raw_data(os.path.basename(mfed_raw_path))
+        if not sfed_member or not mfed_member:
+            return None, None
 
-        return sfed_unzipped, mfed_unzipped
+        # The GeoTIFFs are read in place from the zips
+        return (
+            self._zip_member_path(archives[SFED], sfed_member),
+            self._zip_member_path(archives[MFED], mfed_member),
+        )
 
     def process_data(self, filename, band_type, date=None):
         if not date:
             # Infer date from filename:
             date = get_datetime_from_filename(filename)
 
-        raw_file_path = self.local_raw_dir / filename
+        if str(filename).startswith(("/vsizip/", "/vsimem/")):
+            raw_file_path = filename
+        else:
+            raw_file_path = self.local_raw_dir / filename
 
-        with xr.open_dataset(raw_file_path) as ds:
+        with xr.open_dataset(raw_file_path, engine="rasterio") as ds:
             ds = ds.transpose("band", "y", "x")
             ds_sel = ds.sel({"band": 1}, drop=True)
             ds_sel = ds_sel.rename({"band_data": band_type})
@@ -360,56 +563,246 @@ class FloodScanPipeline(Pipeline):
             self.metadata["date_valid"] = date.day
             self.metadata["year_valid"] = date.year
             self.metadata["month_valid"] = date.month
-            da.attrs = self.metadata
+            da.attrs = dict(self.metadata)
             da = invert_lat_lon(da)
             da = da.rio.write_crs("EPSG:4326", inplace=False)
 
             return da
 
-    def combine_bands(self, sfed, mfed, date):
-        if sfed is not None and mfed is not None:
-            try:
-                da = xr.merge([sfed, mfed])
-                self.save_processed_data(da, self._generate_processed_filename(date))
-                self.logger.info(f"Successfully combined SFED and MFED for: {date}")
-            except Exception as err:
-                self.logger.error(
-                    f"Failed when combining sfed and mfed geotiffs. {err}"
-                )
+    def _read_zip_bands(self, sfed, mfed, date):
+        """Bands of `date` read from the members of 90-day zips, see `combine_bands`"""
+        sfed_da = self.process_data(sfed, band_type=SFED, date=date)
+        mfed_da = self.process_data(mfed, band_type=MFED, date=date)
+        self._set_raw_inputs((sfed, mfed))
+        return sfed_da, mfed_da, date, self._raw_identity
+
+    def combine_bands(self, bands):
+        """
+        Merge the SFED and MFED bands of each date into its processed COG.
+
+        The COGs of all dates are evaluated and written together (see
+        `save_processed_outputs`), so all the dates of a raw input (a 90-day
+        zip or a chunk of the historical archive) are passed at once.
+
+        Args:
+            bands (list): (SFED, MFED, date, raw identity) of each date
+        """
+        outputs = [
+            (
+                xr.merge([sfed, mfed]),
+                self._generate_processed_filename(date),
+                None,
+                raw_identity,
+            )
+            for sfed, mfed, date, raw_identity in bands
+            if sfed is not None and mfed is not None
+        ]
+        dates = ", ".join(f"{date:%Y-%m-%d}" for _, _, date, _ in bands)
+        try:
+            self.save_processed_outputs(outputs)
+        except Exception as err:
+            self.logger.error(
+                f"Failed when combining sfed and mfed geotiffs for: {dates}. {err}"
+            )
+            raise
+        self.logger.info(f"Successfully combined SFED and MFED for: {dates}")
 
     def _retrieve_datarray_for_date(self, date, sfed_filename, sfed_local_file_path):
+        """
+        Load the SFED band of the processed COG of `date`.
+
+        Returns:
+            (xarray.DataArray): SFED grid, or None if it couldn't be downloaded
+        """
         if self.mode == "local":
             if sfed_local_file_path.exists():
                 self.logger.info(f"Using cached raw data: {sfed_local_file_path}")
-                da_in = rxr.open_rasterio(sfed_local_file_path, chunks="auto")
+                sfed_file = sfed_local_file_path
             else:
                 raise FileNotFoundError(
                     f"No SFED file locally at {sfed_local_file_path}"
                 )
         else:
-            try:
-                sfed_file = download_from_azure(
-                    blob_service_client=self.blob_service_client,
-                    container_name=self.container_name,
-                    blob_path=self.processed_path / sfed_filename,
-                    local_file_path=sfed_local_file_path,
-                )
-                da_in = rxr.open_rasterio(sfed_file, chunks="auto")
-            except Exception as err:
-                self.logger.info(f"Failed to download SFED file for date {date}: {err}")
-        da_in["date"] = date
-        da_in = da_in.expand_dims(["date"])
-        da_in = da_in.persist()
+            sfed_file = download_from_azure(
+                blob_service_client=self.blob_service_client,
+                container_name=self.container_name,
+                blob_path=self.processed_path / sfed_filename,
+                local_file_path=sfed_local_file_path,
+                max_concurrency=self.download_concurrency,
+                chunk_size=self.download_chunk_size,
+                partial_dir=self.partial_dir,
+            )
+            if sfed_file is None:
+                self.logger.info(f"Failed to download SFED file for date {date}")
+                return None
+
+        with rxr.open_rasterio(sfed_file) as da_in:
+            da_in = da_in.sel({"band": 1}, drop=True).load()
+        if self.mode != "local":
+            # Only the running sums are kept, not the daily files
+            Path(sfed_file).unlink(missing_ok=True)
         return da_in
 
-    def _calculate_baseline(self, date, merged_ds):
-        merged_ds = merged_ds.rolling(date=11, center=True).mean()
-        merged_ds = merged_ds.groupby("date.dayofyear").mean("date")
+    def _retrieve_baseline_grid(self, date, historical=None):
+        """SFED grid of `date`, from the Zarr mirror if it has it or its COG otherwise"""
+        if historical is not None and date in historical.indexes["time"]:
+            return historical.sel(time=date).drop_vars("time").load()
+        sfed_filename = self._generate_processed_filename(date)
+        return self._retrieve_datarray_for_date(
+            date, sfed_filename, self.local_processed_dir / sfed_filename
+        )
+
+    def _accumulate_baseline(self, dates):
+        """
+        Fold the SFED grids of `dates` into per-day-of-year sums and counts.
+
+        Grids are fetched `BASELINE_FETCH_WORKERS` at a time and folded in
+        date order, so only a few are in memory at once.
+        """
+        historical = None
+        if self.historical_zarr_exists():
+            historical = self._open_historical_data(self.historical_zarr, SFED)
+
+        accumulator = DayOfYearAccumulator()
+        grids = ordered_bounded_map(
+            lambda date: self._retrieve_baseline_grid(date, historical),
+            dates,
+            max_workers=BASELINE_FETCH_WORKERS,
+        )
+        for date, da in zip(dates, grids):
+            if da is None:
+                continue
+            if da.any():
+                accumulator.add(da, date)
+            else:
+                accumulator.cover(date)
+        return accumulator
+
+    def _load_baseline_sums(self, filename):
+        local_path = self.local_raw_dir / filename
+        if self.mode != "local":
+            self.get_raw_data_from_blob(filename, folder=BASELINE_SUMS_FOLDER)
+        if not local_path.exists():
+            return None
+        with xr.open_dataset(local_path, mask_and_scale=False) as ds:
+            return DayOfYearAccumulator.from_dataset(ds.load())
+
+    def _baseline_sums_for_year(self, year):
+        """
+        Per-day-of-year sums and counts of the SFED grids of one year.
+
+        The sums of each year are persisted next to the baseline, so that in
+        incremental mode only the years that aren't persisted yet (usually the
+        one entering the window) are read from the daily grids. Sums that
+        don't cover the whole year (eg. persisted while the year was ongoing)
+        are recomputed.
+        """
+        filename = self._generate_baseline_sums_filename(year)
+        if self.baseline_incremental:
+            accumulator = self._load_baseline_sums(filename)
+            if accumulator is not None:
+                if (
+                    accumulator.last_date is not None
+                    and accumulator.last_date >= datetime(year, 12, 31)
+                ):
+                    self.logger.info(f"Reusing baseline sums of {year}")
+                    return accumulator
+                self.logger.info(
+                    f"Baseline sums of {year} are incomplete (last date: "
+                    f"{accumulator.last_date}), recomputing them"
+                )
+
+        self.logger.info(f"Accumulating baseline sums of {year}...")
+        dates = create_date_range(datetime(year, 1, 1), datetime(year, 12, 31))
+        accumulator = self._accumulate_baseline(dates)
+        if accumulator.template is None:
+            self.logger.warning(f"No SFED data found for {year}")
+            return accumulator
+
+        accumulator.to_dataset().to_netcdf(
+            self.local_raw_dir / filename, format="NETCDF4"
+        )
+        self.save_raw_data(filename, folder=BASELINE_SUMS_FOLDER)
+        return accumulator
+
+    def _baseline_window_sums(self, year):
+        """Sums and counts of the 10 years before `year`"""
+        # Yearly sums are always added in the same order, so incremental and
+        # full runs give the same baseline bit for bit
+        accumulator = DayOfYearAccumulator()
+        for window_year in range(year - 10, year):
+            accumulator.merge(self._baseline_sums_for_year(window_year))
+        return accumulator
+
+    def _calculate_baseline(self, date, accumulator):
+        baseline = accumulator.baseline()
         filename = self._generate_baseline_filename(date)
         local_path = self.local_raw_dir / filename
-        merged_ds.to_netcdf(local_path, format="NETCDF4")
+        baseline.to_netcdf(local_path, format="NETCDF4")
         return filename
 
+    def _fetch_work_unit(self, unit):
+        if "historical" in unit:
+            return unit["historical"]
+        # Members of the latest 90-day zips, by date
+        return {date: self.get_raw_data(date=date.date()) for date in unit["dates"]}
+
+    def _remove_local_raw(self, raw_data):
+        # Historical NetCDFs and 90-day zips are shared by many dates, so keep
+        # them for the run
+        return
+
+    def _process_work_unit(self, raw_data, unit):
+        if "historical" in unit:
+            sfed_path, mfed_path = raw_data
+            self.combine_bands(
+                [
+                    (
+                        self.process_historical_data(sfed_path, date, SFED),
+                        self.process_historical_data(mfed_path, date, MFED),
+                        date,
+                        self._raw_identity,
+                    )
+                    for date in unit["dates"]
+                ]
+            )
+            return
+
+        bands, unavailable = [], []
+        for date, (sfed_path, mfed_path) in raw_data.items():
+            if sfed_path and mfed_path:
+                bands.append(self._read_zip_bands(sfed_path, mfed_path, date))
+            else:
+                unavailable.append(f"{date:%Y-%m-%d}")
+        self.combine_bands(bands)
+        if unavailable:
+            raise ValueError(f"No FloodScan data available for {unavailable}")
+
+    def backfill_missing_dates(self):
+        self.logger.info("Checking for missing data and backfilling if needed...")
+        missing_dates, _ = self.check_coverage()
+        self.print_coverage_report()
+        if len(missing_dates):
+            # Missing dates are backfilled from the latest zips, so they are
+            # fetched once and the dates they have are processed as one unit
+            available = self._latest_archive_dates()
+            dates = [date for date in missing_dates if date in available]
+            unavailable = pd.DatetimeIndex(
+                [date for date in missing_dates if date not in available]
+            )
+            if len(unavailable):
+                ranges = ", ".join(
+                    f"{start:%Y-%m-%d} to {end:%Y-%m-%d}"
+                    for start, end in coverage_utils.contiguous_ranges(unavailable, "D")
+                )
+                self.logger.warning(
+                    f"{len(unavailable)} missing dates aren't in the latest 90-day "
+                    f"zips, so they aren't backfilled: {ranges}"
+                )
+            if dates:
+                self.run_work_units([{"dates": dates}])
+        self._cleanup_local()
+
     def run_pipeline(self):
         yesterday = datetime.today() - pd.DateOffset(days=1)
         dates = create_date_range(
@@ -423,61 +816,35 @@ class FloodScanPipeline(Pipeline):
 
         # This assumes that all missing dates will be in the last 90 days
         if self.backfill:
-            self.logger.info("Checking for missing data and backfilling if needed...")
-            missing_dates, _ = self.check_coverage()
-            self.print_coverage_report()
-            for date in missing_dates:
-                sfed, mfed = self.get_raw_data(date=date.date())
-                if sfed and mfed:
-                    sfed_da = self.process_data(sfed, band_type=SFED)
-                    mfed_da = self.process_data(mfed, band_type=MFED)
-                    self.combine_bands(sfed_da, mfed_da, date)
-                    self._cleanup_local()
-                else:
-                    continue
+            self.backfill_missing_dates()
 
         # Run for the latest available date
         if self.is_update:
             self.logger.info("Retrieving FloodScan data from yesterday...")
             sfed, mfed = self.get_raw_data(date=yesterday.date())
             if sfed and mfed:
-                sfed_da = self.process_data(sfed, band_type=SFED)
-                mfed_da = self.process_data(mfed, band_type=MFED)
-                self.combine_bands(sfed_da, mfed_da, yesterday)
+                self.combine_bands([self._read_zip_bands(sfed, mfed, yesterday)])
                 self._cleanup_local()
+                self.finish_run()
                 return True
 
             raise Exception("Failed retrieving data from yesterday.")
 
         elif self.baseline_update:
-            dates = create_date_range(
-                datetime.strptime(f"{self.baseline_update-10}-01-01", DATE_FORMAT),
-                datetime.strptime(f"{self.baseline_update}-01-01", DATE_FORMAT),
-            )
-
             self.logger.info(
                 "Retrieving the past 10 years of COGs to calculate baseline..."
             )
 
-            sfed_files = []
-            for date in dates:
-                sfed_filename = self._generate_processed_filename(date)
-                sfed_local_file_path = self.local_processed_dir / sfed_filename
-                da_in = self._retrieve_datarray_for_date(
-                    date, sfed_filename, sfed_local_file_path
-                )
-                if da_in.any():
-                    sfed_files.append(da_in.sel({"band": 1}, drop=True))
-
-            self.logger.info("Merging datasets for the baseline...")
-            merged_ds = xr.combine_nested(sfed_files, concat_dim="date")
+            baseline_date = datetime(self.baseline_update, 1, 1)
+            accumulator = self._baseline_window_sums(self.baseline_update)
 
             self.logger.info("Calculating baseline...")
-            filename = self._calculate_baseline(date, merged_ds)
+            filename = self._calculate_baseline(baseline_date, accumulator)
 
             self.logger.info("Uploading baseline file to storage account...")
             self.save_raw_data(filename)
 
+            self.finish_run()
             return True
 
         elif any(date.year < 2024 for date in dates):
@@ -485,17 +852,29 @@ class FloodScanPipeline(Pipeline):
                 f"Retrieving historical FloodScan data from {min(dates).date()} until {max(dates).date()}..."
             )
 
-            # Dates fall under netcdf archive
-            sfed_path, mfed_path = self.get_historical_nc_files()
-
-            for date in dates:
-                if date.year < 2024:
-                    sfed_da = self.process_historical_data(sfed_path, date, SFED)
-                    mfed_da = self.process_historical_data(mfed_path, date, MFED)
-                    self.combine_bands(sfed_da, mfed_da, date=date)
+            # Dates fall under the historical archive, read from its Zarr mirror
+            # if it exists, or from the NetCDFs otherwise
+            if self.historical_zarr_exists():
+                historical = (self.historical_zarr, self.historical_zarr)
+            else:
+                historical = self.get_historical_nc_files()
+            # Identify the historical files once, before any workers are started
+            self._set_raw_inputs(historical)
+
+            # One work unit per month, whose dates are saved in a single pass
+            months = itertools.groupby(
+                (date for date in dates if date.year < 2024),
+                key=lambda date: (date.year, date.month),
+            )
+            self.run_work_units(
+                {"dates": list(month_dates), "historical": historical}
+                for _, month_dates in months
+            )
 
         # If any of the dates are above 2023:
-        if any(date.year >= 2024 for date in dates):
-            filenames = self.get_historical_90days_zipped_files(dates=dates)
+        recent_dates = [date for date in dates if date.year >= 2024]
+        if recent_dates:
+            filenames = self.get_historical_90days_zipped_files(dates=recent_dates)
             filenames.reverse()
-            self.process_historical_zipped_data(filenames, dates)
+            self.process_historical_zipped_data(filenames, recent_dates)
+        self.finish_run()
@@ -9,7 +9,7 @@ import requests
 import xarray as xr
 
 from ..utils.raster_utils import invert_lat_lon
-from .pipeline import Pipeline
+from .pipeline import WRITE_WORKERS, Pipeline
 
 
 class IMERGPipeline(Pipeline):
@@ -27,6 +27,19 @@ class IMERGPipeline(Pipeline):
             metadata=kwargs["metadata"],
             coverage=kwargs["coverage"],
             use_cache=kwargs["use_cache"],
+            workers=kwargs.get("workers", 1),
+            stream=kwargs.get("stream", False),
+            prefetch=kwargs.get("prefetch", 2),
+            raw_cache_dir=kwargs.get("raw_cache_dir"),
+            raw_cache_size_gb=kwargs.get("raw_cache_size_gb", 50),
+            force=kwargs.get("force", False),
+            in_memory=kwargs.get("in_memory", False),
+            memory_threshold_mb=kwargs.get("memory_threshold_mb", 256),
+            download_concurrency=kwargs.get("download_concurrency", 8),
+            download_chunk_mb=kwargs.get("download_chunk_mb", 32),
+            cog_profile=kwargs.get("cog"),
+            sparse=kwargs.get("sparse", False),
+            write_workers=kwargs.get("write_workers", WRITE_WORKERS),
         )
 
         self.backfill = kwargs["backfill"]
@@ -133,6 +146,12 @@ class IMERGPipeline(Pipeline):
             shutil.copy2(homeDir + ".dodsrc", os.getcwd())
             self.logger.info("Copied .dodsrc to:", os.getcwd())
 
+    def _process_work_unit(self, raw_filename, unit):
+        self.process_data(raw_filename, unit["date"])
+
+    def _unit_outputs(self, unit):
+        return [self._generate_processed_filename(unit["date"])]
+
     def run_pipeline(self):
         self.logger.info(f"Running IMERG pipeline in {self.mode} mode...")
         self.logger.info(
@@ -146,17 +165,12 @@ class IMERGPipeline(Pipeline):
             missing_dates, coverage_pct = self.check_coverage()
             self.print_coverage_report()
             if missing_dates:
-                for missing_date in missing_dates:
-                    # TODO: Repeated with below...
-                    self.logger.debug(f"Getting data for {missing_date}...")
-                    raw_filename = self.get_raw_data(date=missing_date)
-                    self.process_data(raw_filename, missing_date)
+                self.run_work_units({"date": date} for date in missing_dates)
 
-        for date in pd.date_range(
+        dates = pd.date_range(
             datetime.strptime(self.start_date, "%Y-%m-%d"),
             datetime.strptime(self.end_date, "%Y-%m-%d") - pd.DateOffset(days=1),
-        ):
-            self.logger.info(f"Getting data for {date}...")
-            raw_filename = self.get_raw_data(date=date)
-            self.process_data(raw_filename, date)
+        )
+        self.run_work_units({"date": date} for date in dates)
+        self.finish_run()
         self.logger.info("Completed IMERG update.")
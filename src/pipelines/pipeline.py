@@ -1,21 +1,77 @@
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
+import queue
 import tempfile
+import threading
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional, Tuple
 
 import coloredlogs
+import dask
 import pandas as pd
 import xarray
+from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import StandardBlobTier
 
-from ..utils.azure_utils import blob_client, download_from_azure, upload_file_by_mode
+from ..utils import coverage_utils
+from ..utils.azure_utils import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_CONCURRENCY,
+    blob_client,
+    container_client,
+    download_from_azure,
+    upload_data_by_mode,
+    upload_file_by_mode,
+)
+from ..utils.cache_utils import GribIndexCache, RawCache, file_checksum
+from ..utils.cog_utils import cog_bytes, cog_sparsity, write_cog
 from ..utils.date_utils import get_datetime_from_filename
+from ..utils.manifest_utils import (
+    MANIFEST_FILENAME,
+    manifest_entry,
+    read_blob_manifest,
+    read_local_manifest,
+    update_blob_manifest,
+    update_local_manifest,
+)
 from ..utils.validation_utils import validate_dataset
 
+# Number of processed outputs to buffer before writing them to the manifest
+MANIFEST_FLUSH_SIZE = 50
+
+# Default number of COGs written at the same time from one raw input
+WRITE_WORKERS = 4
+
+
+class WorkUnitsFailed(Exception):
+    """Raised at the end of a run when some of its work units failed."""
+
+
+# Pipeline instance shared with forked worker processes. Pipelines hold API
+# and storage clients that can't be pickled, so workers inherit the instance
+# through `fork` and only the (picklable) work unit is sent to them.
+_WORKER_PIPELINE = None
+
+
+def _run_work_unit_in_worker(unit):
+    result = _WORKER_PIPELINE._run_work_unit_safely(unit)
+    # Outputs are recorded in the manifest by the parent process
+    result["manifest_entries"] = _WORKER_PIPELINE._take_manifest_entries()
+    return result
+
 
 class Pipeline(ABC):
+    # Bump when a change to the processing code should invalidate existing
+    # outputs, so that they are reprocessed even if their inputs are unchanged
+    PIPELINE_VERSION = "1"
+
     def __init__(
         self,
         container_name,
@@ -26,13 +82,60 @@ class Pipeline(ABC):
         coverage,
         mode="local",
         use_cache=False,
+        workers=1,
+        stream=False,
+        prefetch=2,
+        raw_cache_dir=None,
+        raw_cache_size_gb=50,
+        force=False,
+        in_memory=False,
+        memory_threshold_mb=256,
+        download_concurrency=DOWNLOAD_CONCURRENCY,
+        download_chunk_mb=DOWNLOAD_CHUNK_SIZE / 2**20,
+        cog_profile=None,
+        sparse=False,
+        write_workers=WRITE_WORKERS,
     ):
         self.container_name = container_name
         self.raw_path = Path(raw_path)
         self.processed_path = Path(processed_path)
         self.mode = mode
         self.use_cache = use_cache
+        self.workers = max(1, int(workers or 1))
+        self.stream = stream
+        self.prefetch = max(1, int(prefetch or 1))
+        self.force = force
+        # Outside of local mode, COGs up to `memory_threshold_mb` (of raw array
+        # data) can be encoded in memory and uploaded without touching disk
+        self.in_memory = in_memory
+        self.memory_threshold = int(memory_threshold_mb * 1e6)
+        self.download_concurrency = max(1, int(download_concurrency))
+        self.download_chunk_size = int(download_chunk_mb * 2**20)
+        self.write_workers = max(1, int(write_workers or 1))
+        # Set while streaming, so that `save_processed_data` hands finished
+        # COGs to the background uploader instead of uploading them inline
+        self._upload_queue = None
+        self._current_unit_index = None
+        # Results of the work units that failed during the run, reported by
+        # `finish_run` once all units have run
+        self._failed_units = []
+        self._manifest_entries = {}
+        self._manifest_lock = threading.Lock()
+        # Identity of the raw inputs of the outputs being processed, used to
+        # fingerprint them, and of raw blobs and files seen during the run
+        self._raw_identity = None
+        self._raw_etags = {}
+        self._checksums = {}
+        self._existing_outputs = None
         self.metadata = self._set_metadata(metadata)
+        # Encoding options of the processed COGs (the `cog` config section)
+        if sparse:
+            cog_profile = {**(cog_profile or {}), "sparse": True}
+        self.cog_profile = cog_profile
+        config = {k: v for k, v in self.metadata.items() if k != "download_date"}
+        if cog_profile:
+            config["cog"] = cog_profile
+        self.config_hash = self._hash(config)
         self.coverage = self._set_coverage(coverage)
         self.logger = self._setup_logger(log_level)
 
@@ -48,8 +151,30 @@ class Pipeline(ABC):
         self.local_raw_dir.mkdir(parents=True, exist_ok=True)
         self.local_processed_dir.mkdir(parents=True, exist_ok=True)
 
-        if self.mode != "local":
-            self.blob_service_client = blob_client(self.mode)
+        # Raw inputs downloaded from blob storage can be kept in a persistent
+        # cache, as the temp dir used outside of local mode is deleted after
+        # each run
+        self.raw_cache = None
+        if raw_cache_dir and self.mode != "local":
+            self.raw_cache = RawCache(raw_cache_dir, int(raw_cache_size_gb * 1e9))
+        # Indexes of GRIB raw files, so that cfgrib doesn't rescan files it
+        # has already opened, in this run or a previous one
+        self.grib_index_cache = None
+        if raw_cache_dir:
+            self.grib_index_cache = GribIndexCache(Path(raw_cache_dir) / "grib_index")
+        # Partial downloads, so that an interrupted run resumes them
+        self.partial_dir = None
+        if raw_cache_dir and self.mode != "local":
+            self.partial_dir = Path(raw_cache_dir) / "partial"
+
+    @property
+    def blob_service_client(self):
+        """Shared storage client of the pipeline's mode, see `blob_client()`."""
+        return blob_client(self.mode)
+
+    @property
+    def container_client(self):
+        return container_client(self.mode, self.container_name)
 
     @abstractmethod
     def query_api(self, **kwargs):
@@ -93,7 +218,12 @@ class Pipeline(ABC):
         return standard_metadata
 
     def _set_coverage(self, coverage: dict) -> dict:
-        default_config = {"start_date": None, "end_date": None, "frequency": "M"}
+        default_config = {
+            "start_date": None,
+            "end_date": None,
+            "frequency": "M",
+            "leadtimes": None,
+        }
         if coverage:
             default_config.update(coverage)
 
@@ -139,45 +269,454 @@ class Pipeline(ABC):
         else:
             blob_path = self.raw_path / filename
             local_file_path = self.local_raw_dir / filename
-            if download_from_azure(
-                self.blob_service_client,
-                self.container_name,
-                blob_path,
-                local_file_path,
-            ):
+            if self._download_raw(blob_path, local_file_path):
                 self.logger.info(f"Using cached raw data from cloud: {blob_path}")
                 return local_file_path
 
         self.logger.info("No cached data found. Querying API...")
         return self.query_api(**kwargs)
 
-    def _get_existing_dates(self):
-        """Get list of dates from existing processed files."""
+    def _fetch_work_unit(self, unit):
+        """Retrieve the raw data for a single work unit."""
+        return self.get_raw_data(**unit)
+
+    def _process_work_unit(self, raw_data, unit):
+        """Process the raw data of a single work unit into COGs."""
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not support work units"
+        )
+
+    def _run_work_unit(self, unit):
+        raw_data = self._fetch_work_unit(unit)
+        self._set_raw_inputs(raw_data)
+        return self._process_work_unit(raw_data, unit)
+
+    def _unit_outputs(self, unit):
+        """
+        Filenames of the processed outputs of a work unit, relative to the
+        processed path. Pipelines that can't tell them before processing
+        return None, and their units are never skipped when planning.
+        """
+        return None
+
+    def _unit_raw_blobs(self, unit):
+        """Blob paths of the raw inputs of a work unit."""
+        return [self.raw_path / self._generate_raw_filename(**unit)]
+
+    def _unit_is_current(self, unit):
+        """
+        Whether all outputs of a work unit were produced from the current raw
+        blobs, pipeline version and config, so the unit doesn't need to run.
+        This is only known before downloading when raw data is read from blob
+        storage (`use_cache`).
+        """
+        if self.force or not self.use_cache or self.mode == "local":
+            return False
+        outputs = self._unit_outputs(unit)
+        if not outputs:
+            return False
+        existing = self._get_existing_outputs()
+        if not all(output in existing for output in outputs):
+            return False
+        raw_identity = [
+            self._get_raw_blob_etag(blob) for blob in self._unit_raw_blobs(unit)
+        ]
+        return all(
+            existing[output].get("raw") == raw_identity
+            and existing[output].get("version") == self.PIPELINE_VERSION
+            and existing[output].get("config") == self.config_hash
+            for output in outputs
+        )
+
+    def _run_work_unit_safely(self, unit):
+        try:
+            self._run_work_unit(unit)
+            return {"unit": unit, "success": True, "error": None}
+        except Exception as err:
+            self.logger.error(f"Failed processing {unit}: {err}")
+            return {"unit": unit, "success": False, "error": str(err)}
+
+    def run_work_units(self, units):
+        """
+        Run a list of independent work units, either serially or on a pool of
+        `self.workers` processes.
+
+        Each work unit is a dict of keyword arguments identifying the raw data
+        to retrieve (eg. `{"year": 2020, "month": 1}`). Output filenames are
+        derived from the unit itself, so they don't depend on which worker
+        processes it or in which order.
+
+        Args:
+            units (list): List of work units
+
+        Returns:
+            (list): One result dict per unit, in the same order as `units`,
+            with keys `unit`, `success` and `error`
+        """
+        global _WORKER_PIPELINE
+
+        units = list(units)
+        current = [unit for unit in units if self._unit_is_current(unit)]
+        if current:
+            self.logger.info(
+                f"Skipping {len(current)} work units with unchanged inputs: {current}"
+            )
+            units = [unit for unit in units if unit not in current]
+        if not units:
+            return []
+
+        if self.stream:
+            results = self._stream_work_units(units)
+        elif self.workers == 1 or len(units) == 1:
+            results = [self._run_work_unit_safely(unit) for unit in units]
+        else:
+            n_workers = min(self.workers, len(units))
+            self.logger.info(
+                f"Processing {len(units)} work units across {n_workers} workers..."
+            )
+            _WORKER_PIPELINE = self
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=n_workers,
+                    mp_context=multiprocessing.get_context("fork"),
+                ) as executor:
+                    results = list(executor.map(_run_work_unit_in_worker, units))
+            finally:
+                _WORKER_PIPELINE = None
+            for result in results:
+                self._record_manifest_entries(result.pop("manifest_entries"))
+
+        self.flush_manifest()
+
+        failed = [result for result in results if not result["success"]]
+        self._failed_units.extend(failed)
+        if failed:
+            self.logger.warning(
+                f"{len(failed)} of {len(results)} work units failed: "
+                f"{[result['unit'] for result in failed]}"
+            )
+        else:
+            self.logger.info(f"Successfully processed {len(results)} work units")
+        return results
+
+    def finish_run(self):
+        """
+        End a run: write the outputs still pending to the manifest, and fail
+        the run if any of its work units failed. Failed units don't stop the
+        others, so this is called once all the units of a run are done.
+
+        Raises:
+            WorkUnitsFailed: With the units that failed and their errors
+        """
+        self.flush_manifest()
+        failed, self._failed_units = self._failed_units, []
+        if failed:
+            errors = "; ".join(
+                f"{result['unit']}: {result['error']}" for result in failed
+            )
+            raise WorkUnitsFailed(f"{len(failed)} work units failed: {errors}")
+
+    def _stream_work_units(self, units):
+        """
+        Run work units as a download -> process -> upload stream.
+
+        Raw data for the next `self.prefetch` units is downloaded in a
+        background thread while the current unit is processed, and finished
+        COGs are uploaded by a second background thread. Both queues are
+        bounded, so a slow stage holds back the others rather than filling up
+        local disk and memory.
+        """
+        raw_queue = queue.Queue(maxsize=self.prefetch)
+        self._upload_queue = queue.Queue(maxsize=self.prefetch)
+        results = [{"unit": unit, "success": True, "error": None} for unit in units]
+
+        def download():
+            for i, unit in enumerate(units):
+                try:
+                    raw_queue.put((i, self._fetch_work_unit(unit), None))
+                except Exception as err:
+                    raw_queue.put((i, None, err))
+            raw_queue.put(None)
+
+        def upload():
+            while True:
+                item = self._upload_queue.get()
+                if item is None:
+                    break
+                i, output, blob_path, output_info = item
+                try:
+                    self._upload_processed_file(output, blob_path, output_info)
+                except Exception as err:
+                    self.logger.error(f"Failed uploading {blob_path}: {err}")
+                    results[i].update(success=False, error=str(err))
+
+        self.logger.info(
+            f"Streaming {len(units)} work units with {self.prefetch} prefetched inputs..."
+        )
+        downloader = threading.Thread(target=download, daemon=True)
+        uploader = threading.Thread(target=upload, daemon=True)
+        downloader.start()
+        uploader.start()
+
+        try:
+            while True:
+                item = raw_queue.get()
+                if item is None:
+                    break
+                i, raw_data, fetch_err = item
+                self._current_unit_index = i
+                try:
+                    if fetch_err:
+                        raise fetch_err
+                    self._set_raw_inputs(raw_data)
+                    self._process_work_unit(raw_data, units[i])
+                except Exception as err:
+                    self.logger.error(f"Failed processing {units[i]}: {err}")
+                    results[i].update(success=False, error=str(err))
+                finally:
+                    if self.mode != "local":
+                        self._remove_local_raw(raw_data)
+        finally:
+            self._upload_queue.put(None)
+            uploader.join()
+            self._upload_queue = None
+
+        downloader.join()
+        return results
+
+    def _local_raw_paths(self, raw_data):
+        if isinstance(raw_data, (tuple, list)):
+            return [path for item in raw_data for path in self._local_raw_paths(item)]
+        if isinstance(raw_data, (str, Path)):
+            return [self.local_raw_dir / Path(raw_data).name]
+        return []
+
+    def _file_checksum(self, path):
+        """Checksum of a local file, computed once per version of the file."""
+        stat = path.stat()
+        checksum_key = (str(path), stat.st_size, stat.st_mtime_ns)
+        if checksum_key not in self._checksums:
+            self._checksums[checksum_key] = file_checksum(path)
+        return self._checksums[checksum_key]
+
+    @contextmanager
+    def cfgrib_indexpath(self, raw_file_path):
+        """
+        Index path to open a raw GRIB file with cfgrib, inside the context.
+
+        With a persistent cache directory, the index is kept in the GRIB
+        index cache (see `GribIndexCache`). Otherwise, no index is written.
+        """
+        if not self.grib_index_cache:
+            yield ""
+            return
+        checksum = self._file_checksum(Path(raw_file_path))
+        with self.grib_index_cache.indexpath(raw_file_path, checksum) as indexpath:
+            yield indexpath
+
+    def _set_raw_inputs(self, raw_data):
+        """
+        Set the identity of the raw inputs of the outputs that are about to be
+        processed: the ETag of raw files downloaded from blob storage, or a
+        checksum of their content otherwise.
+        """
+        identity = []
+        for path in self._local_raw_paths(raw_data):
+            if path.name in self._raw_etags:
+                identity.append(self._raw_etags[path.name])
+            elif path.is_file():
+                identity.append(self._file_checksum(path))
+            else:
+                identity = None
+                break
+        self._raw_identity = identity or None
+
+    @staticmethod
+    def _hash(obj):
+        payload = json.dumps(obj, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _fingerprint(self, attrs, raw_identity=None):
+        """
+        Fingerprint of an output: a hash of its raw inputs (`raw_identity`,
+        or the current raw inputs by default), the pipeline version and
+        config (including the COG profile) and its metadata. None if the raw
+        inputs aren't known.
+        """
+        raw_identity = raw_identity or self._raw_identity
+        if not raw_identity:
+            return None
+        return self._hash(
+            {
+                "raw": raw_identity,
+                "version": self.PIPELINE_VERSION,
+                "config": self.config_hash,
+                "metadata": {k: v for k, v in attrs.items() if k != "download_date"},
+            }
+        )
+
+    @staticmethod
+    def _output_blob_metadata(output_info):
+        """Blob metadata recording the fingerprint of an output."""
+        if not output_info["fingerprint"]:
+            return None
+        metadata = {
+            "fingerprint": output_info["fingerprint"],
+            "raw_inputs": ",".join(output_info["raw"]),
+            "pipeline_version": output_info["version"],
+            "config_hash": output_info["config"],
+        }
+        if "sparsity" in output_info:
+            metadata["sparsity"] = str(output_info["sparsity"])
+        return metadata
+
+    @staticmethod
+    def _output_info_from_blob_metadata(metadata):
+        if not metadata or "fingerprint" not in metadata:
+            return {}
+        info = {
+            "fingerprint": metadata["fingerprint"],
+            "raw": metadata["raw_inputs"].split(","),
+            "version": metadata["pipeline_version"],
+            "config": metadata["config_hash"],
+        }
+        if "sparsity" in metadata:
+            info["sparsity"] = float(metadata["sparsity"])
+        return info
+
+    def _get_existing_outputs(self):
+        if self._existing_outputs is None:
+            self._existing_outputs = self._get_existing_files()
+        return self._existing_outputs
+
+    def _remove_local_raw(self, raw_data):
+        """Remove raw inputs that have already been processed from the temp dir."""
+        if isinstance(raw_data, (tuple, list)):
+            for item in raw_data:
+                self._remove_local_raw(item)
+        elif isinstance(raw_data, (str, Path)):
+            local_path = self.local_raw_dir / Path(raw_data).name
+            if local_path.is_file():
+                os.remove(local_path)
+
+    def _list_processed_files(self):
+        """
+        List processed COGs in storage.
+
+        Returns:
+            (dict): Manifest entries keyed by filename, relative to the
+            processed path
+        """
+        entries = {}
+        if self.mode == "local":
+            for file in self.local_processed_dir.glob("*.tif"):
+                entries[file.name] = manifest_entry(file.name, file.stat().st_size)
+        else:
+            blobs = self.container_client.list_blobs(
+                name_starts_with=self.processed_path.as_posix() + "/",
+                include=["metadata"],
+            )
+            for blob in blobs:
+                if blob.name.endswith(".tif"):
+                    filename = Path(blob.name).relative_to(self.processed_path)
+                    entries[filename.as_posix()] = manifest_entry(
+                        blob.name,
+                        blob.size,
+                        blob.etag,
+                        **self._output_info_from_blob_metadata(blob.metadata),
+                    )
+        return entries
+
+    def _read_manifest(self):
+        if self.mode == "local":
+            return read_local_manifest(self.local_processed_dir / MANIFEST_FILENAME)
+        manifest, _ = read_blob_manifest(
+            self.container_client, self.processed_path / MANIFEST_FILENAME
+        )
+        return manifest
+
+    def _write_manifest(self, entries, replace=False):
         if self.mode == "local":
-            path = self.local_processed_dir
-            files = list(path.glob("*.tif"))
+            update_local_manifest(
+                self.local_processed_dir / MANIFEST_FILENAME, entries, replace
+            )
         else:
-            blobs = self.blob_service_client.get_container_client(
-                self.container_name
-            ).list_blobs(name_starts_with=str(self.processed_path))
-            files = [blob.name for blob in blobs if blob.name.endswith(".tif")]
+            update_blob_manifest(
+                self.container_client,
+                self.processed_path / MANIFEST_FILENAME,
+                entries,
+                replace,
+            )
+
+    def _record_manifest_entries(self, entries):
+        with self._manifest_lock:
+            self._manifest_entries.update(entries)
+            n_pending = len(self._manifest_entries)
+        if n_pending >= MANIFEST_FLUSH_SIZE and self._upload_queue is None:
+            self.flush_manifest()
+
+    def _take_manifest_entries(self):
+        with self._manifest_lock:
+            entries = self._manifest_entries
+            self._manifest_entries = {}
+        return entries
+
+    def flush_manifest(self):
+        """
+        Write any outputs processed since the last flush to the manifest. Runs
+        call it when they end, including on errors, so that outputs already
+        written are still recorded.
+        """
+        entries = self._take_manifest_entries()
+        if entries:
+            self._write_manifest(entries)
+
+    def _get_existing_files(self):
+        """
+        Get the processed files, from the manifest next to the processed path
+        when available. Otherwise, fall back to listing the processed path and
+        create the manifest from the listing.
+        """
+        manifest = self._read_manifest()
+        if manifest is not None:
+            return manifest["files"]
 
-        dates = []
-        for file in files:
-            file_name = Path(file).name
-            file_date = get_datetime_from_filename(file_name)
-            dates.append(file_date)
+        self.logger.info("No manifest of processed files found. Listing files...")
+        entries = self._list_processed_files()
+        self._write_manifest(entries, replace=True)
+        return entries
 
+    def _get_existing_dates(self):
+        """Get list of dates from existing processed files."""
+        dates = [
+            get_datetime_from_filename(Path(file).name)
+            for file in self._get_existing_files()
+        ]
         return sorted(set(dates))
 
-    def check_coverage(
+    def reconcile_manifest(self):
+        """
+        Rebuild the manifest of processed files from a full listing of the
+        processed path, eg. if files were added or deleted outside the pipeline.
+        """
+        manifest = self._read_manifest() or {"files": {}}
+        entries = self._list_processed_files()
+        added = set(entries) - set(manifest["files"])
+        removed = set(manifest["files"]) - set(entries)
+        self.logger.info(
+            f"Reconciling manifest for {self.processed_path}: {len(entries)} files, "
+            f"{len(added)} missing from and {len(removed)} stale in the manifest"
+        )
+        self._write_manifest(entries, replace=True)
+
+    def get_coverage_summary(
         self,
         start_date: Optional[str] = None,
         end_date: Optional[str] = None,
         frequency: Optional[str] = None,
-    ) -> Tuple[List[pd.Timestamp], float]:
+    ) -> dict:
         """
-        Check coverage of pipeline outputs.
+        Compare the expected date range against the existing processed files.
 
         Args:
             start_date: Override start_date from config if provided
@@ -185,11 +724,13 @@ class Pipeline(ABC):
             frequency: Override frequency from config if provided
 
         Returns:
-            Tuple of (missing dates, coverage percentage)
+            Dict with the missing dates, contiguous missing ranges, and
+            coverage percentage of the expected range
         """
         # Use config values if not overridden
         start_date = start_date or self.coverage["start_date"]
         frequency = frequency or self.coverage["frequency"]
+        leadtimes = self.coverage["leadtimes"]
 
         if not start_date:
             raise ValueError(
@@ -199,41 +740,81 @@ class Pipeline(ABC):
         if end_date is None:
             end_date = self.coverage["end_date"] or datetime.now().strftime("%Y-%m-%d")
 
-        expected_dates = pd.date_range(
-            start=start_date, end=end_date, freq="MS" if frequency == "M" else frequency
-        )
+        expected = coverage_utils.expected_dates(start_date, end_date, frequency)
         # Drop the last two -- ie. current month or current year isn't missing
         # as well as the latest update date
-        expected_dates = expected_dates[:-2]
-        existing_dates = self._get_existing_dates()
+        expected = expected[:-2]
 
-        missing_dates = [date for date in expected_dates if date not in existing_dates]
-        coverage_pct = (len(existing_dates) / len(expected_dates)) * 100
+        # Additional products are stored in sub-folders of the processed path
+        entries = [
+            entry
+            for filename, entry in self._get_existing_files().items()
+            if "/" not in filename
+        ]
+        existing = coverage_utils.existing_index(entries, leadtimes)
+        missing, coverage_pct = coverage_utils.find_missing(
+            expected, existing, leadtimes
+        )
+
+        return {
+            "missing_dates": list(missing),
+            "missing_ranges": coverage_utils.contiguous_ranges(missing, frequency),
+            "coverage_pct": coverage_pct,
+            "n_expected": len(expected),
+        }
+
+    def check_coverage(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        frequency: Optional[str] = None,
+    ) -> Tuple[List[pd.Timestamp], float]:
+        """
+        Check coverage of pipeline outputs.
+
+        Args:
+            start_date: Override start_date from config if provided
+            end_date: Override end_date from config if provided
+            frequency: Override frequency from config if provided
 
-        return missing_dates, coverage_pct
+        Returns:
+            Tuple of (missing dates, coverage percentage)
+        """
+        summary = self.get_coverage_summary(start_date, end_date, frequency)
+        return summary["missing_dates"], summary["coverage_pct"]
 
     def print_coverage_report(
         self,
         start_date: Optional[str] = None,
         end_date: Optional[str] = None,
         frequency: Optional[str] = None,
+        summary: Optional[dict] = None,
     ) -> None:
         """Print a formatted coverage report."""
-        missing_dates, coverage_pct = self.check_coverage(
-            start_date, end_date, frequency
-        )
+        if summary is None:
+            summary = self.get_coverage_summary(start_date, end_date, frequency)
+        missing_dates = summary["missing_dates"]
+        missing_ranges = summary["missing_ranges"]
 
         self.logger.info(f"Coverage Report for {self.__class__.__name__}")
         self.logger.info("=" * 50)
         self.logger.info(f"Mode: {self.mode}")
         self.logger.info(f"Storage Path: {self.processed_path}")
-        self.logger.info(f"Coverage: {coverage_pct:.1f}%")
+        self.logger.info(f"Coverage: {summary['coverage_pct']:.1f}%")
 
         if missing_dates:
-            self.logger.info(f"Missing Dates: {len(missing_dates)}")
-            if len(missing_dates) < 10:
-                for date in missing_dates:
-                    self.logger.info(f" - {date.strftime('%Y-%m-%d')}")
+            self.logger.info(
+                f"Missing Dates: {len(missing_dates)} in {len(missing_ranges)} ranges"
+            )
+            for first, last in missing_ranges[:10]:
+                if first == last:
+                    self.logger.info(f" - {first.strftime('%Y-%m-%d')}")
+                else:
+                    self.logger.info(
+                        f" - {first.strftime('%Y-%m-%d')} to {last.strftime('%Y-%m-%d')}"
+                    )
+            if len(missing_ranges) > 10:
+                self.logger.info(f" - ... and {len(missing_ranges) - 10} more ranges")
         else:
             self.logger.info("No missing dates found!")
 
@@ -242,13 +823,67 @@ class Pipeline(ABC):
         if folder:
             blob_path = self.raw_path / folder / filename
         local_file_path = self.local_raw_dir / filename
-        if download_from_azure(
+        if self._download_raw(blob_path, local_file_path):
+            self.logger.info(f"Downloading raw data from cloud: {blob_path}")
+
+    def _get_raw_blob_etag(self, blob_path):
+        """Get the ETag of a raw blob, or None if it doesn't exist."""
+        try:
+            return (
+                self.container_client.get_blob_client(str(blob_path))
+                .get_blob_properties()
+                .etag
+            )
+        except ResourceNotFoundError:
+            return None
+
+    def _download_raw(self, blob_path, local_file_path):
+        """
+        Download a raw file from blob storage, going through the persistent raw
+        cache if enabled. Cached files are keyed by the blob path and ETag, so
+        a blob that is overwritten in storage is downloaded again.
+
+        Returns:
+            The local file path if successful, None otherwise
+        """
+        etag = self._get_raw_blob_etag(blob_path)
+        if not etag:
+            self.logger.warning(f"Blob {blob_path} not found")
+            return None
+        # The ETag identifies the raw input when fingerprinting outputs
+        self._raw_etags[Path(local_file_path).name] = etag
+
+        if self.raw_cache:
+            key = RawCache.key(
+                "azure",
+                mode=self.mode,
+                container=self.container_name,
+                blob=Path(blob_path).as_posix(),
+                etag=etag,
+            )
+            if self.raw_cache.get(key, local_file_path):
+                self.logger.info(f"Using raw data from the local cache: {blob_path}")
+                return local_file_path
+
+        if not download_from_azure(
             self.blob_service_client,
             self.container_name,
             blob_path,
             local_file_path,
+            max_concurrency=self.download_concurrency,
+            chunk_size=self.download_chunk_size,
+            partial_dir=self.partial_dir,
         ):
-            self.logger.info(f"Downloading raw data from cloud: {blob_path}")
+            return None
+        if self.raw_cache:
+            self.raw_cache.put(key, local_file_path, blob=Path(blob_path).as_posix())
+        return local_file_path
+
+    def log_cache_stats(self):
+        if self.raw_cache:
+            self.raw_cache.log_stats()
+        if self.grib_index_cache:
+            self.grib_index_cache.log_stats()
 
     def save_raw_data(self, filename, folder=None):
         if self.mode != "local":
@@ -259,7 +894,7 @@ class Pipeline(ABC):
             upload_file_by_mode(self.mode, self.container_name, local_path, blob_path)
         return
 
-    def save_processed_data(self, ds, filename, folder=None):
+    def save_processed_data(self, ds, filename, folder=None, raw_identity=None):
         local_path = self.local_processed_dir / filename
         if type(ds) == xarray.core.dataset.Dataset:
             da = ds
@@ -274,24 +909,125 @@ class Pipeline(ABC):
             da.attrs = self.metadata
         if not validate_dataset(da, filename):
             raise ValueError("Dataset failed validation")
-        da.rio.to_raster(local_path, driver="COG")
 
-        if self.mode != "local":
-            local_path = self.local_processed_dir / filename
+        manifest_key = f"{folder}/{filename}" if folder else filename
+        raw_identity = raw_identity or self._raw_identity
+        fingerprint = self._fingerprint(da.attrs, raw_identity)
+        existing = self._get_existing_outputs().get(manifest_key, {})
+        if (
+            fingerprint
+            and not self.force
+            and existing.get("fingerprint") == fingerprint
+        ):
+            self.logger.info(f"Skipping {filename}: inputs and metadata are unchanged")
+            return
+        output_info = {
+            "fingerprint": fingerprint,
+            "raw": raw_identity,
+            "version": self.PIPELINE_VERSION,
+            "config": self.config_hash,
+        }
+
+        if self.mode == "local":
+            write_cog(da, local_path, self.cog_profile)
+            self._record_sparsity(local_path, output_info)
+            self._record_manifest_entries(
+                {
+                    manifest_key: manifest_entry(
+                        filename, local_path.stat().st_size, **output_info
+                    )
+                }
+            )
+        else:
             blob_path = self.processed_path / filename
             if folder:
                 blob_path = self.processed_path / folder / filename
-            self.logger.info(f"Uploading processed data {local_path} to {blob_path}")
-            upload_file_by_mode(
-                self.mode,
-                self.container_name,
-                local_path,
-                blob_path,
-                StandardBlobTier.HOT,
-                "image/tiff",
-            )
+            if self.in_memory and da.nbytes <= self.memory_threshold:
+                output = cog_bytes(da, self.cog_profile)
+            else:
+                write_cog(da, local_path, self.cog_profile)
+                output = local_path
+            self._record_sparsity(output, output_info)
+            if self._upload_queue is not None:
+                self._upload_queue.put(
+                    (self._current_unit_index, output, blob_path, output_info)
+                )
+            else:
+                self._upload_processed_file(output, blob_path, output_info)
         return
 
+    def save_processed_outputs(self, outputs):
+        """
+        Save all the outputs of a raw input: evaluate them together in a single
+        `dask.compute` pass, so that the steps they share (eg. decoding, the
+        ensemble mean or a unit conversion) run once and on all cores, then
+        write their COGs on `self.write_workers` threads.
+
+        The metadata changes from one output to the next, so each output must
+        carry its own attrs (eg. a copy of `self.metadata`) rather than rely on
+        `save_processed_data` to set them.
+
+        Outputs made from different raw inputs (eg. the days of a 90-day zip)
+        carry the identity of their own inputs as a 4th item, as the current
+        raw inputs are those of the last of them.
+
+        Args:
+            outputs (list): (Dataset or DataArray, filename, folder) of each
+                output, where the data can be lazy (dask-backed), optionally
+                followed by the identity of its raw inputs
+        """
+        if not outputs:
+            return
+        computed = dask.compute(*(output[0] for output in outputs))
+        # Loaded once here, rather than by the first writers concurrently
+        self._get_existing_outputs()
+        with ThreadPoolExecutor(
+            max_workers=min(self.write_workers, len(outputs))
+        ) as executor:
+            futures = [
+                executor.submit(self.save_processed_data, ds, *output[1:])
+                for ds, output in zip(computed, outputs)
+            ]
+            for future in futures:
+                future.result()
+
+    def _record_sparsity(self, output, output_info):
+        """Record the fraction of omitted blocks of a sparse COG in its info."""
+        if self.cog_profile and self.cog_profile.get("sparse"):
+            output_info["sparsity"] = round(cog_sparsity(output), 4)
+
+    def _upload_processed_file(self, output, blob_path, output_info):
+        """
+        Upload a processed COG, given either as the bytes of a COG encoded in
+        memory or as the path of a COG on local disk (which is removed once
+        uploaded).
+        """
+        in_memory = isinstance(output, bytes)
+        upload = upload_data_by_mode if in_memory else upload_file_by_mode
+        size = len(output) if in_memory else output.stat().st_size
+        source = "in-memory COG" if in_memory else output
+        self.logger.info(f"Uploading processed data {source} to {blob_path}")
+        result = upload(
+            self.mode,
+            self.container_name,
+            output,
+            blob_path,
+            StandardBlobTier.HOT,
+            "image/tiff",
+            metadata=self._output_blob_metadata(output_info),
+        )
+        manifest_key = Path(blob_path).relative_to(self.processed_path).as_posix()
+        self._record_manifest_entries(
+            {
+                manifest_key: manifest_entry(
+                    manifest_key, size, result["etag"], **output_info
+                )
+            }
+        )
+        if not in_memory:
+            # Outside of local mode COGs are only kept on disk until uploaded
+            os.remove(output)
+
     def __del__(self):
         if hasattr(self, "temp_dir"):
             import shutil
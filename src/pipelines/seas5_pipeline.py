@@ -1,14 +1,22 @@
 import os
 from datetime import datetime
 
-import fsspec
 import numpy as np
 import pandas as pd
 import xarray as xr
 from ecmwfapi import ECMWFService
 
 from ..utils import leadtime_utils, raster_utils
-from .pipeline import Pipeline
+from ..utils.ensemble_utils import DelayedEnsembleReducer, EnsembleReducer
+from ..utils.grib_utils import iter_message_groups
+from ..utils.s3_utils import fetch_s3_objects, s3_filesystem
+from .pipeline import WRITE_WORKERS, Pipeline
+
+# Converts total precipitation rate (m/s) to total precipitation (mm/day). See
+# https://codes.ecmwf.int/grib/param-db/260048
+TPRATE_TO_MM_DAY = 1000 * 3600 * 24
+# Number of forecast months of each issue date, from leadtime 0 to 6
+MAX_LEADTIME_MONTHS = 7
 
 
 class SEAS5Pipeline(Pipeline):
@@ -22,6 +30,19 @@ class SEAS5Pipeline(Pipeline):
             metadata=kwargs["metadata"],
             coverage=kwargs["coverage"],
             use_cache=kwargs["use_cache"],
+            workers=kwargs.get("workers", 1),
+            stream=kwargs.get("stream", False),
+            prefetch=kwargs.get("prefetch", 2),
+            raw_cache_dir=kwargs.get("raw_cache_dir"),
+            raw_cache_size_gb=kwargs.get("raw_cache_size_gb", 50),
+            force=kwargs.get("force", False),
+            in_memory=kwargs.get("in_memory", False),
+            memory_threshold_mb=kwargs.get("memory_threshold_mb", 256),
+            download_concurrency=kwargs.get("download_concurrency", 8),
+            download_chunk_mb=kwargs.get("download_chunk_mb", 32),
+            cog_profile=kwargs.get("cog"),
+            sparse=kwargs.get("sparse", False),
+            write_workers=kwargs.get("write_workers", WRITE_WORKERS),
         )
         self.backfill = kwargs["backfill"]
         self.is_update = is_update
@@ -30,6 +51,14 @@ class SEAS5Pipeline(Pipeline):
         self.server = ECMWFService("mars")
         self.aws_bucket_name = os.getenv("AWS_BUCKET_NAME")
         self.bbox = kwargs["bbox"][mode]
+        # "cfgrib" opens whole GRIB files, "eccodes" streams their messages
+        self.grib_decoder = kwargs.get("grib_decoder", "cfgrib")
+        # Products computed alongside the ensemble mean, each saved in its own
+        # folder of the processed path, see `_ensemble_products`
+        self.ensemble_products = kwargs.get("ensemble_products") or {}
+        self._tercile_thresholds = None
+        # Raw files from S3 already downloaded by `_prefetch_s3` in this run
+        self._prefetched = set()
 
     def _generate_raw_filename(self, year, issued_month=None, fc_month=None):
         if year >= 2024:
@@ -40,15 +69,22 @@ class SEAS5Pipeline(Pipeline):
     def _generate_processed_filename(self, issued_date, leadtime):
         return f"precip_em_i{issued_date}_lt{leadtime}.tif"
 
+    def _s3_path(self, filename):
+        aws_filename = filename.split(".")[0]  # File on AWS doesn't have `.grib`
+        return f"s3://{self.aws_bucket_name}/ecmwf/{aws_filename}"
+
     def query_api(self, year, issued_month=None, fc_month=None):
         if year >= 2024:
             filename = self._generate_raw_filename(year, issued_month, fc_month)
-            aws_filename = filename.split(".")[0]  # File on AWS doesn't have `.grib`
-            s3_path = f"s3://{self.aws_bucket_name}/ecmwf/{aws_filename}"
-            fs = fsspec.filesystem("s3")
-            with fs.open(s3_path) as f:
-                with open(self.local_raw_dir / filename, "wb") as temp_file:
-                    temp_file.write(f.read())
+            if filename in self._prefetched:
+                self._prefetched.discard(filename)
+            else:
+                errors = fetch_s3_objects(
+                    s3_filesystem(),
+                    {self._s3_path(filename): self.local_raw_dir / filename},
+                )
+                if errors:
+                    raise errors[self._s3_path(filename)]
         else:
             filename = self._generate_raw_filename(year)
             bbox_str = "/".join(
@@ -100,36 +136,50 @@ class SEAS5Pipeline(Pipeline):
         return filename
 
     def process_data(self, raw_filename, year):
+        if self.grib_decoder == "eccodes":
+            return self.stream_data(raw_filename, year)
+
         raw_file_path = self.local_raw_dir / raw_filename
 
         # 2024 data from AWS source will just have `number`, `latitude`, and `longitude` dimensions
         # The month and fc_month are in the filename. Whereas the archived data pre 2024
         # will also contain `forecastMonth` and `time` dimensions that need to be parsed.
-        if year >= 2024:
-            ds = xr.open_dataset(
-                raw_file_path,
-                engine="cfgrib",
-                filter_by_keys={"dataType": "fcmean"},
-                indexpath=(""),
-            )
-        else:
-            ds = xr.open_dataset(
-                raw_file_path,
-                engine="cfgrib",
-                drop_variables=["surface", "values"],
-                backend_kwargs=dict(
-                    time_dims=("time", "forecastMonth"), indexpath=("")
-                ),
-            )
+        with self.cfgrib_indexpath(raw_file_path) as indexpath:
+            if year >= 2024:
+                ds = xr.open_dataset(
+                    raw_file_path,
+                    engine="cfgrib",
+                    filter_by_keys={"dataType": "fcmean"},
+                    indexpath=indexpath,
+                )
+            else:
+                ds = xr.open_dataset(
+                    raw_file_path,
+                    engine="cfgrib",
+                    drop_variables=["surface", "values"],
+                    backend_kwargs=dict(
+                        time_dims=("time", "forecastMonth"), indexpath=indexpath
+                    ),
+                )
 
         # Take the ensemble mean and convert from total precipitation rate (tprate)
-        # to total precipitation. See `tprate` description here:
-        # https://codes.ecmwf.int/grib/param-db/260048
-        ds_mean = ds.mean(dim="number")
-        ds_mean = ds_mean * 1000 * 3600 * 24
-        ds_mean = ds_mean.rename(
-            {"tprate": "total precipitation", "latitude": "y", "longitude": "x"}
+        # to total precipitation, folding in one member at a time. The members
+        # are only read by the shared compute of all outputs, see
+        # `save_processed_outputs`
+        tprate = ds["tprate"]
+        template = tprate.isel(number=0, drop=True)
+
+        def members():
+            for number in tprate["number"].values:
+                yield tprate.sel(number=number).values
+
+        reducer = DelayedEnsembleReducer(
+            members, template.shape, **self._reducer_options(template)
         )
+        ds_mean = template.copy(data=reducer.mean().astype("float32"))
+        ds_mean = ds_mean.to_dataset(name="total precipitation")
+        ds_mean = ds_mean.rename({"latitude": "y", "longitude": "x"})
+        products = self._ensemble_products(reducer, template)
 
         # Picking up dates from file metadata and checking year
         date_issued = pd.Timestamp(ds_mean['time'].values)
@@ -145,39 +195,196 @@ class SEAS5Pipeline(Pipeline):
             ds_mean, filename = self.process_after_2024(
                 ds_mean, date_issued, date_valid
             )
-            self.save_processed_data(ds_mean, filename)
+            outputs = [self._product_output(ds_mean, filename)]
+            for folder, product in products.items():
+                product, _ = self.process_after_2024(product, date_issued, date_valid)
+                outputs.append(self._product_output(product, filename, folder))
+            self.save_processed_outputs(outputs)
 
         # This data will be coming from the MARS API
         else:
+            # All the leadtimes of the year are written together, see
+            # `save_processed_outputs`
             issued_dates = ds_mean.time.values
             forecast_months = ds_mean.forecastMonth.values
+            outputs = []
             for issued_date in issued_dates:
                 issued_date_formatted = pd.to_datetime(issued_date).strftime("%Y-%m-%d")
                 ds_sel = ds_mean.sel({"time": issued_date})
                 for month in forecast_months:
-                    leadtime = month - 1
-                    filename = self._generate_processed_filename(
-                        issued_date_formatted, leadtime
-                    )
-
                     ds_sel_month = ds_sel.sel({"forecastMonth": month})
-                    ds_sel_month = ds_sel_month.rio.write_crs(
-                        "EPSG:4326", inplace=False
+                    outputs.append(
+                        self._leadtime_output(
+                            ds_sel_month, issued_date_formatted, month - 1
+                        )
                     )
+                    for folder, product in products.items():
+                        product = product.sel(
+                            {"time": issued_date, "forecastMonth": month}
+                        )
+                        outputs.append(
+                            self._leadtime_output(
+                                product, issued_date_formatted, month - 1, folder
+                            )
+                        )
+            self.save_processed_outputs(outputs)
 
-                    issued_year = int(issued_date_formatted[:4])
-                    issued_month = int(issued_date_formatted[5:7])
-                    self.metadata["year_issued"] = issued_year
-                    self.metadata["month_issued"] = issued_month
-                    self.metadata["year_valid"] = leadtime_utils.to_fc_year(
-                        issued_month, issued_year, leadtime
-                    )
-                    self.metadata["month_valid"] = leadtime_utils.to_fc_month(
-                        issued_month, leadtime
+    def _reducer_options(self, template):
+        """Options of the ensemble reducer of the grids of `template`"""
+        return {
+            "percentiles": self.ensemble_products.get("percentiles") or (),
+            "terciles": self._terciles_for(template),
+            "scale": TPRATE_TO_MM_DAY,
+        }
+
+    def _load_tercile_thresholds(self):
+        """
+        Tercile thresholds of precipitation (mm/day) by valid month, from the
+        NetCDF `tercile_thresholds` in the raw path, with `lower` and `upper`
+        variables on `month`, `latitude` and `longitude` dimensions.
+        """
+        filename = self.ensemble_products.get("tercile_thresholds")
+        if not filename:
+            return None
+        if self._tercile_thresholds is None:
+            if self.mode != "local":
+                self.get_raw_data_from_blob(filename)
+            with xr.open_dataset(self.local_raw_dir / filename) as ds:
+                self._tercile_thresholds = ds[["lower", "upper"]].load()
+        return self._tercile_thresholds
+
+    def _terciles_for(self, template):
+        """
+        Tercile thresholds matching the grids of `template`, which has
+        `valid_time` coordinates, or None if there are none configured.
+        """
+        thresholds = self._load_tercile_thresholds()
+        if thresholds is None:
+            return None
+        # See `process_data` on why the valid month is a month before `valid_time`
+        valid_month = (template["valid_time"].dt.month - 2) % 12 + 1
+        thresholds = thresholds.sel(
+            latitude=template["latitude"],
+            longitude=template["longitude"],
+            method="nearest",
+        ).sel(month=valid_month)
+        return tuple(
+            thresholds[name].transpose(*template.dims).values
+            for name in ("lower", "upper")
+        )
+
+    def _ensemble_products(self, reducer, template):
+        """
+        Products derived from the ensemble, besides its mean, as Datasets
+        like `template` by folder: `spread` (standard deviation of the
+        members), `percentiles` (one variable per percentile) and `terciles`
+        (probabilities of below normal, near normal and above normal
+        precipitation).
+        """
+        def dataset(variables):
+            return xr.Dataset(
+                {
+                    name: template.copy(data=values.astype("float32"))
+                    for name, values in variables.items()
+                }
+            ).rename({"latitude": "y", "longitude": "x"})
+
+        products = {}
+        if self.ensemble_products.get("spread"):
+            products["spread"] = dataset({"total precipitation": reducer.spread()})
+        if self.ensemble_products.get("percentiles"):
+            products["percentiles"] = dataset(
+                {
+                    f"p{percentile:g}": values
+                    for percentile, values in reducer.percentiles().items()
+                }
+            )
+        if reducer.terciles is not None:
+            below, near, above = reducer.tercile_probabilities()
+            products["terciles"] = dataset(
+                {"below normal": below, "near normal": near, "above normal": above}
+            )
+        return products
+
+    def _product_output(self, ds, filename, folder=None):
+        """
+        Output for `save_processed_outputs`, with a copy of the metadata of
+        the current leadtime.
+        """
+        ds.attrs = dict(self.metadata)
+        if folder == "terciles":
+            ds.attrs["units"] = "probability"
+        return ds, filename, folder
+
+    def _leadtime_output(self, ds, issued_date_formatted, leadtime, folder=None):
+        filename = self._generate_processed_filename(issued_date_formatted, leadtime)
+        ds = ds.rio.write_crs("EPSG:4326", inplace=False)
+
+        issued_year = int(issued_date_formatted[:4])
+        issued_month = int(issued_date_formatted[5:7])
+        self.metadata["year_issued"] = issued_year
+        self.metadata["month_issued"] = issued_month
+        self.metadata["year_valid"] = leadtime_utils.to_fc_year(
+            issued_month, issued_year, leadtime
+        )
+        self.metadata["month_valid"] = leadtime_utils.to_fc_month(
+            issued_month, leadtime
+        )
+        self.metadata["leadtime"] = leadtime
+        ds = raster_utils.round_lat_lon(ds, "y", "x")
+        return self._product_output(ds, filename, folder)
+
+    def stream_data(self, raw_filename, year):
+        """
+        Process a GRIB file message by message with ecCodes, instead of
+        opening it whole with cfgrib.
+
+        The members of each (issue date, forecast month) are reduced as they
+        are read, and each leadtime is saved as soon as all its members are,
+        so only one reducer per leadtime being read is held in memory.
+        """
+        raw_file_path = self.local_raw_dir / raw_filename
+        filter_keys = {"dataType": "fcmean"} if year >= 2024 else None
+
+        def reducer(key, latitudes, longitudes):
+            data_date, forecast_month = key
+            issued = pd.to_datetime(str(data_date), format="%Y%m%d")
+            valid = issued + pd.DateOffset(months=int(forecast_month))
+            template = xr.DataArray(
+                np.empty((len(latitudes), len(longitudes))),
+                dims=("latitude", "longitude"),
+                coords={"latitude": latitudes, "longitude": longitudes},
+            ).assign_coords(valid_time=valid)
+            return EnsembleReducer(**self._reducer_options(template))
+
+        groups = iter_message_groups(
+            raw_file_path, ("dataDate", "forecastMonth"), filter_keys, reducer
+        )
+        for (data_date, forecast_month), group, latitudes, longitudes in groups:
+            date_issued = pd.to_datetime(str(data_date), format="%Y%m%d")
+            if date_issued.year != year:
+                raise ValueError(
+                    f"Year mismatch: The year in the file {date_issued.year} "
+                    f"and the current year {year} do not match."
+                )
+
+            template = xr.DataArray(
+                group.mean().astype("float32"),
+                dims=("latitude", "longitude"),
+                coords={"latitude": latitudes, "longitude": longitudes},
+            )
+            ds = template.to_dataset(name="total precipitation")
+            ds = ds.rename({"latitude": "y", "longitude": "x"})
+            issued_date_formatted = date_issued.strftime("%Y-%m-%d")
+            leadtime = forecast_month - 1
+            outputs = [self._leadtime_output(ds, issued_date_formatted, leadtime)]
+            for folder, product in self._ensemble_products(group, template).items():
+                outputs.append(
+                    self._leadtime_output(
+                        product, issued_date_formatted, leadtime, folder
                     )
-                    self.metadata["leadtime"] = leadtime
-                    ds_sel_month = raster_utils.round_lat_lon(ds_sel_month, "y", "x")
-                    self.save_processed_data(ds_sel_month, filename)
+                )
+            self.save_processed_outputs(outputs)
 
     def process_after_2024(self, ds_mean, date_issued, date_valid):
         self.metadata["month_issued"] = date_issued.month
@@ -201,65 +408,148 @@ class SEAS5Pipeline(Pipeline):
         )
         return ds_mean, filename
 
+    def _prefetch_s3(self, units):
+        """
+        Download the S3 files of all the units from 2024 on at once, with up to
+        `self.download_concurrency` objects in flight, so that eg. the seven
+        files of a monthly update take about as long as one.
+
+        Units whose raw files are read from blob storage (`use_cache`), which
+        may also be skipped as current, are left to `get_raw_data`. Files that
+        fail are downloaded again by `query_api`.
+        """
+        if self.use_cache:
+            return
+        files = {}
+        for unit in units:
+            if unit["year"] < 2024:
+                continue
+            filename = self._generate_raw_filename(**unit)
+            files[self._s3_path(filename)] = self.local_raw_dir / filename
+        if not files:
+            return
+
+        self.logger.info(f"Downloading {len(files)} files from S3...")
+        errors = fetch_s3_objects(
+            s3_filesystem(), files, max_concurrency=self.download_concurrency
+        )
+        for s3_path, error in errors.items():
+            self.logger.warning(f"Failed downloading {s3_path}: {error}")
+        self._prefetched.update(
+            local_path.name
+            for s3_path, local_path in files.items()
+            if s3_path not in errors
+        )
+
+    def run_work_units(self, units):
+        units = list(units)
+        self._prefetch_s3(units)
+        return super().run_work_units(units)
+
+    def _process_work_unit(self, raw_filename, unit):
+        self.process_data(raw_filename, unit["year"])
+
+    def _unit_outputs(self, unit):
+        year = unit["year"]
+        if year >= 2024:
+            issued_months = [unit["issued_month"]]
+            leadtimes = [
+                leadtime_utils.to_leadtime(unit["issued_month"], unit["fc_month"])
+            ]
+        else:
+            issued_months = range(1, 13)
+            leadtimes = range(7)
+        filenames = [
+            self._generate_processed_filename(f"{year}-{month:02}-01", leadtime)
+            for month in issued_months
+            for leadtime in leadtimes
+        ]
+        folders = [
+            folder
+            for folder, enabled in (
+                ("spread", self.ensemble_products.get("spread")),
+                ("percentiles", self.ensemble_products.get("percentiles")),
+                ("terciles", self.ensemble_products.get("tercile_thresholds")),
+            )
+            if enabled
+        ]
+        return filenames + [
+            f"{folder}/{filename}" for folder in folders for filename in filenames
+        ]
+
+    def _plan_backfill(self, missing_dates):
+        """
+        Work units to backfill `missing_dates` with as few upstream requests as
+        possible: a single MARS request (and raw file) per year before 2024,
+        and each S3 file of the missing issue dates once from 2024 on.
+        """
+        units = {}
+        for missing_date in missing_dates:
+            year = missing_date.year
+            if year < 2024:
+                units.setdefault((year,), {"year": year})
+                continue
+            for fc_month in leadtime_utils.leadtime_months(
+                missing_date.month, MAX_LEADTIME_MONTHS
+            ):
+                unit = {
+                    "year": year,
+                    "issued_month": missing_date.month,
+                    "fc_month": fc_month,
+                }
+                units.setdefault(tuple(unit.values()), unit)
+        return list(units.values())
+
     def run_pipeline(self):
         today = datetime.today()
         cur_year = today.year
         this_month = today.month
-        max_leadtime_months = 7
 
         self.logger.info(f"Running SEAS5 pipeline in {self.mode} mode...")
 
+        if self.is_update:
+            units = [
+                {"year": cur_year, "issued_month": this_month, "fc_month": fc_month}
+                for fc_month in leadtime_utils.leadtime_months(
+                    this_month, MAX_LEADTIME_MONTHS
+                )
+            ]
+        else:
+            units = []
+            for year in range(self.start_year, self.end_year + 1):
+                # TODO: May need updating when cur_year > 2024
+                if year == cur_year:
+                    units += [
+                        {"year": cur_year, "issued_month": month, "fc_month": fc_month}
+                        for month in range(1, this_month + 1)
+                        for fc_month in leadtime_utils.leadtime_months(
+                            month, MAX_LEADTIME_MONTHS
+                        )
+                    ]
+                else:
+                    units.append({"year": year})
+
         if self.backfill:
             self.logger.info("Checking for missing data and backfilling if needed...")
             missing_dates, coverage_pct = self.check_coverage()
             self.print_coverage_report()
-            if missing_dates:
-                for missing_date in missing_dates:
-                    self.logger.debug(f"Getting data for {missing_date}...")
-                    missing_month = missing_date.month
-                    missing_year = missing_date.year
-                    for fc_month in leadtime_utils.leadtime_months(
-                        missing_month, max_leadtime_months
-                    ):
-                        raw_filename = self.get_raw_data(
-                            year=missing_year,
-                            issued_month=missing_month,
-                            fc_month=fc_month,
-                        )
-                        self.process_data(raw_filename, missing_year)
+            # Raw files processed below anyway aren't backfilled separately
+            backfill_units = [
+                unit
+                for unit in self._plan_backfill(missing_dates)
+                if unit not in units and {"year": unit["year"]} not in units
+            ]
+            if backfill_units:
+                self.run_work_units(backfill_units)
 
         # Run for the latest available date
         if self.is_update:
             self.logger.info("Retrieving SEAS5 data from this month...")
-            for fc_month in leadtime_utils.leadtime_months(
-                this_month, max_leadtime_months
-            ):
-                raw_filename = self.get_raw_data(
-                    year=cur_year, issued_month=this_month, fc_month=fc_month
-                )
-                self.process_data(raw_filename, cur_year)
         else:
             self.logger.info(
                 f"Retrieving SEAS5 data from {self.start_year} to {self.end_year}..."
             )
-            for year in range(self.start_year, self.end_year + 1):
-                # TODO: May need updating when cur_year > 2024
-                if year == cur_year:
-                    for month in range(1, this_month + 1):
-                        for fc_month in leadtime_utils.leadtime_months(
-                            month, max_leadtime_months
-                        ):
-                            raw_filename = self.get_raw_data(
-                                year=cur_year, issued_month=month, fc_month=fc_month
-                            )
-                            self.process_data(
-                                raw_filename,
-                                year,
-                                issued_month=month,
-                                fc_month=fc_month,
-                            )
-                else:
-                    raw_filename = self.get_raw_data(year=year)
-                    self.process_data(raw_filename, year)
+        self.run_work_units(units)
 
+        self.finish_run()
         self.logger.info("Completed SEAS5 update.")
@@ -0,0 +1,139 @@
+import argparse
+from pathlib import Path
+
+import pandas as pd
+import rioxarray as rxr
+
+from src.scripts.run_coverage import PIPELINES, create_pipeline
+from src.utils.azure_utils import download_from_azure
+from src.utils.cog_utils import BENCHMARK_PROFILES, benchmark_profile
+from src.utils.grib_utils import benchmark_grib_open
+
+
+def parse_arguments(base_parser):
+    parser = argparse.ArgumentParser(parents=[base_parser])
+    parser.add_argument(
+        "pipelines",
+        nargs="*",
+        help=f"Pipelines whose latest output is benchmarked, from {PIPELINES} "
+        "(default: all)",
+    )
+    parser.add_argument(
+        "--files",
+        nargs="+",
+        default=[],
+        help="Local rasters to benchmark, instead of or in addition to pipeline outputs",
+    )
+    parser.add_argument(
+        "--grib",
+        nargs="+",
+        default=[],
+        help="Local GRIB files (eg. yearly SEAS5 files) whose cfgrib open latency is "
+        "benchmarked with and without the GRIB index cache, instead of COG profiles",
+    )
+    parser.add_argument(
+        "--grib-time-dims",
+        nargs="+",
+        default=["time", "forecastMonth"],
+        help="cfgrib time dimensions of the GRIB files (default: those of SEAS5 "
+        "MARS files)",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=1,
+        help="Number of the most recent outputs of each pipeline to benchmark",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of runs per profile; the fastest is reported",
+    )
+    parser.add_argument(
+        "--imerg-run",
+        choices=["early", "late"],
+        default="late",
+        help="IMERG run to benchmark",
+    )
+    args = parser.parse_args()
+    unknown = set(args.pipelines) - set(PIPELINES)
+    if unknown:
+        parser.error(f"Unknown pipelines: {sorted(unknown)}")
+    return args
+
+
+def latest_outputs(pipeline, count=1):
+    """Get local copies of the `count` most recent processed COGs of a pipeline."""
+    entries = pipeline._get_existing_files()
+    filenames = [filename for filename in entries if "/" not in filename]
+    filenames = sorted(filenames, key=lambda filename: entries[filename]["date"])
+    paths = []
+    for filename in filenames[-count:]:
+        local_path = pipeline.local_processed_dir / filename
+        if pipeline.mode != "local":
+            local_path = download_from_azure(
+                pipeline.blob_service_client,
+                pipeline.container_name,
+                pipeline.processed_path / filename,
+                local_path,
+            )
+        if local_path:
+            paths.append(Path(local_path))
+    return paths
+
+
+def benchmark_grib(args):
+    rows = []
+    for file in args.grib:
+        print(f"Benchmarking cfgrib opens of {file}...")
+        result = benchmark_grib_open(
+            file, args.repeats, time_dims=tuple(args.grib_time_dims)
+        )
+        rows.append({"file": Path(file).name, **result})
+    report = pd.DataFrame(rows)
+    report["speedup"] = report["no_index_s"] / report["cached_s"]
+    with pd.option_context("display.width", 120, "display.max_rows", None):
+        print(report.round(4).to_string(index=False))
+
+
+def main(base_parser):
+    args = parse_arguments(base_parser)
+    if args.grib:
+        benchmark_grib(args)
+        return
+    names = args.pipelines or ([] if args.files else PIPELINES)
+
+    samples = [(Path(file).name, Path(file), {}) for file in args.files]
+    for name in names:
+        pipeline = create_pipeline(name, args)
+        paths = latest_outputs(pipeline, args.samples)
+        if not paths:
+            print(f"No processed outputs found for {name}, skipping")
+            continue
+        profiles = {}
+        if pipeline.cog_profile:
+            profiles[f"{name}_config"] = pipeline.cog_profile
+            profiles[f"{name}_config_sparse"] = {**pipeline.cog_profile, "sparse": True}
+        samples.extend((name, path, profiles) for path in paths)
+
+    rows = []
+    for sample, path, configured in samples:
+        da = rxr.open_rasterio(path).load()
+        print(f"Benchmarking {sample} ({path.name}, {da.shape}, {da.dtype})...")
+        for profile_name, profile in {**BENCHMARK_PROFILES, **configured}.items():
+            result = benchmark_profile(da, profile, args.repeats)
+            rows.append({"sample": sample, "profile": profile_name, **result})
+
+    if not rows:
+        print("Nothing to benchmark")
+        return
+    report = pd.DataFrame(rows)
+    report["size_mb"] = report.pop("size_bytes") / 1e6
+    with pd.option_context("display.width", 120, "display.max_rows", None):
+        print(report.round(4).to_string(index=False))
+        # Averages over the samples of each pipeline, eg. several days
+        summary = report.groupby(["sample", "profile"], sort=False).mean(
+            numeric_only=True
+        )
+        print(summary.round(4).to_string())
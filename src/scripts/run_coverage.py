@@ -0,0 +1,95 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+from src.config.settings import load_pipeline_config
+from src.pipelines.era5_pipeline import ERA5Pipeline
+from src.pipelines.floodscan_pipeline import FloodScanPipeline
+from src.pipelines.imerg_pipeline import IMERGPipeline
+from src.pipelines.seas5_pipeline import SEAS5Pipeline
+from src.utils.date_utils import DATE_FORMAT
+
+PIPELINES = ["era5", "floodscan", "imerg", "seas5"]
+
+
+def parse_arguments(base_parser):
+    parser = argparse.ArgumentParser(parents=[base_parser])
+    parser.add_argument(
+        "pipelines",
+        nargs="*",
+        help=f"Pipelines to check coverage for, from {PIPELINES}",
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="Check coverage for all pipelines"
+    )
+    parser.add_argument(
+        "--imerg-run",
+        choices=["early", "late"],
+        default="late",
+        help="IMERG run to check coverage for",
+    )
+    args = parser.parse_args()
+    if not args.all and not args.pipelines:
+        parser.error("Specify pipelines to check or use --all")
+    unknown = set(args.pipelines) - set(PIPELINES)
+    if unknown:
+        parser.error(f"Unknown pipelines: {sorted(unknown)}")
+    return args
+
+
+def create_pipeline(name, args):
+    """Create a pipeline with the settings needed to check its coverage."""
+    settings = load_pipeline_config(name)
+    yesterday = (datetime.today() - pd.DateOffset(days=1)).strftime(DATE_FORMAT)
+    settings.update(
+        {
+            "mode": args.mode,
+            "log_level": args.log_level,
+            "use_cache": False,
+            "backfill": False,
+        }
+    )
+    if name == "era5":
+        return ERA5Pipeline(is_update=False, start_year=None, end_year=None, **settings)
+    if name == "seas5":
+        return SEAS5Pipeline(
+            is_update=False, start_year=None, end_year=None, **settings
+        )
+    if name == "imerg":
+        settings.update(
+            {
+                "run": args.imerg_run,
+                "version": 7,
+                "start_date": yesterday,
+                "end_date": yesterday,
+                "create_auth_files": False,
+            }
+        )
+        return IMERGPipeline(**settings)
+    settings.update(
+        {
+            "is_update": False,
+            "baseline_update": False,
+            "start_date": yesterday,
+            "end_date": yesterday,
+            "version": 5,
+        }
+    )
+    return FloodScanPipeline(**settings)
+
+
+def main(base_parser):
+    args = parse_arguments(base_parser)
+    names = PIPELINES if args.all else list(dict.fromkeys(args.pipelines))
+    pipelines = [create_pipeline(name, args) for name in names]
+
+    # Coverage checks are I/O bound, so run them all at once
+    with ThreadPoolExecutor(max_workers=len(pipelines)) as executor:
+        summaries = list(
+            executor.map(lambda pipeline: pipeline.get_coverage_summary(), pipelines)
+        )
+
+    for pipeline, summary in zip(pipelines, summaries):
+        pipeline.print_coverage_report(summary=summary)
@@ -43,12 +43,29 @@ def parse_arguments(base_parser):
         type=int,
         default=int(today.year),
     )
+    parser.add_argument(
+        "--incremental-baseline",
+        action="store_true",
+        help="With --baseline-update, reuse the persisted sums of years already "
+        "in a previous baseline and only read the daily COGs of the other years",
+    )
     parser.add_argument(
         "--backfill",
         action="store_true",
         help="Whether to check and backfill for any missing dates (only 2024 onwards)",
     )
     parser.add_argument("--update", action="store_true", help="Run in update mode")
+    parser.add_argument(
+        "--convert-historical",
+        action="store_true",
+        help="Convert the historical NetCDFs to a day-chunked Zarr store and exit",
+    )
+    parser.add_argument(
+        "--range-read",
+        action="store_true",
+        help="Read the needed days from the 90-day zips in blob storage with "
+        "range requests instead of downloading the zips (2024 onwards)",
+    )
     return parser.parse_args()
 
 
@@ -60,14 +77,39 @@ def main(base_parser):
             "mode": args.mode,
             "is_update": args.update,
             "baseline_update": args.baseline_update,
+            "baseline_incremental": args.incremental_baseline,
             "backfill": args.backfill,
             "start_date": args.start_date,
             "end_date": args.end_date,
             "version": args.version,
             "log_level": args.log_level,
             "use_cache": args.use_cache,
+            "workers": args.workers,
+            "stream": args.stream,
+            "prefetch": args.prefetch,
+            "raw_cache_dir": args.cache_dir,
+            "raw_cache_size_gb": args.cache_size_gb,
+            "force": args.force,
+            "in_memory": args.in_memory,
+            "memory_threshold_mb": args.memory_threshold_mb,
+            "download_concurrency": args.download_concurrency,
+            "download_chunk_mb": args.download_chunk_mb,
+            "sparse": args.sparse,
+            "write_workers": args.write_workers,
+            "range_read": args.range_read,
         }
     )
 
     pipeline = FloodScanPipeline(**settings)
-    pipeline.run_pipeline()
+    if args.reconcile_manifest:
+        pipeline.reconcile_manifest()
+        return
+    if args.convert_historical:
+        pipeline.convert_historical_to_zarr()
+        return
+    try:
+        pipeline.run_pipeline()
+    finally:
+        # Outputs written before an error are still recorded in the manifest
+        pipeline.flush_manifest()
+    pipeline.log_cache_stats()
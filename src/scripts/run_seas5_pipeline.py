@@ -33,8 +33,28 @@ def main(base_parser):
             "end_year": args.end_year,
             "log_level": args.log_level,
             "use_cache": args.use_cache,
+            "workers": args.workers,
+            "stream": args.stream,
+            "prefetch": args.prefetch,
+            "raw_cache_dir": args.cache_dir,
+            "raw_cache_size_gb": args.cache_size_gb,
+            "force": args.force,
+            "in_memory": args.in_memory,
+            "memory_threshold_mb": args.memory_threshold_mb,
+            "download_concurrency": args.download_concurrency,
+            "download_chunk_mb": args.download_chunk_mb,
+            "sparse": args.sparse,
+            "write_workers": args.write_workers,
         }
     )
 
     pipeline = SEAS5Pipeline(**settings)
-    pipeline.run_pipeline()
+    if args.reconcile_manifest:
+        pipeline.reconcile_manifest()
+        return
+    try:
+        pipeline.run_pipeline()
+    finally:
+        # Outputs written before an error are still recorded in the manifest
+        pipeline.flush_manifest()
+    pipeline.log_cache_stats()
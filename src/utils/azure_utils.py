@@ -1,20 +1,47 @@
+import hashlib
+import json
 import logging
+import math
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
 
 import coloredlogs
+import requests
+from adlfs import AzureBlobFileSystem
+from azure.core import MatchConditions
 from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob import (
-    BlobClient,
-    BlobServiceClient,
-    ContentSettings,
-    StandardBlobTier,
-)
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient, ContentSettings, StandardBlobTier
 
 from ..config.settings import (
     SAS_TOKEN_DEV,
     SAS_TOKEN_PROD,
     STORAGE_ACCOUNT_DEV,
     STORAGE_ACCOUNT_PROD,
+    STORAGE_CONNECTION_STRING_DEV,
+    STORAGE_CONNECTION_STRING_PROD,
+    STORAGE_ENDPOINT_DEV,
+    STORAGE_ENDPOINT_PROD,
 )
+from .file_utils import atomic_write
+
+# Defaults for ranged downloads of raw inputs
+DOWNLOAD_CONCURRENCY = 8
+DOWNLOAD_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Size of the connection pool shared by all requests to a storage account
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 32
+
+# Clients shared by all pipelines of a process, see `blob_client()`
+_service_clients = {}
+_container_clients = {}
+_clients_lock = threading.Lock()
 
 logger = logging.getLogger(__name__)
 coloredlogs.install(
@@ -25,31 +52,65 @@ coloredlogs.install(
 
 
 def download_from_azure(
-    blob_service_client, container_name, blob_path, local_file_path
+    blob_service_client,
+    container_name,
+    blob_path,
+    local_file_path,
+    max_concurrency=DOWNLOAD_CONCURRENCY,
+    chunk_size=DOWNLOAD_CHUNK_SIZE,
+    partial_dir=None,
 ):
     """
     Download a file from Azure Blob Storage.
 
+    The blob is downloaded in ranged chunks of `chunk_size` bytes, up to
+    `max_concurrency` at a time, which are written straight to a `.part` file
+    in `partial_dir` (next to `local_file_path` by default). Finished chunks
+    are recorded alongside it, so an interrupted download of the same blob
+    version resumes where it left off, as long as `partial_dir` outlives the
+    run (eg. under the raw cache directory).
+
+    The file is checked against the blob's Content-MD5 before being moved
+    into place. Blobs uploaded in blocks usually have none, and are checked
+    for the size of each chunk instead, every chunk being read from the same
+    version (ETag) of the blob.
+
     Args:
     blob_service_client (BlobServiceClient): The Azure Blob Service Client
     container_name (str): The name of the container
     blob_path (str or Path): The path of the blob in the container
     local_file_path (str or Path): The local path where the file should be saved
+    max_concurrency (int): Number of chunks downloaded in parallel
+    chunk_size (int): Size in bytes of each ranged request
+    partial_dir (str or Path): Directory of partial downloads
 
     Returns:
-    bool: True if download was successful, False otherwise
+    The local file path if download was successful, None otherwise
     """
     try:
         # Get the blob client
         blob_client = blob_service_client.get_blob_client(
             container=container_name, blob=str(blob_path)
         )
+        properties = blob_client.get_blob_properties()
 
-        # Download the blob
-        with open(local_file_path, "wb") as download_file:
-            download_file.write(blob_client.download_blob().readall())
+        start = time.monotonic()
+        part_path = _part_path(container_name, blob_path, local_file_path, partial_dir)
+        n_bytes = _download_chunks(
+            blob_client,
+            properties,
+            local_file_path,
+            max_concurrency,
+            chunk_size,
+            part_path,
+        )
+        elapsed = max(time.monotonic() - start, 1e-6)
 
-        logger.info(f"Successfully downloaded blob {blob_path} to {local_file_path}")
+        logger.info(
+            f"Successfully downloaded blob {blob_path} to {local_file_path} "
+            f"({n_bytes / 1e6:.1f} MB in {elapsed:.1f}s, "
+            f"{n_bytes / 1e6 / elapsed:.1f} MB/s)"
+        )
         return local_file_path
 
     except ResourceNotFoundError:
@@ -61,41 +122,239 @@ def download_from_azure(
     return None
 
 
-def blob_client(mode):
-    if mode == "dev":
-        storage_account = STORAGE_ACCOUNT_DEV
-        sas_token = SAS_TOKEN_DEV
+def _part_path(container_name, blob_path, local_file_path, partial_dir=None):
+    """
+    Path of the partial download of a blob. In a shared `partial_dir`, it is
+    named after the blob, so that any later download of it can resume.
+    """
+    local_file_path = Path(local_file_path)
+    if partial_dir is None:
+        return local_file_path.with_name(local_file_path.name + ".part")
+    partial_dir = Path(partial_dir)
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    blob_hash = hashlib.sha256(
+        f"{container_name}/{Path(blob_path).as_posix()}".encode()
+    ).hexdigest()[:16]
+    return partial_dir / f"{blob_hash}.{local_file_path.name}.part"
+
+
+def _download_chunks(
+    blob_client, properties, local_file_path, max_concurrency, chunk_size, part_path
+):
+    """
+    Download the chunks of a blob that are missing from its `.part` file, then
+    verify it and move it to `local_file_path`.
+
+    Returns:
+        (int): Number of bytes downloaded, excluding resumed chunks
+    """
+    local_file_path = Path(local_file_path)
+    state_path = part_path.with_name(part_path.name + ".json")
+    size = properties.size
+    n_chunks = math.ceil(size / chunk_size)
+
+    state = {"etag": properties.etag, "size": size, "chunk_size": chunk_size}
+    done = set()
+    if part_path.exists() and state_path.exists():
+        with open(state_path, "r") as state_file:
+            previous = json.load(state_file)
+        if all(previous.get(key) == value for key, value in state.items()):
+            done = set(previous["done"])
+            logger.info(
+                f"Resuming download of {local_file_path.name}: "
+                f"{len(done)}/{n_chunks} chunks already downloaded"
+            )
+    if not done:
+        with open(part_path, "wb") as part_file:
+            part_file.truncate(size)
+
+    state_lock = threading.Lock()
+
+    def download_chunk(fd, index):
+        offset = index * chunk_size
+        length = min(chunk_size, size - offset)
+        # Fail rather than mix chunks of two versions if the blob is overwritten
+        data = blob_client.download_blob(
+            offset=offset,
+            length=length,
+            etag=properties.etag,
+            match_condition=MatchConditions.IfNotModified,
+        ).readall()
+        if len(data) != length:
+            raise ValueError(
+                f"Short read of {local_file_path.name} at {offset}: "
+                f"{len(data)} of {length} bytes"
+            )
+        os.pwrite(fd, data, offset)
+        with state_lock:
+            done.add(index)
+            atomic_write(state_path, json.dumps({**state, "done": sorted(done)}))
+        return len(data)
+
+    remaining = [index for index in range(n_chunks) if index not in done]
+    fd = os.open(part_path, os.O_WRONLY)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            futures = [executor.submit(download_chunk, fd, i) for i in remaining]
+            try:
+                n_bytes = sum(future.result() for future in futures)
+            except Exception:
+                # Stop early, keeping the chunks already written for a resume
+                executor.shutdown(cancel_futures=True)
+                raise
+    finally:
+        os.close(fd)
+
+    content_md5 = properties.content_settings.content_md5
+    if content_md5:
+        if _file_md5(part_path) != bytes(content_md5):
+            part_path.unlink()
+            state_path.unlink(missing_ok=True)
+            raise ValueError(f"Checksum mismatch for {local_file_path.name}")
+    else:
+        logger.info(
+            f"No Content-MD5 for {local_file_path.name}: only checked the size "
+            f"of each chunk of version {properties.etag}"
+        )
+    if part_path.stat().st_size != size:
+        raise ValueError(f"Size mismatch for {local_file_path.name}")
+
+    # The partial download may be on another filesystem
+    shutil.move(part_path, local_file_path)
+    state_path.unlink(missing_ok=True)
+    return n_bytes
+
+
+def _file_md5(file_path, chunk_size=8 * 1024 * 1024):
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _credentials(mode):
     if mode == "prod":
-        storage_account = STORAGE_ACCOUNT_PROD
-        sas_token = SAS_TOKEN_PROD
-    account_url = f"https://{storage_account}.blob.core.windows.net"
-    return BlobServiceClient(account_url=account_url, credential=sas_token)
+        return STORAGE_ACCOUNT_PROD, SAS_TOKEN_PROD
+    return STORAGE_ACCOUNT_DEV, SAS_TOKEN_DEV
 
 
-def upload_file(
-    sas_token,
+def _connection(mode):
+    """
+    Get the connection string and blob endpoint overriding the default
+    connection (account name and SAS token) to the storage account for
+    `mode`, if any.
+    """
+    if mode == "prod":
+        return STORAGE_CONNECTION_STRING_PROD, STORAGE_ENDPOINT_PROD
+    return STORAGE_CONNECTION_STRING_DEV, STORAGE_ENDPOINT_DEV
+
+
+def _account_url(storage_account, endpoint=None):
+    return (endpoint or f"https://{storage_account}.blob.core.windows.net").rstrip("/")
+
+
+def _pooled_transport():
+    """
+    Create an HTTP transport whose connection pool is large enough for the
+    concurrent uploads and ranged downloads of a pipeline, so that they all
+    reuse warm connections.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return RequestsTransport(session=session, session_owner=False)
+
+
+def blob_client(mode):
+    """
+    Get the `BlobServiceClient` of the storage account for `mode`, from its
+    connection string if one is set, else from its account name (or blob
+    endpoint) and SAS token.
+
+    Clients are created once per process and mode, over a connection-pooled
+    transport, and shared by all callers. They are keyed by process so that
+    forked workers don't share the parent's connections.
+    """
+    key = (os.getpid(), mode)
+    with _clients_lock:
+        if key not in _service_clients:
+            connection_string, endpoint = _connection(mode)
+            if connection_string:
+                _service_clients[key] = BlobServiceClient.from_connection_string(
+                    connection_string, transport=_pooled_transport()
+                )
+            else:
+                storage_account, sas_token = _credentials(mode)
+                _service_clients[key] = BlobServiceClient(
+                    account_url=_account_url(storage_account, endpoint),
+                    credential=sas_token,
+                    transport=_pooled_transport(),
+                )
+        return _service_clients[key]
+
+
+def container_client(mode, container_name):
+    """Get the shared `ContainerClient` of `container_name` for `mode`."""
+    service_client = blob_client(mode)
+    key = (os.getpid(), mode, container_name)
+    with _clients_lock:
+        if key not in _container_clients:
+            _container_clients[key] = service_client.get_container_client(
+                container_name
+            )
+        return _container_clients[key]
+
+
+def blob_filesystem(mode):
+    """
+    Get an fsspec filesystem over the storage account for `mode`, for
+    selective reads and writes of chunked stores (eg. Zarr). Instances are
+    cached by fsspec, so they are shared within a process.
+
+    The storage account is connected to as by `blob_client()`.
+    """
+    connection_string, endpoint = _connection(mode)
+    if connection_string:
+        return AzureBlobFileSystem(connection_string=connection_string)
+    storage_account, sas_token = _credentials(mode)
+    kwargs = {}
+    if endpoint:
+        # adlfs builds the account URL as `https://{account_host}`
+        kwargs["account_host"] = urlparse(endpoint).netloc
+    return AzureBlobFileSystem(
+        account_name=storage_account, sas_token=sas_token, **kwargs
+    )
+
+
+def upload_data_by_mode(
+    mode,
     container_name,
-    storage_account,
-    local_file_path,
+    data,
     blob_path,
     blob_tier=StandardBlobTier.COOL,
     content_type="application/octet-stream",
+    metadata=None,
 ):
     """
-    Uploads a single file from 'local_file_path'
-    to 'blob_path' in Azure Blob Storage.
+    Uploads `data` (bytes or a readable file-like object) to 'blob_path'
+    through the shared client of `dev` vs `prod` mode. Returns the blob
+    properties (including its `etag`) set by the upload.
     """
-    base_url = f"https://{storage_account}.blob.core.windows.net"
-    sas_url = f"{base_url}/{container_name}/{blob_path}" f"?{sas_token}"
-
-    blob_client = BlobClient.from_blob_url(blob_url=sas_url)
-    with open(local_file_path, "rb") as data:
-        blob_client.upload_blob(
+    return (
+        container_client(mode, container_name)
+        .get_blob_client(str(blob_path))
+        .upload_blob(
             data,
             overwrite=True,
             standard_blob_tier=blob_tier,
             content_settings=ContentSettings(content_type=content_type),
+            metadata=metadata,
         )
+    )
 
 
 def upload_file_by_mode(
@@ -105,19 +364,19 @@ def upload_file_by_mode(
     blob_path,
     blob_tier=StandardBlobTier.COOL,
     content_type="application/octet-stream",
+    metadata=None,
 ):
     """
-    A thin wrapper on `upload_file()` that handles credentials according to
-    `dev` vs `prod` mode.
-    """
-    sas_token = SAS_TOKEN_PROD if mode == "prod" else SAS_TOKEN_DEV
-    storage_account = STORAGE_ACCOUNT_PROD if mode == "prod" else STORAGE_ACCOUNT_DEV
-    upload_file(
-        local_file_path=local_file_path,
-        sas_token=sas_token,
-        container_name=container_name,
-        storage_account=storage_account,
-        blob_path=blob_path,
-        blob_tier=blob_tier,
-        content_type=content_type,
-    )
+    Uploads a single file from 'local_file_path' to 'blob_path' through the
+    shared client of `dev` vs `prod` mode.
+    """
+    with open(local_file_path, "rb") as data:
+        return upload_data_by_mode(
+            mode,
+            container_name,
+            data,
+            blob_path,
+            blob_tier=blob_tier,
+            content_type=content_type,
+            metadata=metadata,
+        )
@@ -0,0 +1,192 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+DAYS_IN_YEAR = 366
+# Days on each side of a day of year that contribute to its baseline
+BASELINE_HALF_WINDOW = 5
+# Encoding attributes of the daily grids that don't apply to the sums
+ENCODING_ATTRS = ("_FillValue", "missing_value", "scale_factor", "add_offset")
+
+
+def ordered_bounded_map(func, items, max_workers, max_pending=None):
+    """
+    Apply `func` to `items` concurrently, yielding the results in the order of
+    `items`.
+
+    At most `max_pending` calls (twice `max_workers` by default) are submitted
+    ahead of the result being consumed, so results are held in memory only
+    briefly.
+
+    Args:
+        func (callable): Function of one item
+        items (iterable): Inputs to `func`
+        max_workers (int): Number of threads
+        max_pending (int): Maximum number of calls in flight or not consumed
+
+    Yields:
+        Results of `func`, in order
+    """
+    max_pending = max_pending or 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+class DayOfYearAccumulator:
+    """
+    Running per-day-of-year sums and counts of daily grids, from which a
+    smoothed climatological baseline is derived.
+
+    Memory is proportional to `DAYS_IN_YEAR` grids, however many days are
+    added. Missing (NaN) cells are left out of both the sums and the counts.
+
+    Accumulators of disjoint periods (eg. one per year) can be persisted with
+    `to_dataset()` and combined with `merge()`. Merging the same partials in
+    the same order always gives the same sums, bit for bit.
+
+    `last_date` is the last date covered by the sums, so that the sums of a
+    period that was still ongoing can be told apart from complete ones.
+    """
+
+    def __init__(self):
+        self.sums = None
+        self.counts = None
+        self.template = None
+        self.last_date = None
+
+    def cover(self, date):
+        """Record that the sums cover `date`, even if it had no grid to add."""
+        date = pd.Timestamp(date)
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+
+    def add(self, da, date):
+        """
+        Fold a 2D grid into the sums and counts of its day of year.
+
+        Args:
+            da (xarray.DataArray): Grid with dimensions (y, x)
+            date (datetime): Date of the grid
+        """
+        values = np.asarray(da.values, dtype="float64")
+        if self.template is None:
+            self.template = da.copy(deep=False)
+            self.template.attrs = {
+                k: v for k, v in da.attrs.items() if k not in ENCODING_ATTRS
+            }
+            self.sums = np.zeros((DAYS_IN_YEAR, *values.shape), dtype="float64")
+            self.counts = np.zeros((DAYS_IN_YEAR, *values.shape), dtype="uint16")
+        elif values.shape != self.sums.shape[1:]:
+            raise ValueError(
+                f"Grid for {date} has shape {values.shape}, "
+                f"expected {self.sums.shape[1:]}"
+            )
+
+        doy = date.timetuple().tm_yday - 1
+        valid = ~np.isnan(values)
+        self.sums[doy] += np.where(valid, values, 0)
+        self.counts[doy] += valid
+        self.cover(date)
+
+    def merge(self, other):
+        """Add the sums and counts of another accumulator to this one."""
+        if other.last_date is not None:
+            self.cover(other.last_date)
+        if other.template is None:
+            return
+        if self.template is None:
+            self.template = other.template
+            self.sums = np.zeros_like(other.sums)
+            self.counts = np.zeros_like(other.counts)
+        elif other.sums.shape != self.sums.shape:
+            raise ValueError(
+                f"Cannot merge sums of shape {other.sums.shape} into {self.sums.shape}"
+            )
+        self.sums += other.sums
+        self.counts += other.counts
+
+    def to_dataset(self):
+        """
+        Sums and counts as a Dataset, to persist them (eg. to NetCDF) and
+        restore them with `from_dataset()`.
+        """
+        if self.template is None:
+            raise ValueError("No grids were added to the accumulator")
+        template = self.template
+        dims = ("dayofyear", *template.dims)
+        ds = xr.Dataset(
+            {
+                "sums": (dims, self.sums, template.attrs),
+                "counts": (dims, self.counts),
+            },
+            coords={
+                "dayofyear": np.arange(1, DAYS_IN_YEAR + 1),
+                **{name: coord for name, coord in template.coords.items()},
+            },
+        )
+        ds.attrs["dtype"] = str(template.dtype)
+        if template.name is not None:
+            ds.attrs["name"] = template.name
+        if self.last_date is not None:
+            ds.attrs["last_date"] = self.last_date.strftime("%Y-%m-%d")
+        return ds
+
+    @classmethod
+    def from_dataset(cls, ds):
+        """Restore an accumulator persisted with `to_dataset()`."""
+        accumulator = cls()
+        template = ds["sums"].isel(dayofyear=0, drop=True)
+        accumulator.template = template.astype(ds.attrs["dtype"]).rename(
+            ds.attrs.get("name")
+        )
+        accumulator.sums = ds["sums"].values.astype("float64")
+        accumulator.counts = ds["counts"].values.astype("uint16")
+        if "last_date" in ds.attrs:
+            accumulator.last_date = pd.Timestamp(ds.attrs["last_date"])
+        return accumulator
+
+    def baseline(self, half_window=BASELINE_HALF_WINDOW):
+        """
+        Mean of every value within `half_window` days of each day of year.
+
+        The window wraps around the end of the year (a circular convolution
+        over days of year), so late December and early January smooth into
+        each other.
+
+        Returns:
+            (xarray.DataArray): Baseline with dimensions (dayofyear, y, x)
+        """
+        if self.template is None:
+            raise ValueError("No grids were added to the baseline")
+
+        sums = self.sums.copy()
+        counts = self.counts.astype("uint32")
+        for shift in range(1, half_window + 1):
+            for direction in (shift, -shift):
+                sums += np.roll(self.sums, direction, axis=0)
+                counts += np.roll(self.counts, direction, axis=0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(counts > 0, sums / counts, np.nan)
+
+        template = self.template
+        da = xr.DataArray(
+            mean.astype(template.dtype if template.dtype.kind == "f" else "float64"),
+            dims=("dayofyear", *template.dims),
+            coords={
+                "dayofyear": np.arange(1, DAYS_IN_YEAR + 1),
+                **{name: coord for name, coord in template.coords.items()},
+            },
+            name=template.name,
+            attrs=template.attrs,
+        )
+        return da
@@ -0,0 +1,256 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import coloredlogs
+
+from .file_utils import atomic_write, file_lock
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(
+    level="DEBUG",
+    logger=logger,
+    fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+# Name of the index of a GRIB file that cfgrib reads and writes, with a
+# short hash of the index keys
+CFGRIB_INDEX_NAME = "{short_hash}.idx"
+
+
+def file_checksum(file_path, chunk_size=8 * 1024 * 1024):
+    """
+    Compute the SHA-256 checksum of a file, reading it in chunks.
+
+    Args:
+        file_path (str or Path): Path of the file
+        chunk_size (int): Number of bytes read at a time
+
+    Returns:
+        (str): Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class RawCache:
+    """
+    Persistent cache of raw input files, shared by all jobs on a node.
+
+    Files are stored under a key derived from their source and request
+    parameters (which should include a content identifier, such as the ETag
+    of a blob). The cache is kept under `max_bytes` by evicting the least
+    recently used files, and its index is protected by a lock file so that
+    concurrent jobs can share it.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.index_path = self.cache_dir / "index.json"
+        self.lock_path = self.cache_dir / "index.lock"
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes_served": 0}
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(source, **params):
+        """Create a cache key from a source name and request parameters."""
+        payload = json.dumps({"source": source, **params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _object_path(self, key):
+        return self.objects_dir / key[:2] / key
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, "r") as index_file:
+                return json.load(index_file)
+        except FileNotFoundError:
+            return {"entries": {}, "stats": {"hits": 0, "misses": 0, "evictions": 0}}
+
+    def _write_index(self, index):
+        atomic_write(self.index_path, json.dumps(index))
+
+    def get(self, key, dest_path):
+        """
+        Copy a cached file to `dest_path` if present.
+
+        Returns:
+            (bool): Whether the key was found in the cache
+        """
+        object_path = self._object_path(key)
+        # Hold a private link to the cached file while copying it outside the
+        # lock, so that eviction by another job can't remove it mid-copy
+        link_path = object_path.with_name(
+            f".{key}.{os.getpid()}.{threading.get_ident()}.get"
+        )
+        with file_lock(self.lock_path):
+            index = self._read_index()
+            entry = index["entries"].get(key)
+            hit = entry is not None and object_path.exists()
+            if hit:
+                os.link(object_path, link_path)
+                entry["last_access"] = time.time()
+                self.stats["hits"] += 1
+                self.stats["bytes_served"] += entry["size"]
+                index["stats"]["hits"] += 1
+            else:
+                index["entries"].pop(key, None)
+                self.stats["misses"] += 1
+                index["stats"]["misses"] += 1
+            self._write_index(index)
+
+        if hit:
+            try:
+                shutil.copyfile(link_path, dest_path)
+            finally:
+                link_path.unlink()
+        return hit
+
+    def put(self, key, src_path, **info):
+        """
+        Add a file to the cache, evicting the least recently used files if
+        the cache would exceed its size budget. Files larger than the whole
+        budget are not cached.
+        """
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            logger.warning(f"Not caching {src_path}: larger than the cache budget")
+            return
+
+        object_path = self._object_path(key)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = object_path.with_name(
+            f".{key}.{os.getpid()}.{threading.get_ident()}"
+        )
+        shutil.copyfile(src_path, tmp_path)
+
+        with file_lock(self.lock_path):
+            os.replace(tmp_path, object_path)
+            index = self._read_index()
+            index["entries"][key] = {
+                "size": size,
+                "last_access": time.time(),
+                **info,
+            }
+            self._evict(index, keep=key)
+            self._write_index(index)
+
+    def _evict(self, index, keep=None):
+        entries = index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            self._object_path(key).unlink(missing_ok=True)
+            total -= entries.pop(key)["size"]
+            self.stats["evictions"] += 1
+            index["stats"]["evictions"] += 1
+
+    def log_stats(self):
+        index_stats = self._read_index()["stats"]
+        logger.info(
+            f"Raw cache {self.cache_dir}: {self.stats['hits']} hits "
+            f"({self.stats['bytes_served'] / 1e6:.1f} MB served), "
+            f"{self.stats['misses']} misses and {self.stats['evictions']} evictions "
+            f"this run. All time: {index_stats['hits']} hits, "
+            f"{index_stats['misses']} misses, {index_stats['evictions']} evictions."
+        )
+
+
+class GribIndexCache:
+    """
+    Persistent cache of cfgrib index files, shared by all jobs on a node.
+
+    cfgrib indexes a GRIB file by scanning all its messages, which is most of
+    the cost of opening it. It can save the index next to the file, but only
+    reuses it for the same path and if it is newer than the file, which rules
+    out raw files downloaded again to a new temp dir.
+
+    Indexes are stored under the checksum of the GRIB content instead, so
+    they are reused whatever the path of the file, and a raw file that changes
+    gets a new index. Cached indexes are copied to a scratch directory of the
+    cache (with their path updated) that cfgrib reads and writes indexes in,
+    and new ones are added to the cache afterwards, so that no index is left
+    next to the raw files. Index files are written atomically and under a
+    lock file, so that concurrent jobs can share the cache.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.lock_path = self.cache_dir / "index.lock"
+        self.scratch_dir = self.cache_dir / "scratch"
+        self.stats = {"hits": 0, "misses": 0}
+        self.scratch_dir.mkdir(parents=True, exist_ok=True)
+
+    def _object_path(self, checksum, short_hash):
+        return self.cache_dir / checksum[:2] / f"{checksum}.{short_hash}.idx"
+
+    @contextmanager
+    def indexpath(self, grib_path, checksum):
+        """
+        Provide cached indexes of a GRIB file to cfgrib for the duration of
+        the context, and cache the indexes it creates.
+
+        Args:
+            grib_path (str or Path): Local GRIB file, as it is given to cfgrib
+            checksum (str): Checksum of the file content, see `file_checksum`
+
+        Yields:
+            (str): Value for the `indexpath` argument of cfgrib
+        """
+        grib_path = Path(grib_path)
+        with file_lock(self.lock_path):
+            cached = {
+                path.name[len(checksum) + 1 : -len(".idx")]: path.read_bytes()
+                for path in (self.cache_dir / checksum[:2]).glob(f"{checksum}.*.idx")
+            }
+
+        # Each open gets its own scratch directory, as concurrent jobs may
+        # open GRIB files of the same name
+        scratch = Path(tempfile.mkdtemp(dir=self.scratch_dir))
+        try:
+            for short_hash, data in cached.items():
+                index = pickle.loads(data)
+                # cfgrib only accepts an index of the same path
+                index.fieldset.path = str(grib_path)
+                atomic_write(scratch / f"{short_hash}.idx", pickle.dumps(index))
+            if cached:
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                logger.debug(f"No cached GRIB index for {grib_path.name}")
+
+            # Braces of the path would be taken as fields by cfgrib
+            scratch_template = str(scratch).replace("{", "{{").replace("}", "}}")
+            yield os.path.join(scratch_template, CFGRIB_INDEX_NAME)
+
+            for path in scratch.glob("*.idx"):
+                short_hash = path.name[: -len(".idx")]
+                if short_hash not in cached:
+                    with file_lock(self.lock_path):
+                        atomic_write(
+                            self._object_path(checksum, short_hash), path.read_bytes()
+                        )
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def log_stats(self):
+        logger.info(
+            f"GRIB index cache {self.cache_dir}: {self.stats['hits']} hits and "
+            f"{self.stats['misses']} misses this run"
+        )
@@ -0,0 +1,179 @@
+import time
+
+import rasterio
+import xarray as xr
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+# Candidate profiles compared by the benchmark, in addition to the profiles
+# configured for each pipeline
+BENCHMARK_PROFILES = {
+    "gdal_default": {},
+    "deflate_6": {"compress": "DEFLATE", "level": 6, "predictor": "YES"},
+    "zstd_1": {"compress": "ZSTD", "level": 1, "predictor": "YES"},
+    "zstd_9": {"compress": "ZSTD", "level": 9, "predictor": "YES"},
+    "zstd_9_256": {
+        "compress": "ZSTD",
+        "level": 9,
+        "predictor": "YES",
+        "blocksize": 256,
+    },
+    "lzw": {"compress": "LZW", "predictor": "YES"},
+    "zstd_9_sparse": {
+        "compress": "ZSTD",
+        "level": 9,
+        "predictor": "YES",
+        "sparse": True,
+    },
+}
+
+
+def cog_options(profile=None):
+    """
+    Split a COG profile (the `cog` section of a pipeline config) into COG
+    driver creation options and GDAL configuration options.
+
+    Args:
+        profile (dict): Profile with optional `compress`, `level`,
+            `predictor`, `blocksize`, `overview_resampling`, `num_threads`,
+            `gdal_cachemax` (in MB), `sparse` and `nodata` keys. Outputs
+            are written by several workers at once, so `num_threads` should
+            be a small fixed count rather than `ALL_CPUS`
+
+    Returns:
+        (tuple): Creation options for `rio.to_raster()` and config options
+        for `rasterio.Env()`
+    """
+    options = {k: v for k, v in (profile or {}).items() if v is not None}
+    # Handled by `write_cog()`, as they apply to the data
+    options.pop("nodata", None)
+    if options.pop("sparse", False):
+        options["sparse_ok"] = "TRUE"
+    env = {}
+    if "gdal_cachemax" in options:
+        env["GDAL_CACHEMAX"] = options.pop("gdal_cachemax")
+    return options, env
+
+
+def _set_nodata(da, nodata):
+    """Set the nodata value of a DataArray, removing it if `nodata` is None."""
+    da = da.rio.write_nodata(nodata, inplace=False)
+    if nodata is None:
+        da.encoding.pop("_FillValue", None)
+    return da
+
+
+def write_cog(da, path, profile=None):
+    """
+    Write a DataArray to `path` as a Cloud Optimized GeoTIFF.
+
+    With a `sparse` profile, blocks that are entirely nodata are omitted from
+    the file, and read back as nodata. The nodata value is set to the
+    profile's `nodata`, or removed if it has none, in which case blocks of
+    zeros are omitted and read back as zeros.
+
+    Args:
+        da (xarray.DataArray or xarray.Dataset): Data to write, with a CRS
+            set. The variables of a Dataset are written as bands
+        path (str or Path): Output path
+        profile (dict): COG profile, see `cog_options()`
+    """
+    options, env = cog_options(profile)
+    if options.get("sparse_ok"):
+        nodata = profile.get("nodata")
+        if isinstance(da, xr.Dataset):
+            # Each band is written with the nodata of its variable
+            da = da.copy()
+            for name in da.data_vars:
+                da[name] = _set_nodata(da[name], nodata)
+        else:
+            da = _set_nodata(da, nodata)
+    with rasterio.Env(**env):
+        da.rio.to_raster(path, driver="COG", **options)
+
+
+def cog_sparsity(source):
+    """
+    Fraction of the full resolution blocks of a GeoTIFF that are omitted
+    from the file (see `SPARSE_OK`).
+
+    Args:
+        source (str, Path or bytes): Path or content of the GeoTIFF
+
+    Returns:
+        (float): Between 0 (every block is stored) and 1
+    """
+    if isinstance(source, bytes):
+        with MemoryFile(source) as memfile:
+            return cog_sparsity(memfile.name)
+
+    with rasterio.open(source) as src:
+        height, width = src.block_shapes[0]
+        rows = -(-src.height // height)
+        cols = -(-src.width // width)
+        missing = sum(
+            src.get_tag_item(f"BLOCK_OFFSET_{col}_{row}", "TIFF", bidx=1) in (None, "0")
+            for row in range(rows)
+            for col in range(cols)
+        )
+    return missing / (rows * cols)
+
+
+def cog_bytes(da, profile=None):
+    """
+    Encode a DataArray as a Cloud Optimized GeoTIFF in memory.
+
+    The COG is written to a rasterio `MemoryFile` (a GDAL `/vsimem/` file),
+    so nothing touches local disk.
+
+    Args:
+        da (xarray.DataArray): Data to encode, with a CRS set
+        profile (dict): COG profile, see `cog_options()`
+
+    Returns:
+        (bytes): Content of the COG
+    """
+    with MemoryFile(ext=".tif") as memfile:
+        write_cog(da, memfile.name, profile)
+        return memfile.read()
+
+
+def benchmark_profile(da, profile=None, repeats=3):
+    """
+    Measure how a COG profile performs on a raster.
+
+    Args:
+        da (xarray.DataArray): Representative raster, with a CRS set
+        profile (dict): COG profile, see `cog_options()`
+        repeats (int): Number of runs; the fastest is reported
+
+    Returns:
+        (dict): Encode time (s), output size (bytes), fraction of omitted
+        blocks, and latency (s) of a full read and of reading one block
+    """
+    encode_times, full_reads, block_reads = [], [], []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        data = cog_bytes(da, profile)
+        encode_times.append(time.perf_counter() - start)
+
+        sparsity = cog_sparsity(data)
+        with MemoryFile(data) as memfile:
+            start = time.perf_counter()
+            with memfile.open() as src:
+                src.read()
+            full_reads.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            with memfile.open() as src:
+                height, width = src.block_shapes[0]
+                src.read(1, window=Window(0, 0, width, height))
+            block_reads.append(time.perf_counter() - start)
+
+    return {
+        "encode_s": min(encode_times),
+        "size_bytes": len(data),
+        "sparsity": sparsity,
+        "read_s": min(full_reads),
+        "block_read_s": min(block_reads),
+    }
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+# `pd.date_range` frequencies for the coverage frequencies in the config files
+DATE_RANGE_FREQUENCIES = {"D": "D", "M": "MS", "Y": "YS"}
+
+
+def expected_dates(start_date, end_date, frequency):
+    """
+    Create the index of dates that a pipeline is expected to have outputs for.
+
+    Args:
+        start_date (str or datetime): First expected date
+        end_date (str or datetime): Last date of the range
+        frequency (str): One of `D`, `M` or `Y`
+
+    Returns:
+        (pd.DatetimeIndex): Expected dates
+    """
+    return pd.date_range(
+        start=start_date, end=end_date, freq=DATE_RANGE_FREQUENCIES[frequency]
+    )
+
+
+def existing_index(entries, leadtimes=None):
+    """
+    Create an index of the dates (and leadtimes) covered by processed files.
+
+    Args:
+        entries (iterable): Manifest entries, with `date` and `leadtime` keys
+        leadtimes (int): Number of leadtimes per date for leadtime-indexed
+            products (eg. SEAS5), or None
+
+    Returns:
+        (pd.Index): A DatetimeIndex, or a MultiIndex of (date, leadtime) pairs
+        for leadtime-indexed products
+    """
+    entries = list(entries)
+    dates = pd.DatetimeIndex([entry["date"] for entry in entries]).normalize()
+    if not leadtimes:
+        return dates.unique()
+    return pd.MultiIndex.from_arrays(
+        [dates, [entry["leadtime"] for entry in entries]], names=["date", "leadtime"]
+    ).unique()
+
+
+def find_missing(expected, existing, leadtimes=None):
+    """
+    Find expected dates without outputs, using index set operations.
+
+    For leadtime-indexed products, a date is missing if any of its leadtimes
+    is missing, and coverage is computed over all (date, leadtime) pairs.
+
+    Args:
+        expected (pd.DatetimeIndex): Expected dates
+        existing (pd.Index): Output of `existing_index()`
+        leadtimes (int): Number of leadtimes per date, or None
+
+    Returns:
+        (tuple): Missing dates (pd.DatetimeIndex) and coverage percentage of
+        the expected range
+    """
+    if leadtimes:
+        expected_pairs = pd.MultiIndex.from_product(
+            [expected, range(leadtimes)], names=["date", "leadtime"]
+        )
+        missing_pairs = expected_pairs.difference(existing)
+        missing = pd.DatetimeIndex(
+            missing_pairs.get_level_values(0).unique()
+        ).sort_values()
+        n_expected, n_missing = len(expected_pairs), len(missing_pairs)
+    else:
+        missing = expected.difference(existing)
+        n_expected, n_missing = len(expected), len(missing)
+
+    coverage_pct = (n_expected - n_missing) / n_expected * 100 if n_expected else 100
+    return missing, coverage_pct
+
+
+def contiguous_ranges(dates, frequency):
+    """
+    Group dates into contiguous ranges at the given frequency.
+
+    Args:
+        dates (pd.DatetimeIndex): Sorted dates
+        frequency (str): One of `D`, `M` or `Y`
+
+    Returns:
+        (list): List of (first date, last date) tuples
+    """
+    if len(dates) == 0:
+        return []
+    ordinals = pd.DatetimeIndex(dates).to_period(frequency).asi8
+    breaks = np.flatnonzero(np.diff(ordinals) != 1) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks - 1, [len(dates) - 1]])
+    return [(dates[start], dates[end]) for start, end in zip(starts, ends)]
@@ -72,3 +72,36 @@ def get_datetime_from_filename(filename, return_type=False):
             return datetime.strptime(res[0], "%Y%m%d")
     except Exception:
         raise argparse.ArgumentTypeError(f"Cannot get datetime from {filename}.")
+
+
+def greedy_window_cover(dates, window_ends, window_days):
+    """
+    Choose a small set of fixed-length windows that covers `dates`, using
+    greedy set cover: repeatedly pick the window covering the most dates that
+    are still uncovered, preferring the latest window on ties.
+
+    Args:
+        dates (list): Dates to cover
+        window_ends (list): Last date of each available window
+        window_days (int): Number of days in each window, including its end
+
+    Returns:
+        (tuple): Sorted ends of the chosen windows, and sorted dates that no
+        window covers
+    """
+    span = timedelta(days=window_days - 1)
+    uncovered = set(dates)
+    windows = {
+        end: {date for date in uncovered if end - span <= date <= end}
+        for end in set(window_ends)
+    }
+
+    chosen = []
+    while uncovered and windows:
+        best = max(windows, key=lambda end: (len(windows[end] & uncovered), end))
+        if not windows[best] & uncovered:
+            break
+        chosen.append(best)
+        uncovered -= windows.pop(best)
+
+    return sorted(chosen), sorted(uncovered)
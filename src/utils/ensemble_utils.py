@@ -0,0 +1,210 @@
+import dask
+import dask.array
+import numpy as np
+
+
+class P2Quantile:
+    """
+    Streaming estimate of a quantile of each cell of a grid, with the P²
+    algorithm (Jain & Chlamtac, 1985).
+
+    Five markers per cell are kept whatever the number of observations, which
+    is exact for up to five observations and an approximation beyond.
+
+    Args:
+        p (float): Quantile to estimate, between 0 and 1
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self._first = []
+        self.heights = None
+        self.positions = None
+        self.desired = None
+        # Increments of the desired marker positions for each observation
+        self._increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def add(self, values):
+        self.count += 1
+        if self.count <= 5:
+            self._first.append(np.asarray(values, dtype="float64"))
+            if self.count == 5:
+                self.heights = np.sort(np.stack(self._first), axis=0)
+                self.positions = np.broadcast_to(
+                    np.arange(1.0, 6.0).reshape(5, *[1] * values.ndim),
+                    self.heights.shape,
+                ).copy()
+                p = self.p
+                self.desired = np.array([1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5])
+                self._first = []
+            return
+
+        q, n = self.heights, self.positions
+        x = np.asarray(values, dtype="float64")
+        q[0] = np.minimum(q[0], x)
+        q[4] = np.maximum(q[4], x)
+        # Markers above the cell of `x` move up one position
+        for i in range(1, 4):
+            n[i] += x < q[i]
+        n[4] += 1
+        self.desired += self._increments
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for i in range(1, 4):
+                d = self.desired[i] - n[i]
+                move = ((d >= 1) & (n[i + 1] - n[i] > 1)) | (
+                    (d <= -1) & (n[i - 1] - n[i] < -1)
+                )
+                s = np.sign(d)
+                parabolic = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                neighbour = np.where(s > 0, q[i + 1], q[i - 1])
+                neighbour_position = np.where(s > 0, n[i + 1], n[i - 1])
+                linear = q[i] + s * (neighbour - q[i]) / (neighbour_position - n[i])
+                in_order = (q[i - 1] < parabolic) & (parabolic < q[i + 1])
+                q[i] = np.where(move, np.where(in_order, parabolic, linear), q[i])
+                n[i] = np.where(move, n[i] + s, n[i])
+
+    def estimate(self):
+        if self.count == 0:
+            raise ValueError("No observations were added")
+        if self.count < 5:
+            return np.quantile(np.stack(self._first), self.p, axis=0)
+        return self.heights[2]
+
+
+class EnsembleReducer:
+    """
+    Ensemble statistics of each cell of a grid, folding in one member at a
+    time, so that memory is proportional to the grid rather than to the
+    number of members.
+
+    The mean and spread use Welford's online algorithm. Optionally, the
+    reducer also estimates percentiles (see `P2Quantile`) and the fraction of
+    members below and above tercile thresholds.
+
+    Args:
+        percentiles (list): Percentiles to estimate, between 0 and 100
+        terciles (tuple): Lower and upper tercile thresholds, as arrays that
+            broadcast to the members' shape
+        scale (float): Factor applied to the members as they are added, eg.
+            for a unit conversion
+    """
+
+    def __init__(self, percentiles=(), terciles=None, scale=1):
+        self.scale = scale
+        self.terciles = terciles
+        self.count = 0
+        self._mean = None
+        self._m2 = None
+        self._below = None
+        self._above = None
+        self._percentiles = {
+            percentile: P2Quantile(percentile / 100) for percentile in percentiles
+        }
+
+    def add(self, values):
+        x = np.asarray(values, dtype="float64") * self.scale
+        if self._mean is None:
+            self._mean = np.zeros(x.shape)
+            self._m2 = np.zeros(x.shape)
+            if self.terciles is not None:
+                self._below = np.zeros(x.shape, dtype="uint16")
+                self._above = np.zeros(x.shape, dtype="uint16")
+
+        self.count += 1
+        delta = x - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (x - self._mean)
+
+        if self.terciles is not None:
+            lower, upper = self.terciles
+            self._below += x < lower
+            self._above += x > upper
+        for quantile in self._percentiles.values():
+            quantile.add(x)
+
+    def mean(self):
+        return self._mean
+
+    def spread(self):
+        """Standard deviation of the members (with one degree of freedom)."""
+        if self.count < 2:
+            return np.full(self._mean.shape, np.nan)
+        return np.sqrt(self._m2 / (self.count - 1))
+
+    def tercile_probabilities(self):
+        """
+        Fractions of the members below the lower tercile, between the
+        terciles and above the upper tercile.
+        """
+        if self.terciles is None:
+            raise ValueError("No tercile thresholds were given")
+        below = self._below / self.count
+        above = self._above / self.count
+        return below, 1 - below - above, above
+
+    def percentiles(self):
+        return {
+            percentile: quantile.estimate()
+            for percentile, quantile in self._percentiles.items()
+        }
+
+
+def reduce_members(members, **kwargs):
+    """Fold an iterable of members into an `EnsembleReducer(**kwargs)`."""
+    reducer = EnsembleReducer(**kwargs)
+    for member in members:
+        reducer.add(member)
+    return reducer
+
+
+class DelayedEnsembleReducer:
+    """
+    An `EnsembleReducer` whose members are only read and folded in when its
+    statistics are computed with dask. Statistics computed together (eg. by
+    a single `dask.compute` of all the outputs of a file) share one pass over
+    the members.
+
+    Args:
+        members (callable): Returns an iterable of the members, as arrays of
+            `shape`
+        shape (tuple): Shape of each member
+        percentiles, terciles, scale: See `EnsembleReducer`
+    """
+
+    def __init__(self, members, shape, percentiles=(), terciles=None, scale=1):
+        self.shape = shape
+        self.terciles = terciles
+        self._percentiles = tuple(percentiles)
+        self._reducer = dask.delayed(
+            lambda: reduce_members(
+                members(), percentiles=percentiles, terciles=terciles, scale=scale
+            ),
+            pure=False,
+        )()
+
+    def _array(self, value):
+        return dask.array.from_delayed(value, self.shape, dtype="float64")
+
+    def mean(self):
+        return self._array(self._reducer.mean())
+
+    def spread(self):
+        return self._array(self._reducer.spread())
+
+    def tercile_probabilities(self):
+        if self.terciles is None:
+            raise ValueError("No tercile thresholds were given")
+        probabilities = self._reducer.tercile_probabilities()
+        return tuple(self._array(probabilities[i]) for i in range(3))
+
+    def percentiles(self):
+        estimates = self._reducer.percentiles()
+        return {
+            percentile: self._array(estimates[percentile])
+            for percentile in self._percentiles
+        }
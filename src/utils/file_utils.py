@@ -0,0 +1,54 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+@contextmanager
+def file_lock(lock_path):
+    """
+    Hold an exclusive lock on `lock_path` for the duration of the context, so
+    that several processes on the same node can safely share a file.
+
+    Locking relies on `fcntl` and is skipped on platforms without it.
+
+    Args:
+        lock_path (str or Path): Path of the lock file. Created if missing.
+    """
+    lock_path = Path(lock_path)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write(path, data):
+    """
+    Write `data` to `path` via a temporary file in the same directory,
+    so that readers never see a partially written file.
+
+    Args:
+        path (str or Path): Destination path
+        data (bytes or str): Content to write
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    mode = "wb" if isinstance(data, bytes) else "w"
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, mode) as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,220 @@
+import logging
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import coloredlogs
+import numpy as np
+import xarray as xr
+
+from .cache_utils import GribIndexCache, file_checksum
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(
+    level="DEBUG",
+    logger=logger,
+    fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+# ecCodes is imported where it's used rather than here: with some binary
+# wheels, loading it before GDAL (ie. rasterio) crashes the interpreter
+
+
+class _GroupMean:
+    """Running sum and count of the messages of a group, cell by cell."""
+
+    def __init__(self):
+        self.count = 0
+        self.sums = None
+        self.counts = None
+
+    def add(self, values):
+        if self.sums is None:
+            self.sums = np.zeros(values.shape, dtype="float64")
+            self.counts = np.zeros(values.shape, dtype="uint16")
+        valid = ~np.isnan(values)
+        self.sums += np.where(valid, values, 0)
+        self.counts += valid
+        self.count += 1
+
+    def mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.counts > 0, self.sums / self.counts, np.nan)
+
+
+def _message_grid(gid):
+    """
+    Values of a regular lat/lon GRIB message as a (lat, lon) array, and its
+    coordinates (taken from the same keys as cfgrib).
+    """
+    import eccodes
+
+    grid_type = eccodes.codes_get(gid, "gridType")
+    if grid_type != "regular_ll":
+        raise ValueError(f"Unsupported GRIB grid type: {grid_type}")
+
+    ni = eccodes.codes_get(gid, "Ni")
+    nj = eccodes.codes_get(gid, "Nj")
+    latitudes = eccodes.codes_get_array(gid, "distinctLatitudes")
+    longitudes = eccodes.codes_get_array(gid, "distinctLongitudes")
+
+    values = eccodes.codes_get_values(gid).astype("float64")
+    if eccodes.codes_get(gid, "bitmapPresent"):
+        values[values == eccodes.codes_get(gid, "missingValue")] = np.nan
+    return values.reshape(nj, ni), latitudes, longitudes
+
+
+def _ensemble_size(gid):
+    """Number of members of the message's ensemble, 1 if it isn't one."""
+    import eccodes
+
+    if eccodes.codes_is_defined(gid, "totalNumber"):
+        return max(1, eccodes.codes_get(gid, "totalNumber"))
+    return 1
+
+
+def iter_message_groups(path, group_keys, filter_keys=None, reducer=None):
+    """
+    Stream the messages of a GRIB file, folding the grids of each group of
+    messages (eg. the members of an ensemble forecast) into a reducer, and
+    yield each group as soon as it is complete.
+
+    Messages are grouped by the values of `group_keys`. A group is complete
+    once it has as many messages as its ensemble has members (`totalNumber`,
+    or one message outside of ensembles). Groups still incomplete at the end
+    of the file are yielded last. Only one reducer per group being read is
+    held in memory, not the whole file.
+
+    Args:
+        path (str or Path): GRIB file, with messages on a regular lat/lon grid
+        group_keys (tuple): ecCodes keys to group messages by, eg.
+            `("dataDate", "forecastMonth")`
+        filter_keys (dict): Only read messages with these key values, eg.
+            `{"dataType": "fcmean"}`
+        reducer (callable): Creates the reducer of a group from its key
+            values, latitudes and longitudes: an object with an `add(values)`
+            method and a `count` of added grids. Defaults to a running mean
+
+    Yields:
+        (tuple): Values of `group_keys`, the reducer of the group, and the
+        latitudes and longitudes of its grids
+    """
+    import eccodes
+
+    filter_keys = filter_keys or {}
+    groups = {}
+    with open(path, "rb") as f:
+        while True:
+            gid = eccodes.codes_grib_new_from_file(f)
+            if gid is None:
+                break
+            try:
+                if any(
+                    str(eccodes.codes_get(gid, key)) != str(value)
+                    for key, value in filter_keys.items()
+                ):
+                    continue
+                key = tuple(eccodes.codes_get(gid, name) for name in group_keys)
+                values, latitudes, longitudes = _message_grid(gid)
+                if key not in groups:
+                    if reducer:
+                        group = reducer(key, latitudes, longitudes)
+                    else:
+                        group = _GroupMean()
+                    expected = _ensemble_size(gid)
+                    groups[key] = (group, expected, latitudes, longitudes)
+                group, expected = groups[key][:2]
+                group.add(values)
+            finally:
+                eccodes.codes_release(gid)
+
+            if group.count >= expected:
+                group, _, latitudes, longitudes = groups.pop(key)
+                yield key, group, latitudes, longitudes
+
+    for key, (group, expected, latitudes, longitudes) in groups.items():
+        logger.warning(f"Only {group.count} of {expected} messages found for {key}")
+        yield key, group, latitudes, longitudes
+
+
+def iter_group_means(path, group_keys, filter_keys=None):
+    """
+    Mean of each group of messages of a GRIB file, yielded as soon as the
+    group is complete. See `iter_message_groups()`.
+
+    Yields:
+        (tuple): Values of `group_keys`, and the mean of the group as a
+        float32 DataArray with `latitude` and `longitude` dimensions and the
+        number of messages averaged in its `messages` attribute
+    """
+    for key, group, latitudes, longitudes in iter_message_groups(
+        path, group_keys, filter_keys
+    ):
+        yield key, xr.DataArray(
+            group.mean().astype("float32"),
+            dims=("latitude", "longitude"),
+            coords={"latitude": latitudes, "longitude": longitudes},
+            attrs={"messages": group.count},
+        )
+
+
+def benchmark_grib_open(path, repeats=3, **backend_kwargs):
+    """
+    Measure the latency of opening a GRIB file with cfgrib, without an index
+    (`indexpath=""`) and through a `GribIndexCache`.
+
+    The file is copied to a temp dir first, and each cached open is of a new
+    copy, like a raw file downloaded again in a later run.
+
+    Args:
+        path (str or Path): GRIB file, eg. a yearly SEAS5 file from MARS
+        repeats (int): Number of runs; the fastest is reported
+        backend_kwargs: cfgrib options, eg. `time_dims`
+
+    Returns:
+        (dict): Latency (s) of an open without index, of the first open
+        through an empty cache (which builds the index), of an open with a
+        cached index, and of the checksum of the file (included in the
+        latter two)
+    """
+    path = Path(path)
+    no_index, cached, checksums = [], [], []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_dir = Path(temp_dir)
+        cache = GribIndexCache(temp_dir / "cache")
+
+        def copy(run):
+            run_dir = temp_dir / f"run_{run}"
+            run_dir.mkdir()
+            return Path(shutil.copyfile(path, run_dir / path.name))
+
+        def open_grib(grib_path, indexpath):
+            with xr.open_dataset(
+                grib_path,
+                engine="cfgrib",
+                backend_kwargs={**backend_kwargs, "indexpath": indexpath},
+            ):
+                pass
+
+        for run in range(repeats):
+            grib_path = copy(f"no_index_{run}")
+            start = time.perf_counter()
+            open_grib(grib_path, "")
+            no_index.append(time.perf_counter() - start)
+
+        for run in range(repeats + 1):
+            grib_path = copy(run)
+            start = time.perf_counter()
+            checksum = file_checksum(grib_path)
+            checksums.append(time.perf_counter() - start)
+            with cache.indexpath(grib_path, checksum) as indexpath:
+                open_grib(grib_path, indexpath)
+            cached.append(time.perf_counter() - start)
+
+    return {
+        "no_index_s": min(no_index),
+        "cold_cache_s": cached[0],
+        "cached_s": min(cached[1:]),
+        "checksum_s": min(checksums),
+    }
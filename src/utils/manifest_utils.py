@@ -0,0 +1,147 @@
+import json
+import logging
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+
+import coloredlogs
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    ResourceExistsError,
+    ResourceModifiedError,
+    ResourceNotFoundError,
+)
+from azure.storage.blob import ContentSettings
+
+from .date_utils import DATE_FORMAT, get_datetime_from_filename
+from .file_utils import atomic_write, file_lock
+
+MANIFEST_FILENAME = "_manifest.json"
+MANIFEST_VERSION = 1
+
+logger = logging.getLogger(__name__)
+coloredlogs.install(
+    level="DEBUG",
+    logger=logger,
+    fmt="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+
+def manifest_entry(filename, size=None, etag=None, **info):
+    """
+    Create the manifest entry of a processed COG.
+
+    Args:
+        filename (str): Name of the COG, relative to the processed path
+        size (int): Size of the COG in bytes
+        etag (str): ETag of the uploaded blob (None in local mode)
+        **info: Additional fields to record, eg. the COG's fingerprint
+
+    Returns:
+        (dict): Manifest entry with date, leadtime, size, etag and `info`
+    """
+    leadtime = re.search(r"_lt([0-9]+)", Path(filename).name)
+    return {
+        "date": get_datetime_from_filename(Path(filename).name).strftime(DATE_FORMAT),
+        "leadtime": int(leadtime.group(1)) if leadtime else None,
+        "size": size,
+        "etag": etag,
+        **info,
+    }
+
+
+def empty_manifest():
+    return {"version": MANIFEST_VERSION, "updated": None, "files": {}}
+
+
+def merge_manifest(manifest, entries):
+    """Merge `entries` ({filename: entry}) into a copy of `manifest`."""
+    manifest = dict(manifest or empty_manifest())
+    manifest["files"] = {**manifest.get("files", {}), **entries}
+    manifest["updated"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    return manifest
+
+
+def read_local_manifest(manifest_path):
+    """Read a local manifest, returning None if it doesn't exist."""
+    try:
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+def update_local_manifest(manifest_path, entries, replace=False):
+    """
+    Atomically merge `entries` into a local manifest. Concurrent writers are
+    serialised through a lock file next to the manifest.
+
+    Args:
+        manifest_path (Path): Path of the manifest
+        entries (dict): Manifest entries keyed by filename
+        replace (bool): Whether to discard existing entries rather than merge
+    """
+    manifest_path = Path(manifest_path)
+    with file_lock(manifest_path.with_suffix(".lock")):
+        manifest = None if replace else read_local_manifest(manifest_path)
+        manifest = merge_manifest(manifest, entries)
+        atomic_write(manifest_path, json.dumps(manifest))
+    return manifest
+
+
+def read_blob_manifest(container_client, blob_path):
+    """
+    Read a manifest from blob storage in a single GET.
+
+    Returns:
+        (tuple): The manifest and its ETag, or (None, None) if it doesn't exist
+    """
+    try:
+        downloader = container_client.get_blob_client(str(blob_path)).download_blob()
+        return json.loads(downloader.readall()), downloader.properties.etag
+    except ResourceNotFoundError:
+        return None, None
+
+
+def update_blob_manifest(
+    container_client, blob_path, entries, replace=False, max_attempts=10
+):
+    """
+    Atomically merge `entries` into a manifest in blob storage.
+
+    Uses optimistic concurrency: the manifest is only overwritten if its ETag
+    hasn't changed since it was read, otherwise the merge is retried.
+
+    Args:
+        container_client (ContainerClient): Client of the container
+        blob_path (str or Path): Path of the manifest blob
+        entries (dict): Manifest entries keyed by filename
+        replace (bool): Whether to discard existing entries rather than merge
+        max_attempts (int): Number of read-merge-write attempts
+    """
+    blob_client = container_client.get_blob_client(str(blob_path))
+    content_settings = ContentSettings(content_type="application/json")
+
+    for attempt in range(max_attempts):
+        manifest, etag = read_blob_manifest(container_client, blob_path)
+        data = json.dumps(merge_manifest(None if replace else manifest, entries))
+        try:
+            if etag:
+                blob_client.upload_blob(
+                    data,
+                    overwrite=True,
+                    etag=etag,
+                    match_condition=MatchConditions.IfNotModified,
+                    content_settings=content_settings,
+                )
+            else:
+                blob_client.upload_blob(
+                    data, overwrite=False, content_settings=content_settings
+                )
+            return
+        except (ResourceModifiedError, ResourceExistsError):
+            logger.debug(f"Manifest {blob_path} changed while updating, retrying...")
+
+    raise RuntimeError(
+        f"Failed to update manifest {blob_path} after {max_attempts} attempts"
+    )
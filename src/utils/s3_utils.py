@@ -0,0 +1,70 @@
+import asyncio
+import os
+import threading
+from pathlib import Path
+
+import fsspec
+from fsspec.asyn import sync
+
+# Default number of objects downloaded at the same time
+S3_FETCH_CONCURRENCY = 8
+
+
+def s3_filesystem(**storage_options):
+    """
+    Get an async fsspec filesystem over S3 (s3fs). Credentials and endpoint
+    are read from the environment (eg. `AWS_ENDPOINT_URL` for a local S3
+    server). Instances are cached by fsspec, so they are shared within a
+    process.
+    """
+    return fsspec.filesystem("s3", asynchronous=False, **storage_options)
+
+
+def fetch_s3_objects(fs, files, max_concurrency=S3_FETCH_CONCURRENCY):
+    """
+    Download S3 objects to local files concurrently, on the filesystem's event
+    loop.
+
+    Each object is streamed to disk in chunks by s3fs rather than read into
+    memory whole, via a temporary file that is renamed once complete, and at
+    most `max_concurrency` objects are downloaded at a time. A failed object
+    doesn't stop the others.
+
+    Args:
+        fs (s3fs.S3FileSystem): Filesystem, see `s3_filesystem()`
+        files (dict): Local path of each S3 path (`s3://bucket/key`)
+        max_concurrency (int): Maximum number of downloads in flight
+
+    Returns:
+        (dict): Error of each S3 path that couldn't be downloaded
+    """
+    files = {rpath: Path(lpath) for rpath, lpath in files.items()}
+    if not files:
+        return {}
+
+    async def fetch(semaphore, rpath, lpath):
+        tmp_path = lpath.with_name(
+            f".{lpath.name}.{os.getpid()}.{threading.get_ident()}.part"
+        )
+        async with semaphore:
+            try:
+                await fs._get_file(rpath, str(tmp_path))
+                os.replace(tmp_path, lpath)
+            finally:
+                tmp_path.unlink(missing_ok=True)
+
+    async def fetch_all():
+        semaphore = asyncio.Semaphore(max(1, int(max_concurrency)))
+        return await asyncio.gather(
+            *(fetch(semaphore, rpath, lpath) for rpath, lpath in files.items()),
+            return_exceptions=True,
+        )
+
+    for lpath in files.values():
+        lpath.parent.mkdir(parents=True, exist_ok=True)
+    results = sync(fs.loop, fetch_all)
+    return {
+        rpath: result
+        for rpath, result in zip(files, results)
+        if isinstance(result, Exception)
+    }
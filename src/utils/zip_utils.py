@@ -0,0 +1,69 @@
+import struct
+import zlib
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile
+
+# Fixed-size part of a zip local file header (APPNOTE 4.3.7)
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+# Size of the range requests used to read a zip's central directory
+DIRECTORY_BLOCK_SIZE = 256 * 1024
+
+
+class RemoteZip:
+    """
+    Random access to the members of a zip in an fsspec filesystem (eg. Azure
+    Blob Storage through adlfs), using range requests.
+
+    Opening a `RemoteZip` only reads the zip's central directory, from the end
+    of the file. Reading a member then fetches its local header and its
+    compressed bytes, so extracting one member of a large archive moves
+    roughly the size of that member.
+
+    Args:
+        fs (fsspec.AbstractFileSystem): Filesystem of the zip
+        path (str): Path of the zip in `fs`
+        block_size (int): Size of the range requests for the directory
+    """
+
+    def __init__(self, fs, path, block_size=DIRECTORY_BLOCK_SIZE):
+        self.fs = fs
+        self.path = path
+        with fs.open(path, "rb", block_size=block_size, cache_type="readahead") as f:
+            with ZipFile(f) as zipobj:
+                self.members = {info.filename: info for info in zipobj.infolist()}
+
+    def __str__(self):
+        return self.path
+
+    def namelist(self):
+        return list(self.members)
+
+    def read(self, name):
+        """
+        Read and decompress a member, checking its CRC.
+
+        Returns:
+            (bytes): Uncompressed content of the member
+        """
+        info = self.members[name]
+        header = self.fs.cat_file(
+            self.path, info.header_offset, info.header_offset + LOCAL_HEADER.size
+        )
+        fields = LOCAL_HEADER.unpack(header)
+        if fields[0] != LOCAL_HEADER_SIGNATURE:
+            raise BadZipFile(f"Bad local header for {name} in {self.path}")
+
+        # The local header has its own name and extra field lengths
+        start = info.header_offset + LOCAL_HEADER.size + fields[-2] + fields[-1]
+        data = self.fs.cat_file(self.path, start, start + info.compress_size)
+        if info.compress_type == ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        elif info.compress_type != ZIP_STORED:
+            raise NotImplementedError(
+                f"Unsupported compression {info.compress_type} for {name}"
+            )
+
+        if zlib.crc32(data) != info.CRC:
+            raise BadZipFile(f"CRC mismatch for {name} in {self.path}")
+        return data
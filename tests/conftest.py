@@ -0,0 +1,83 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+from src.utils import azure_utils
+
+# Well-known key of the Azure storage emulator account
+EMULATOR_KEY = (
+    "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/"
+    "K1SZFPTOtr/KBHBeksoGMGw=="
+)
+
+
+class FakeBlobEndpoint(BaseHTTPRequestHandler):
+    """Blob endpoint serving blob properties and (ranged) reads of `blobs`."""
+
+    blobs = {}
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send_headers(self, status, length, content_range=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("x-ms-blob-type", "BlockBlob")
+        self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+        self.send_header("ETag", '"0x1"')
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def _blob(self):
+        # Paths are `/<account>/<container>/<blob>`
+        data = self.blobs.get(urlparse(self.path).path.split("/", 2)[2])
+        if data is None:
+            self.send_response(404)
+            self.send_header("x-ms-error-code", "BlobNotFound")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        return data
+
+    def do_HEAD(self):
+        data = self._blob()
+        if data is not None:
+            self._send_headers(200, len(data))
+
+    def do_GET(self):
+        data = self._blob()
+        if data is None:
+            return
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("x-ms-range", ""))
+        if match:
+            start, end = int(match[1]), min(int(match[2]), len(data) - 1)
+            self.ranges.append((start, end))
+            chunk = data[start : end + 1]
+            self._send_headers(206, len(chunk), f"bytes {start}-{end}/{len(data)}")
+        else:
+            chunk = data
+            self._send_headers(200, len(chunk))
+        self.wfile.write(chunk)
+
+
+@pytest.fixture
+def blob_endpoint(monkeypatch):
+    FakeBlobEndpoint.blobs = {}
+    FakeBlobEndpoint.ranges = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBlobEndpoint)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/devstoreaccount1"
+    connection_string = (
+        "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+        f"AccountKey={EMULATOR_KEY};BlobEndpoint={endpoint};"
+    )
+    monkeypatch.setattr(azure_utils, "STORAGE_CONNECTION_STRING_DEV", connection_string)
+    monkeypatch.setattr(azure_utils, "_service_clients", {})
+    yield FakeBlobEndpoint
+    server.shutdown()
+    thread.join()
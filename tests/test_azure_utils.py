@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import azure_utils
+from src.utils.azure_utils import blob_client, download_from_azure
+
+
+class FakeBlobClient:
+    def __init__(self, data, etag="0x1", fail_at=None):
+        self.data = data
+        self.etag = etag
+        self.fail_at = fail_at
+        self.requested = []
+
+    def get_blob_properties(self):
+        return SimpleNamespace(
+            size=len(self.data),
+            etag=self.etag,
+            content_settings=SimpleNamespace(
+                content_md5=bytearray(hashlib.md5(self.data).digest())
+            ),
+        )
+
+    def download_blob(self, offset, length, **kwargs):
+        if offset == self.fail_at:
+            raise ConnectionError("Connection reset")
+        self.requested.append(offset)
+        chunk = self.data[offset : offset + length]
+        return SimpleNamespace(readall=lambda: chunk)
+
+
+class FakeServiceClient:
+    def __init__(self, blob):
+        self.blob = blob
+
+    def get_blob_client(self, container, blob):
+        return self.blob
+
+
+def test_download_from_azure_resumes(tmp_path):
+    data = bytes(range(256)) * 40
+    blob = FakeBlobClient(data, fail_at=4096)
+    client = FakeServiceClient(blob)
+    local_path = tmp_path / "raw.nc"
+
+    kwargs = {"max_concurrency": 1, "chunk_size": 1024}
+    assert download_from_azure(client, "raster", "raw.nc", local_path, **kwargs) is None
+    assert not local_path.exists()
+    state = json.loads((tmp_path / "raw.nc.part.json").read_text())
+    assert {0, 1, 2, 3} <= set(state["done"]) and 4 not in state["done"]
+
+    blob.fail_at = None
+    blob.requested = []
+    assert download_from_azure(client, "raster", "raw.nc", local_path, **kwargs)
+    assert local_path.read_bytes() == data
+    missing = [i * 1024 for i in range(10) if i not in state["done"]]
+    assert sorted(blob.requested) == missing
+    assert not (tmp_path / "raw.nc.part").exists()
+    assert not (tmp_path / "raw.nc.part.json").exists()
+
+
+def test_download_from_azure_checksum_mismatch(tmp_path):
+    blob = FakeBlobClient(b"a" * 3000)
+    blob.get_blob_properties = lambda: SimpleNamespace(
+        size=3000,
+        etag="0x1",
+        content_settings=SimpleNamespace(content_md5=bytearray(16)),
+    )
+    local_path = tmp_path / "raw.nc"
+    result = download_from_azure(
+        FakeServiceClient(blob), "raster", "raw.nc", local_path, chunk_size=1024
+    )
+    assert result is None
+    assert not local_path.exists()
+
+
+def test_download_from_azure_resumes_from_partial_dir(tmp_path):
+    data = bytes(range(256)) * 40
+    blob = FakeBlobClient(data, fail_at=4096)
+    client = FakeServiceClient(blob)
+    partial_dir = tmp_path / "partial"
+    kwargs = {"max_concurrency": 1, "chunk_size": 1024, "partial_dir": partial_dir}
+
+    # Each run downloads to its own temp dir, which is deleted after it
+    first_run_path = tmp_path / "run1" / "raw.nc"
+    first_run_path.parent.mkdir()
+    assert (
+        download_from_azure(client, "raster", "raw.nc", first_run_path, **kwargs)
+        is None
+    )
+    assert list(first_run_path.parent.iterdir()) == []
+    assert len(list(partial_dir.glob("*.part"))) == 1
+
+    blob.fail_at = None
+    blob.requested = []
+    second_run_path = tmp_path / "run2" / "raw.nc"
+    second_run_path.parent.mkdir()
+    assert download_from_azure(client, "raster", "raw.nc", second_run_path, **kwargs)
+    assert second_run_path.read_bytes() == data
+    assert min(blob.requested) == 4096
+    assert list(partial_dir.iterdir()) == []
+
+
+def test_download_from_azure_without_md5(tmp_path, caplog):
+    data = b"a" * 3000
+    blob = FakeBlobClient(data)
+    blob.get_blob_properties = lambda: SimpleNamespace(
+        size=len(data),
+        etag="0x1",
+        content_settings=SimpleNamespace(content_md5=None),
+    )
+    client = FakeServiceClient(blob)
+    local_path = tmp_path / "raw.nc"
+    with caplog.at_level(logging.INFO):
+        assert download_from_azure(client, "raster", "raw.nc", local_path)
+    assert local_path.read_bytes() == data
+    assert "No Content-MD5 for raw.nc" in caplog.text
+
+    # A truncated chunk is caught without a checksum
+    local_path.unlink()
+    blob.data = data[:2500]
+    assert download_from_azure(client, "raster", "raw.nc", local_path) is None
+    assert not local_path.exists()
+
+
+def test_blob_client_downloads_with_connection_string(blob_endpoint, tmp_path):
+    data = bytes(range(256)) * 40
+    blob_endpoint.blobs["raster/raw.nc"] = data
+    local_path = tmp_path / "raw.nc"
+
+    client = blob_client("dev")
+    assert client.url.startswith("http://127.0.0.1:")
+    assert download_from_azure(client, "raster", "raw.nc", local_path, chunk_size=1024)
+    assert local_path.read_bytes() == data
+
+
+def test_blob_client_endpoint_override(monkeypatch):
+    monkeypatch.setattr(azure_utils, "_service_clients", {})
+    monkeypatch.setattr(azure_utils, "STORAGE_ACCOUNT_DEV", "account")
+    monkeypatch.setattr(
+        azure_utils, "STORAGE_ENDPOINT_DEV", "https://blob.example.org/account"
+    )
+    assert blob_client("dev").url.startswith("https://blob.example.org/account")
@@ -0,0 +1,86 @@
+import random
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src.utils.baseline_utils import (
+    DAYS_IN_YEAR,
+    DayOfYearAccumulator,
+    ordered_bounded_map,
+)
+
+
+def test_ordered_bounded_map_preserves_order_and_bound():
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def func(item):
+        with lock:
+            in_flight.append(item)
+            peak.append(len(in_flight))
+        time.sleep(random.uniform(0, 0.01))
+        with lock:
+            in_flight.remove(item)
+        return item * 2
+
+    results = list(ordered_bounded_map(func, range(50), max_workers=4))
+
+    assert results == [item * 2 for item in range(50)]
+    assert max(peak) <= 4
+
+
+def test_baseline_is_circular_mean_over_days_of_year():
+    dates = pd.date_range("2019-12-20", "2020-01-10")
+    rng = np.random.default_rng(0)
+    grids = rng.random((len(dates), 2, 3)).astype("float32")
+    grids[5, 0, 0] = np.nan
+
+    accumulator = DayOfYearAccumulator()
+    for date, grid in zip(dates, grids):
+        da = xr.DataArray(grid, dims=("y", "x"), coords={"y": [1, 0], "x": [0, 1, 2]})
+        accumulator.add(da, date.to_pydatetime())
+    baseline = accumulator.baseline(half_window=5)
+
+    assert baseline.dims == ("dayofyear", "y", "x")
+    assert baseline.sizes["dayofyear"] == DAYS_IN_YEAR
+    # Day 1 averages every day within 5 days of it, across the year boundary
+    distance = np.minimum(
+        (dates.dayofyear - 1) % DAYS_IN_YEAR, (1 - dates.dayofyear) % DAYS_IN_YEAR
+    )
+    expected = np.nanmean(grids[distance <= 5], axis=0)
+    np.testing.assert_allclose(baseline.sel(dayofyear=1), expected, rtol=1e-6)
+    # Days without any data in their window are missing
+    assert np.isnan(baseline.sel(dayofyear=180)).all()
+
+
+def test_accumulator_rejects_mismatched_grids():
+    accumulator = DayOfYearAccumulator()
+    accumulator.add(
+        xr.DataArray(np.ones((2, 2)), dims=("y", "x")), datetime(2020, 1, 1)
+    )
+    with pytest.raises(ValueError):
+        accumulator.add(
+            xr.DataArray(np.ones((3, 2)), dims=("y", "x")), datetime(2020, 1, 2)
+        )
+
+
+def test_accumulator_persists_last_date():
+    accumulator = DayOfYearAccumulator()
+    accumulator.add(
+        xr.DataArray(np.ones((2, 2)), dims=("y", "x")), datetime(2020, 3, 1)
+    )
+    # A date without any grid to add still counts as covered
+    accumulator.cover(datetime(2020, 3, 2))
+
+    restored = DayOfYearAccumulator.from_dataset(accumulator.to_dataset())
+    assert restored.last_date == pd.Timestamp("2020-03-02")
+
+    merged = DayOfYearAccumulator()
+    merged.merge(restored)
+    assert merged.last_date == pd.Timestamp("2020-03-02")
@@ -0,0 +1,136 @@
+import pickle
+import shutil
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+
+from src.utils.cache_utils import GribIndexCache, RawCache, file_checksum
+
+
+def write_file(path, size):
+    path.write_bytes(b"x" * size)
+    return path
+
+
+def test_raw_cache_hit_and_miss(tmp_path):
+    cache = RawCache(tmp_path / "cache", max_bytes=100)
+    key = RawCache.key("azure", blob="raw/tprate_2020.grib", etag="0x1")
+    src = write_file(tmp_path / "tprate_2020.grib", 10)
+    dest = tmp_path / "dest.grib"
+
+    assert not cache.get(key, dest)
+    cache.put(key, src)
+    assert cache.get(key, dest)
+    assert file_checksum(dest) == file_checksum(src)
+    assert cache.stats["hits"] == 1 and cache.stats["misses"] == 1
+
+    # A new ETag means new content, so it shouldn't hit the old entry
+    new_key = RawCache.key("azure", blob="raw/tprate_2020.grib", etag="0x2")
+    assert not cache.get(new_key, dest)
+
+
+def test_raw_cache_evicts_least_recently_used(tmp_path):
+    cache = RawCache(tmp_path / "cache", max_bytes=25)
+    keys = [RawCache.key("azure", blob=f"file_{i}") for i in range(3)]
+    cache.put(keys[0], write_file(tmp_path / "file_0", 10))
+    cache.put(keys[1], write_file(tmp_path / "file_1", 10))
+    # Accessing the first file makes the second one the least recently used
+    assert cache.get(keys[0], tmp_path / "dest")
+    cache.put(keys[2], write_file(tmp_path / "file_2", 10))
+
+    assert cache.stats["evictions"] == 1
+    assert cache.get(keys[0], tmp_path / "dest")
+    assert not cache.get(keys[1], tmp_path / "dest")
+    assert cache.get(keys[2], tmp_path / "dest")
+
+
+def test_grib_index_cache_follows_content(tmp_path):
+    cache = GribIndexCache(tmp_path / "cache")
+
+    def open_grib(grib_path):
+        # Stands for cfgrib, which writes a missing index at `indexpath`
+        with cache.indexpath(grib_path, file_checksum(grib_path)) as indexpath:
+            index_path = indexpath.format(path=grib_path, short_hash="abcde")
+            try:
+                with open(index_path, "rb") as f:
+                    return pickle.load(f)
+            except FileNotFoundError:
+                index = SimpleNamespace(fieldset=SimpleNamespace(path=str(grib_path)))
+                with open(index_path, "wb") as f:
+                    pickle.dump(index, f)
+
+    first = tmp_path / "run_1" / "tprate_2020.grib"
+    first.parent.mkdir()
+    first.write_bytes(b"GRIB1")
+    assert open_grib(first) is None
+
+    # Same content downloaded again to another directory
+    second = tmp_path / "run_2" / "tprate_2020.grib"
+    second.parent.mkdir()
+    second.write_bytes(b"GRIB1")
+    assert open_grib(second).fieldset.path == str(second)
+
+    # Changed content
+    second.write_bytes(b"GRIB2")
+    assert open_grib(second) is None
+    assert cache.stats == {"hits": 1, "misses": 2}
+
+    # The cache holds the only copy of the indexes
+    assert list(tmp_path.glob("run_*/*.idx")) == []
+    assert list(cache.scratch_dir.iterdir()) == []
+    assert len(list(cache.cache_dir.glob("*/*.idx"))) == 2
+
+
+def _write_grib(path):
+    # Imported after rasterio, see `grib_utils`
+    import eccodes
+
+    sample = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib1")
+    with open(path, "wb") as f:
+        for day in (1, 2):
+            gid = eccodes.codes_clone(sample)
+            eccodes.codes_set(gid, "dataDate", 20200300 + day)
+            eccodes.codes_set_values(gid, np.full(16 * 31, float(day)))
+            eccodes.codes_write(gid, f)
+            eccodes.codes_release(gid)
+    eccodes.codes_release(sample)
+
+
+def test_grib_index_cache_is_reused_by_cfgrib(tmp_path):
+    # Imported after rasterio, see `grib_utils`
+    import cfgrib
+
+    cache = GribIndexCache(tmp_path / "cache")
+    first = tmp_path / "run_1" / "tprate_2020.grib"
+    first.parent.mkdir()
+    _write_grib(first)
+    # Same content downloaded again to another directory
+    second = tmp_path / "run_2" / "tprate_2020.grib"
+    second.parent.mkdir()
+    shutil.copy(first, second)
+
+    def open_grib(grib_path):
+        with cache.indexpath(grib_path, file_checksum(grib_path)) as indexpath:
+            with xr.open_dataset(
+                grib_path, engine="cfgrib", indexpath=indexpath, decode_timedelta=False
+            ) as ds:
+                return ds.load()
+
+    scan = cfgrib.messages.FileIndex.from_fieldset
+    with patch.object(
+        cfgrib.messages.FileIndex, "from_fieldset", side_effect=scan
+    ) as from_fieldset:
+        ds_first = open_grib(first)
+        assert from_fieldset.call_count == 1
+        ds_second = open_grib(second)
+        # cfgrib loaded the cached index rather than scanning the file again
+        assert from_fieldset.call_count == 1
+
+    assert cache.stats == {"hits": 1, "misses": 1}
+    assert len(list((tmp_path / "cache").glob("*/*.idx"))) == 1
+    # No index was left next to the raw files
+    assert list(tmp_path.glob("run_*/*.idx")) == []
+    xr.testing.assert_equal(ds_first, ds_second)
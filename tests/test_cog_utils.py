@@ -0,0 +1,73 @@
+import numpy as np
+import rioxarray  # noqa: F401
+import xarray as xr
+from rasterio.io import MemoryFile
+
+from src.utils.cog_utils import cog_bytes, cog_options, cog_sparsity
+
+
+def test_cog_bytes():
+    da = xr.DataArray(
+        np.arange(20 * 30, dtype="float32").reshape(20, 30),
+        dims=("y", "x"),
+        coords={"y": np.linspace(10, 0, 20), "x": np.linspace(0, 15, 30)},
+    ).rio.write_crs("EPSG:4326")
+
+    data = cog_bytes(da, {"compress": "ZSTD", "predictor": "YES"})
+
+    with MemoryFile(data) as memfile, memfile.open() as src:
+        assert src.driver == "GTiff"
+        assert src.crs.to_epsg() == 4326
+        assert src.compression.name == "zstd"
+        np.testing.assert_array_equal(src.read(1), da.values)
+
+
+def test_cog_options():
+    options, env = cog_options(
+        {"compress": "ZSTD", "level": 9, "blocksize": None, "gdal_cachemax": 512}
+    )
+    assert options == {"compress": "ZSTD", "level": 9}
+    assert env == {"GDAL_CACHEMAX": 512}
+    assert cog_options(None) == ({}, {})
+
+
+def test_sparse_cog_omits_empty_blocks():
+    values = np.zeros((1024, 1024), dtype="float32")
+    values[:100, :100] = 0.5
+    da = xr.DataArray(
+        values,
+        dims=("y", "x"),
+        coords={"y": np.arange(1024.0)[::-1], "x": np.arange(1024.0)},
+    ).rio.write_crs("EPSG:4326")
+    # A NaN nodata would keep blocks of zeros
+    da = da.rio.write_nodata(np.nan)
+    profile = {"compress": "ZSTD", "blocksize": 256}
+
+    dense = cog_bytes(da, profile)
+    sparse = cog_bytes(da, {**profile, "sparse": True})
+
+    assert cog_sparsity(dense) == 0
+    assert cog_sparsity(sparse) == 15 / 16
+    assert len(sparse) < len(dense)
+    with MemoryFile(sparse) as memfile, memfile.open() as src:
+        assert src.nodata is None
+        np.testing.assert_array_equal(src.read(1), values)
+
+
+def test_sparse_cog_of_dataset():
+    values = np.zeros((512, 512), dtype="float32")
+    values[:100, :100] = 0.5
+    coords = {"y": np.arange(512.0)[::-1], "x": np.arange(512.0)}
+    ds = xr.Dataset(
+        {name: (("y", "x"), values) for name in ("SFED", "MFED")}, coords=coords
+    ).rio.write_crs("EPSG:4326")
+    for name in ds.data_vars:
+        ds[name].encoding["_FillValue"] = np.nan
+
+    sparse = cog_bytes(ds, {"blocksize": 256, "sparse": True})
+
+    assert cog_sparsity(sparse) == 3 / 4
+    with MemoryFile(sparse) as memfile, memfile.open() as src:
+        assert src.count == 2
+        assert src.nodata is None
+        np.testing.assert_array_equal(src.read(2), values)
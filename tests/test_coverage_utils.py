@@ -0,0 +1,67 @@
+import pandas as pd
+import pytest
+
+from src.utils.coverage_utils import (
+    contiguous_ranges,
+    existing_index,
+    expected_dates,
+    find_missing,
+)
+
+
+def test_find_missing_daily():
+    expected = expected_dates("2024-01-01", "2024-01-10", "D")
+    entries = [{"date": f"2024-01-{day:02d}", "leadtime": None} for day in (1, 2, 5)]
+    missing, coverage_pct = find_missing(expected, existing_index(entries))
+    assert len(missing) == 7
+    assert coverage_pct == pytest.approx(30)
+
+
+def test_find_missing_ignores_dates_outside_range():
+    expected = expected_dates("2024-01-01", "2024-04-01", "M")
+    entries = [
+        {"date": date, "leadtime": None}
+        for date in ["2023-12-01", "2024-01-01", "2024-02-01", "2024-02-01"]
+    ]
+    missing, coverage_pct = find_missing(expected, existing_index(entries))
+    assert list(missing) == [pd.Timestamp("2024-03-01"), pd.Timestamp("2024-04-01")]
+    assert coverage_pct == pytest.approx(50)
+
+
+def test_find_missing_with_leadtimes():
+    expected = expected_dates("2024-01-01", "2024-02-01", "M")
+    entries = [
+        {"date": date, "leadtime": leadtime}
+        for date in ["2024-01-01", "2024-02-01"]
+        for leadtime in range(7)
+    ]
+    # Drop a single leadtime for February
+    entries = entries[:-1]
+    missing, coverage_pct = find_missing(
+        expected, existing_index(entries, leadtimes=7), leadtimes=7
+    )
+    assert list(missing) == [pd.Timestamp("2024-02-01")]
+    assert coverage_pct == pytest.approx(13 / 14 * 100)
+
+
+@pytest.mark.parametrize(
+    "dates, frequency, expected",
+    [
+        ([], "D", []),
+        (
+            ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-05"],
+            "D",
+            [("2024-01-01", "2024-01-03"), ("2024-01-05", "2024-01-05")],
+        ),
+        (
+            ["2023-11-01", "2023-12-01", "2024-01-01", "2024-03-01"],
+            "M",
+            [("2023-11-01", "2024-01-01"), ("2024-03-01", "2024-03-01")],
+        ),
+    ],
+)
+def test_contiguous_ranges(dates, frequency, expected):
+    ranges = contiguous_ranges(pd.DatetimeIndex(dates), frequency)
+    assert ranges == [
+        (pd.Timestamp(start), pd.Timestamp(end)) for start, end in expected
+    ]
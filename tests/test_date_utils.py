@@ -4,7 +4,11 @@ from datetime import datetime
 import pytest
 from typing_extensions import assert_type
 
-from src.utils.date_utils import create_date_range, get_datetime_from_filename
+from src.utils.date_utils import (
+    create_date_range,
+    get_datetime_from_filename,
+    greedy_window_cover,
+)
 
 
 @pytest.mark.parametrize(
@@ -96,3 +100,22 @@ def test_create_date_range_raises_exception(start, end, min_accepted, max_accept
 )
 def test_get_datetime_from_filename(filename, expected):
     assert get_datetime_from_filename(filename, return_type=True) == expected
+
+
+def test_greedy_window_cover():
+    dates = create_date_range(datetime(2024, 1, 1), datetime(2024, 4, 9))
+    window_ends = [datetime(2024, 3, 1), datetime(2024, 3, 30), datetime(2024, 4, 9)]
+
+    chosen, uncovered = greedy_window_cover(dates, window_ends, 90)
+
+    # The latest window covers Jan 11 - Apr 9. Both other windows cover the
+    # rest, and the later one is preferred
+    assert chosen == [datetime(2024, 3, 30), datetime(2024, 4, 9)]
+    assert uncovered == []
+
+
+def test_greedy_window_cover_uncovered():
+    dates = [datetime(2024, 1, 1), datetime(2024, 6, 1)]
+    chosen, uncovered = greedy_window_cover(dates, [datetime(2024, 1, 5)], 90)
+    assert chosen == [datetime(2024, 1, 5)]
+    assert uncovered == [datetime(2024, 6, 1)]
@@ -0,0 +1,82 @@
+import dask
+import numpy as np
+import pytest
+
+from src.utils.ensemble_utils import DelayedEnsembleReducer, EnsembleReducer, P2Quantile
+
+
+@pytest.fixture
+def members():
+    return np.random.default_rng(0).gamma(2, 2, size=(51, 6, 8))
+
+
+def test_ensemble_reducer_moments(members):
+    reducer = EnsembleReducer(scale=2)
+    for member in members:
+        reducer.add(member)
+
+    np.testing.assert_allclose(reducer.mean(), (members * 2).mean(axis=0))
+    np.testing.assert_allclose(reducer.spread(), (members * 2).std(axis=0, ddof=1))
+
+
+def test_ensemble_reducer_terciles(members):
+    lower = np.full(members.shape[1:], 2.0)
+    reducer = EnsembleReducer(terciles=(lower, 5.0))
+    for member in members:
+        reducer.add(member)
+
+    below, near, above = reducer.tercile_probabilities()
+    np.testing.assert_allclose(below, (members < 2).mean(axis=0))
+    np.testing.assert_allclose(above, (members > 5).mean(axis=0))
+    np.testing.assert_allclose(below + near + above, 1)
+
+
+def test_p2_quantile(members):
+    median = P2Quantile(0.5)
+    for member in members[:4]:
+        median.add(member)
+    # Exact with up to five observations
+    np.testing.assert_allclose(median.estimate(), np.median(members[:4], axis=0))
+
+    reducer = EnsembleReducer(percentiles=[10, 50, 90])
+    for member in members:
+        reducer.add(member)
+    estimates = reducer.percentiles()
+    for percentile, estimate in estimates.items():
+        exact = np.percentile(members, percentile, axis=0)
+        assert np.abs(estimate - exact).mean() < 0.5 * members.std()
+    assert (estimates[10] <= estimates[50]).all()
+    assert (estimates[50] <= estimates[90]).all()
+
+
+def test_delayed_ensemble_reducer_shares_one_pass(members):
+    reads = []
+
+    def read_members():
+        for member in members:
+            reads.append(member)
+            yield member
+
+    lower = np.full(members.shape[1:], 2.0)
+    kwargs = {"percentiles": [50], "terciles": (lower, 5.0), "scale": 2}
+    delayed = DelayedEnsembleReducer(read_members, members.shape[1:], **kwargs)
+    mean, spread = delayed.mean(), delayed.spread()
+    (median,) = delayed.percentiles().values()
+    below, near, above = delayed.tercile_probabilities()
+    # Nothing is read until the statistics are computed
+    assert reads == []
+
+    results = dask.compute(mean, spread, median, below, near, above)
+    assert len(reads) == len(members)
+
+    reducer = EnsembleReducer(**kwargs)
+    for member in members:
+        reducer.add(member)
+    expected = (
+        reducer.mean(),
+        reducer.spread(),
+        reducer.percentiles()[50],
+        *reducer.tercile_probabilities(),
+    )
+    for result, values in zip(results, expected):
+        np.testing.assert_array_equal(result, values)
@@ -1,14 +1,24 @@
+import threading
 from unittest.mock import call, patch
 
+import dask.array
+import numpy as np
+import pandas as pd
 import pytest
+import rasterio
+import rioxarray  # noqa: F401
+import xarray as xr
 
 from src.pipelines.era5_pipeline import ERA5Pipeline
+from src.pipelines.pipeline import WorkUnitsFailed
+from src.utils.manifest_utils import (
+    MANIFEST_FILENAME,
+    manifest_entry,
+    read_local_manifest,
+)
 
 
-@pytest.fixture
-def pipeline(monkeypatch):
-    monkeypatch.setenv("CDSAPI_KEY", "dummy-key")
-    monkeypatch.setenv("CDSAPI_URL", "dummy-url")
+def _era5_pipeline(**kwargs):
     return ERA5Pipeline(
         mode="local",
         is_update=False,
@@ -22,9 +32,20 @@ def pipeline(monkeypatch):
         backfill=False,
         metadata={},
         coverage={},
+        **kwargs,
     )
 
 
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path_factory):
+    monkeypatch.setenv("CDSAPI_KEY", "dummy-key")
+    monkeypatch.setenv("CDSAPI_URL", "dummy-url")
+    pipeline = _era5_pipeline()
+    # Keep local outputs and the manifest out of the repo
+    pipeline.local_processed_dir = tmp_path_factory.mktemp("processed")
+    return pipeline
+
+
 def test_generate_raw_filename(pipeline):
     assert (
         pipeline._generate_raw_filename(2020)
@@ -34,6 +55,10 @@ def test_generate_raw_filename(pipeline):
         pipeline._generate_raw_filename(2020, 6)
         == "tp_reanalysis_monthly_2020_06.grib"  # noqa
     )
+    assert (
+        pipeline._generate_raw_filename(2020, months=[7, 3])
+        == "tp_reanalysis_monthly_2020_03_07.grib"  # noqa
+    )
 
 
 def test_generate_processed_filename(pipeline):
@@ -64,3 +89,212 @@ def test_run_pipeline_update(mock_process_data, mock_get_raw_data, pipeline):
     # In update mode, it should only process the last month
     assert mock_get_raw_data.call_count == 1
     assert mock_process_data.call_count == 1
+
+
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.get_raw_data")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.process_data")
+def test_run_pipeline_update_writes_manifest(
+    mock_process_data, mock_get_raw_data, pipeline
+):
+    filename = "precip_reanalysis_v2020-01-01.tif"
+    mock_process_data.side_effect = lambda raw: pipeline._record_manifest_entries(
+        {filename: manifest_entry(filename, 10)}
+    )
+    pipeline.is_update = True
+    pipeline.run_pipeline()
+    manifest = read_local_manifest(pipeline.local_processed_dir / MANIFEST_FILENAME)
+    assert list(manifest["files"]) == [filename]
+
+
+@patch("src.pipelines.pipeline.validate_dataset", return_value=True)
+def test_changed_cog_profile_rewrites_outputs(mock_validate, pipeline):
+    da = xr.DataArray(
+        np.ones((2, 2), dtype="float32"),
+        dims=("y", "x"),
+        coords={"y": [1.0, 0.0], "x": [0.0, 1.0]},
+    ).rio.write_crs("EPSG:4326")
+    filename = "precip_reanalysis_v2020-01-01.tif"
+    path = pipeline.local_processed_dir / filename
+
+    def save(pipeline):
+        pipeline._raw_identity = ["0x1"]
+        pipeline.save_processed_data(da, filename)
+        pipeline.finish_run()
+        with rasterio.open(path) as src:
+            return path.stat().st_mtime_ns, src.compression
+
+    written, compression = save(pipeline)
+    assert compression.name == "lzw"
+    # Unchanged inputs and config
+    rerun = _era5_pipeline()
+    rerun.local_processed_dir = pipeline.local_processed_dir
+    assert save(rerun) == (written, compression)
+    # A new COG profile re-encodes the output
+    zstd = _era5_pipeline(cog={"compress": "ZSTD"})
+    zstd.local_processed_dir = pipeline.local_processed_dir
+    assert save(zstd)[1].name == "zstd"
+
+
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.get_raw_data")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.process_data")
+def test_run_work_units_collects_failures(
+    mock_process_data, mock_get_raw_data, pipeline
+):
+    mock_get_raw_data.side_effect = ["ok.grib", ValueError("CDS request failed")]
+    results = pipeline.run_work_units([{"year": 2020}, {"year": 2021}])
+    assert [result["success"] for result in results] == [True, False]
+    assert results[1]["unit"] == {"year": 2021}
+    assert results[1]["error"] == "CDS request failed"
+    mock_process_data.assert_called_once_with("ok.grib")
+
+
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.get_raw_data")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.process_data")
+def test_run_pipeline_raises_after_failed_units(
+    mock_process_data, mock_get_raw_data, pipeline
+):
+    mock_get_raw_data.side_effect = [ValueError("CDS request failed"), "ok.grib"]
+    with pytest.raises(WorkUnitsFailed, match="CDS request failed"):
+        pipeline.run_pipeline()
+    # The other units still ran
+    mock_process_data.assert_called_once_with("ok.grib")
+
+
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.get_raw_data")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.process_data")
+def test_stream_work_units(mock_process_data, mock_get_raw_data, pipeline):
+    pipeline.stream = True
+    pipeline.prefetch = 1
+    mock_get_raw_data.side_effect = lambda year: f"{year}.grib"
+    mock_process_data.side_effect = [None, ValueError("Bad GRIB"), None]
+    results = pipeline.run_work_units([{"year": year} for year in range(2020, 2023)])
+    assert [result["success"] for result in results] == [True, False, True]
+    assert mock_process_data.call_args_list == [
+        call("2020.grib"),
+        call("2021.grib"),
+        call("2022.grib"),
+    ]
+
+
+@patch("src.pipelines.pipeline.validate_dataset", return_value=True)
+@patch("src.pipelines.pipeline.upload_data_by_mode")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.get_raw_data")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.process_data")
+def test_stream_work_units_reports_failed_uploads(
+    mock_process_data, mock_get_raw_data, mock_upload, mock_validate, pipeline
+):
+    pipeline.mode = "dev"
+    pipeline.stream = True
+    pipeline.in_memory = True
+    mock_get_raw_data.side_effect = lambda year: f"{year}.grib"
+    da = xr.DataArray(
+        np.zeros((2, 2), dtype="float32"),
+        dims=("y", "x"),
+        coords={"y": [1.0, 0.0], "x": [0.0, 1.0]},
+    ).rio.write_crs("EPSG:4326")
+    mock_process_data.side_effect = lambda raw_filename: pipeline.save_processed_data(
+        da, f"precip_reanalysis_v{raw_filename[:4]}-01-01.tif"
+    )
+    mock_upload.side_effect = [{"etag": "0x1"}, ConnectionError("Upload failed")]
+    threads = threading.active_count()
+
+    with (
+        patch.object(pipeline, "_get_existing_outputs", return_value={}),
+        patch.object(pipeline, "flush_manifest"),
+    ):
+        results = pipeline.run_work_units([{"year": 2020}, {"year": 2021}])
+
+    # The COG of 2021 was processed, but its upload failed
+    assert [result["success"] for result in results] == [True, False]
+    assert results[1]["error"] == "Upload failed"
+    assert mock_upload.call_count == 2
+    # The uploader and downloader threads are joined
+    assert threading.active_count() == threads
+    assert pipeline._upload_queue is None
+
+
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.get_raw_data")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.process_data")
+@patch("src.pipelines.era5_pipeline.ERA5Pipeline.check_coverage")
+def test_run_pipeline_backfill(
+    mock_check_coverage, mock_process_data, mock_get_raw_data, pipeline
+):
+    pipeline.backfill = True
+    pipeline.start_year = pipeline.end_year = 2021
+    missing = ["2019-01-01", "2019-02-01", "2019-06-01", "2020-03-01", "2021-05-01"]
+    mock_check_coverage.return_value = ([pd.Timestamp(d) for d in missing], 95.0)
+    with patch.object(pipeline, "print_coverage_report"):
+        pipeline.run_pipeline()
+    # One request per year, and none for 2021 as it's processed anyway
+    assert mock_get_raw_data.call_args_list == [
+        call(year=2019, months=[1, 2, 6]),
+        call(year=2020, month=3),
+        call(year=2021),
+    ]
+    assert mock_process_data.call_count == 3
+
+
+def test_stream_data(pipeline, tmp_path):
+    # Imported after rasterio, see `grib_utils`
+    import eccodes
+
+    pipeline.local_raw_dir = tmp_path
+    sample = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib1")
+    with open(tmp_path / "tp.grib", "wb") as f:
+        for month in (1, 2):
+            gid = eccodes.codes_clone(sample)
+            eccodes.codes_set(gid, "dataDate", int(f"2020{month:02d}01"))
+            eccodes.codes_set_values(gid, np.full(16 * 31, month / 1000))
+            eccodes.codes_write(gid, f)
+            eccodes.codes_release(gid)
+    eccodes.codes_release(sample)
+
+    pipeline.grib_decoder = "eccodes"
+    with patch.object(pipeline, "save_processed_data") as save_processed_data:
+        pipeline.process_data("tp.grib")
+
+    filenames = [c.args[1] for c in save_processed_data.call_args_list]
+    assert filenames == [
+        "precip_reanalysis_v2020-01-01.tif",
+        "precip_reanalysis_v2020-02-01.tif",
+    ]
+    ds = save_processed_data.call_args_list[1].args[0]
+    assert ds["total precipitation"].dtype == np.float32
+    np.testing.assert_allclose(ds["total precipitation"], 2, rtol=1e-3)
+    assert str(ds.rio.crs) == "EPSG:4326"
+
+
+def test_save_processed_outputs_computes_shared_steps_once(pipeline):
+    calls = []
+
+    def decode(block):
+        calls.append(block.shape)
+        return block * 1000
+
+    raw = xr.DataArray(
+        dask.array.ones((3, 4, 5), dtype="float32", chunks=-1),
+        dims=("valid_time", "y", "x"),
+        coords={
+            "valid_time": pd.date_range("2020-01-01", periods=3, freq="MS"),
+            "y": np.linspace(10, 0, 4),
+            "x": np.linspace(0, 20, 5),
+        },
+    )
+    ds = raw.copy(
+        data=raw.data.map_blocks(decode, meta=np.array((), dtype="float32"))
+    ).to_dataset(name="tp")
+    ds = ds.rio.write_crs("EPSG:4326")
+    outputs = []
+    for month in range(1, 4):
+        pipeline.metadata["month_valid"] = month
+        ds_sel = ds.isel(valid_time=month - 1)
+        ds_sel.attrs = dict(pipeline.metadata)
+        outputs.append((ds_sel, f"precip_reanalysis_v2020-{month:02}-01.tif", None))
+
+    with patch.object(pipeline, "save_processed_data") as save_processed_data:
+        pipeline.save_processed_outputs(outputs)
+
+    assert len(calls) == 1
+    saved = sorted(save_processed_data.call_args_list, key=lambda c: c.args[1])
+    assert [c.args[0].attrs["month_valid"] for c in saved] == [1, 2, 3]
+    assert all(float(c.args[0]["tp"].max()) == 1000 for c in saved)
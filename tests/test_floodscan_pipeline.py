@@ -0,0 +1,363 @@
+from unittest.mock import Mock, patch
+from zipfile import ZipFile
+
+import fsspec
+import numpy as np
+import pandas as pd
+import pytest
+import rioxarray  # noqa: F401
+import xarray as xr
+
+from src.pipelines.floodscan_pipeline import MFED, SFED, FloodScanPipeline
+from src.pipelines.pipeline import WorkUnitsFailed
+from src.utils.manifest_utils import MANIFEST_FILENAME, read_local_manifest
+from src.utils.zip_utils import RemoteZip
+
+
+@pytest.fixture
+def pipeline(tmp_path_factory):
+    pipeline = FloodScanPipeline(
+        mode="local",
+        log_level="INFO",
+        container_name="test-container",
+        raw_path="test-raw",
+        processed_path="test-processed",
+        use_cache=False,
+        backfill=False,
+        is_update=False,
+        baseline_update=False,
+        start_date="2020-01-01",
+        end_date="2020-01-03",
+        version=5,
+        sfed_historical="sfed.nc",
+        mfed_historical="mfed.nc",
+        metadata={},
+        coverage={},
+    )
+    # Keep local outputs and the manifest out of the repo
+    pipeline.local_processed_dir = tmp_path_factory.mktemp("processed")
+    return pipeline
+
+
+@pytest.fixture
+def historical_file(tmp_path):
+    # Non-standard calendar, so that time is decoded to cftime objects
+    time = xr.cftime_range("2020-01-01", periods=3, freq="D", calendar="noleap")
+    ds = xr.Dataset(
+        {
+            "SFED_AREA": (
+                ("time", "lat", "lon"),
+                np.arange(3 * 4 * 5, dtype="float32").reshape(3, 4, 5),
+            )
+        },
+        coords={"time": time, "lat": np.arange(4.0), "lon": np.arange(5.0)},
+    )
+    filepath = tmp_path / "sfed.nc"
+    ds.to_netcdf(filepath)
+    return filepath
+
+
+def test_process_historical_data_opens_once(pipeline, historical_file):
+    with patch("xarray.open_dataset", wraps=xr.open_dataset) as open_dataset:
+        das = [
+            pipeline.process_historical_data(historical_file, date, SFED)
+            for date in pd.date_range("2020-01-01", periods=3)
+        ]
+    assert open_dataset.call_count == 1
+
+    da = das[1]
+    assert da.name == SFED
+    assert da.dims == ("y", "x")
+    # Latitudes are flipped to run north to south
+    assert da["y"].values.tolist() == [3.0, 2.0, 1.0, 0.0]
+    np.testing.assert_array_equal(da.values[-1], np.arange(20, 25, dtype="float32"))
+
+
+def test_convert_historical_to_zarr(pipeline, historical_file, tmp_path):
+    mfed_file = tmp_path / "mfed.nc"
+    ds = xr.open_dataset(historical_file).rename({"SFED_AREA": "MFED_AREA"})
+    ds.to_netcdf(mfed_file)
+    pipeline.local_raw_dir = tmp_path
+    pipeline.historical_zarr = "historical.zarr"
+    pipeline.get_historical_nc_files = lambda: (historical_file, mfed_file)
+
+    assert not pipeline.historical_zarr_exists()
+    pipeline.convert_historical_to_zarr()
+    assert pipeline.historical_zarr_exists()
+    nc_identity = pipeline._raw_identity
+
+    zarr = ("historical.zarr", "historical.zarr")
+    pipeline._set_raw_inputs(zarr)
+    assert pipeline._raw_identity == nc_identity
+
+    date = pd.Timestamp("2020-01-02")
+    from_nc = pipeline.process_historical_data(historical_file, date, SFED)
+    from_zarr = pipeline.process_historical_data(zarr[0], date, SFED)
+    xr.testing.assert_identical(from_nc, from_zarr)
+
+
+def test_run_pipeline_fails_when_saving_fails(pipeline, historical_file, tmp_path):
+    mfed_file = tmp_path / "mfed.nc"
+    ds = xr.open_dataset(historical_file).rename({"SFED_AREA": "MFED_AREA"})
+    ds.to_netcdf(mfed_file)
+    pipeline.local_raw_dir = tmp_path
+    pipeline.get_historical_nc_files = lambda: (historical_file, mfed_file)
+
+    with (
+        patch.object(
+            pipeline, "save_processed_outputs", side_effect=OSError("Disk full")
+        ),
+        pytest.raises(WorkUnitsFailed, match="Disk full"),
+    ):
+        pipeline.run_pipeline()
+
+
+def _write_90days_zip(path, band_type, dates, tmp_path):
+    with ZipFile(path, "w") as zipobj:
+        for i, date in enumerate(dates):
+            da = xr.DataArray(
+                np.full((1, 4, 5), i, dtype="float32"),
+                dims=("band", "y", "x"),
+                coords={"band": [1], "y": np.arange(4.0)[::-1], "x": np.arange(5.0)},
+            ).rio.write_crs("EPSG:4326")
+            name = f"aer_floodscan_{band_type.lower()}_{date:%Y%m%d}.tif"
+            da.rio.to_raster(tmp_path / name)
+            zipobj.write(tmp_path / name, f"daily/{name}")
+            (tmp_path / name).unlink()
+
+
+def test_process_historical_zipped_data_reads_in_place(pipeline, tmp_path):
+    dates = list(pd.date_range("2024-03-01", periods=3).to_pydatetime())
+    zips = {}
+    for band_type in (SFED, MFED):
+        zips[band_type] = tmp_path / f"{band_type.lower()}.zip"
+        _write_90days_zip(zips[band_type], band_type, dates, tmp_path)
+    pipeline.local_raw_dir = tmp_path / "raw"
+    pipeline.local_raw_dir.mkdir()
+
+    with patch.object(pipeline, "save_processed_outputs") as save_processed_outputs:
+        pipeline.process_historical_zipped_data([zips], dates[1:])
+
+    # All dates of the zip are saved in a single pass
+    (outputs,) = save_processed_outputs.call_args.args
+    assert [filename for _, filename, _, _ in outputs] == [
+        pipeline._generate_processed_filename(date) for date in dates[1:]
+    ]
+    ds = outputs[0][0]
+    assert set(ds.data_vars) == {SFED, MFED}
+    assert (ds[SFED].values == 1).all()
+    # Each output keeps the identity of its own members
+    identities = [raw_identity for _, _, _, raw_identity in outputs]
+    assert all(len(identity) == 2 for identity in identities)
+    assert identities[0] != identities[1]
+    # Nothing is extracted to disk
+    assert list(pipeline.local_raw_dir.iterdir()) == []
+
+
+def test_process_historical_zipped_data_reads_remote_zips(pipeline, tmp_path):
+    dates = list(pd.date_range("2024-03-01", periods=3).to_pydatetime())
+    fs = fsspec.filesystem("file")
+    zips = {}
+    for band_type in (SFED, MFED):
+        path = tmp_path / f"{band_type.lower()}.zip"
+        _write_90days_zip(path, band_type, dates, tmp_path)
+        zips[band_type] = RemoteZip(fs, str(path))
+
+    values = []
+
+    def save_processed_outputs(outputs):
+        for ds, _, _, _ in outputs:
+            values.append((ds[SFED].values.max(), ds[MFED].values.max()))
+
+    with patch.object(
+        pipeline, "save_processed_outputs", side_effect=save_processed_outputs
+    ):
+        pipeline.process_historical_zipped_data([zips], dates[1:])
+
+    assert values == [(1, 1), (2, 2)]
+    # The in-memory GeoTIFFs are released once saved
+    assert pipeline._member_files == {}
+
+
+def test_process_historical_zipped_data_records_member_identities(pipeline, tmp_path):
+    dates = list(pd.date_range("2024-03-01", periods=3).to_pydatetime())
+    zips = {}
+    for band_type in (SFED, MFED):
+        zips[band_type] = tmp_path / f"{band_type.lower()}.zip"
+        _write_90days_zip(zips[band_type], band_type, dates, tmp_path)
+
+    pipeline.process_historical_zipped_data([zips], dates)
+
+    manifest = read_local_manifest(pipeline.local_processed_dir / MANIFEST_FILENAME)
+    raw = [
+        manifest["files"][pipeline._generate_processed_filename(date)]["raw"]
+        for date in dates
+    ]
+    # Outputs saved together keep the identity of their own members
+    assert all(len(identity) == 2 for identity in raw)
+    assert len({tuple(identity) for identity in raw}) == len(dates)
+
+
+def test_process_historical_zipped_data_records_failed_zips(pipeline, tmp_path):
+    dates = list(pd.date_range("2024-03-01", periods=2).to_pydatetime())
+    zips = {}
+    for band_type in (SFED, MFED):
+        zips[band_type] = tmp_path / f"{band_type.lower()}.zip"
+        _write_90days_zip(zips[band_type], band_type, dates, tmp_path)
+
+    with patch.object(
+        pipeline, "save_processed_outputs", side_effect=OSError("Disk full")
+    ):
+        pipeline.process_historical_zipped_data([zips], dates)
+
+    assert [result["unit"] for result in pipeline._failed_units] == [{"dates": dates}]
+    with pytest.raises(WorkUnitsFailed, match="Disk full"):
+        pipeline.finish_run()
+
+
+def test_backfill_fetches_latest_archives_once(pipeline, tmp_path):
+    dates = list(pd.date_range("2024-03-01", periods=3).to_pydatetime())
+    content = {}
+    for band_type in (SFED, MFED):
+        zip_path = tmp_path / f"{band_type.lower()}.zip"
+        _write_90days_zip(zip_path, band_type, dates, tmp_path)
+        content[band_type] = zip_path.read_bytes()
+    pipeline.local_raw_dir = tmp_path / "raw"
+    pipeline.local_raw_dir.mkdir()
+    pipeline.sfed_base_url, pipeline.mfed_base_url = SFED, MFED
+
+    missing = pd.DatetimeIndex(dates[:2])
+    with (
+        patch("requests.get", side_effect=lambda url: Mock(content=content[url])),
+        patch.object(pipeline, "check_coverage", return_value=(missing, 0)),
+        patch.object(pipeline, "print_coverage_report"),
+        patch.object(pipeline, "save_raw_data") as save_raw_data,
+        patch.object(pipeline, "save_processed_outputs") as save_processed_outputs,
+    ):
+        pipeline.backfill_missing_dates()
+
+    # Both missing dates come from a single download and upload of each zip,
+    # and are saved in a single pass
+    assert save_raw_data.call_count == 2
+    (outputs,) = save_processed_outputs.call_args.args
+    assert [filename for _, filename, _, _ in outputs] == [
+        pipeline._generate_processed_filename(date) for date in missing
+    ]
+
+
+def test_backfill_skips_dates_outside_latest_archives(pipeline, tmp_path, caplog):
+    dates = list(pd.date_range("2024-03-01", periods=3).to_pydatetime())
+    content = {}
+    for band_type in (SFED, MFED):
+        zip_path = tmp_path / f"{band_type.lower()}.zip"
+        _write_90days_zip(zip_path, band_type, dates, tmp_path)
+        content[band_type] = zip_path.read_bytes()
+    pipeline.local_raw_dir = tmp_path / "raw"
+    pipeline.local_raw_dir.mkdir()
+    pipeline.sfed_base_url, pipeline.mfed_base_url = SFED, MFED
+
+    missing = pd.DatetimeIndex(["2023-11-01", "2023-11-02", "2024-03-02"])
+    with (
+        patch("requests.get", side_effect=lambda url: Mock(content=content[url])),
+        patch.object(pipeline, "check_coverage", return_value=(missing, 0)),
+        patch.object(pipeline, "print_coverage_report"),
+        patch.object(pipeline, "save_raw_data"),
+        patch.object(pipeline, "save_processed_outputs") as save_processed_outputs,
+        caplog.at_level("WARNING"),
+    ):
+        pipeline.backfill_missing_dates()
+
+    (outputs,) = save_processed_outputs.call_args.args
+    assert [filename for _, filename, _, _ in outputs] == [
+        pipeline._generate_processed_filename(missing[2])
+    ]
+    # Dates outside the zips are reported once, rather than failing the run
+    assert pipeline._failed_units == []
+    warnings = [r.message for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 1
+    assert "2023-11-01 to 2023-11-02" in warnings[0]
+
+
+def test_accumulate_baseline_folds_processed_cogs(pipeline, tmp_path):
+    dates = list(pd.date_range("2020-01-01", periods=3).to_pydatetime())
+    pipeline.local_processed_dir = tmp_path
+    for i, date in enumerate(dates):
+        da = xr.DataArray(
+            np.full((2, 4, 5), i + 1, dtype="float32"),
+            dims=("band", "y", "x"),
+            coords={"band": [1, 2], "y": np.arange(4.0)[::-1], "x": np.arange(5.0)},
+        ).rio.write_crs("EPSG:4326")
+        da.rio.to_raster(tmp_path / pipeline._generate_processed_filename(date))
+
+    accumulator = pipeline._accumulate_baseline(dates)
+
+    assert accumulator.counts[:3].sum(axis=(1, 2)).tolist() == [20, 20, 20]
+    baseline = accumulator.baseline()
+    assert (baseline.sel(dayofyear=2) == 2).all()
+
+
+def test_incremental_baseline_matches_full_recompute(pipeline, tmp_path):
+    pipeline.local_raw_dir = tmp_path
+    fetched = []
+
+    def grid(date, historical=None):
+        fetched.append(date)
+        rng = np.random.default_rng(date.toordinal())
+        return xr.DataArray(
+            rng.random((2, 3)).astype("float32"),
+            dims=("y", "x"),
+            coords={"y": [1.0, 0.0], "x": [0.0, 1.0, 2.0]},
+        )
+
+    with patch.object(pipeline, "_retrieve_baseline_grid", side_effect=grid):
+        full = pipeline._baseline_window_sums(2021).baseline()
+        fetched.clear()
+        pipeline.baseline_incremental = True
+        incremental = pipeline._baseline_window_sums(2021).baseline()
+
+    assert fetched == []
+    np.testing.assert_array_equal(full.values, incremental.values)
+
+    with patch.object(pipeline, "_retrieve_baseline_grid", side_effect=grid):
+        rolled = pipeline._baseline_window_sums(2022).baseline()
+        pipeline.baseline_incremental = False
+        recomputed = pipeline._baseline_window_sums(2022).baseline()
+
+    # Rolling forward only reads the year entering the window
+    assert {date.year for date in fetched[:365]} == {2021}
+    assert len(fetched) == 365 + len(pd.date_range("2012-01-01", "2021-12-31"))
+    np.testing.assert_array_equal(rolled.values, recomputed.values)
+
+
+def test_incremental_baseline_recomputes_partial_year(pipeline, tmp_path):
+    pipeline.local_raw_dir = tmp_path
+    pipeline.baseline_incremental = True
+    available_until = pd.Timestamp("2021-06-30")
+    fetched = []
+
+    def grid(date, historical=None):
+        if date > available_until:
+            return None
+        fetched.append(date)
+        return xr.DataArray(
+            np.ones((2, 3), dtype="float32"),
+            dims=("y", "x"),
+            coords={"y": [1.0, 0.0], "x": [0.0, 1.0, 2.0]},
+        )
+
+    with patch.object(pipeline, "_retrieve_baseline_grid", side_effect=grid):
+        partial = pipeline._baseline_sums_for_year(2021)
+        assert partial.last_date == available_until
+
+        # The rest of the year is now available, so the sums are recomputed
+        available_until = pd.Timestamp("2021-12-31")
+        fetched.clear()
+        complete = pipeline._baseline_sums_for_year(2021)
+        assert len(fetched) == 365
+        assert complete.last_date == available_until
+
+        # Complete sums are reused
+        fetched.clear()
+        reused = pipeline._baseline_sums_for_year(2021)
+    assert fetched == []
+    np.testing.assert_array_equal(reused.counts, complete.counts)
@@ -0,0 +1,64 @@
+import eccodes
+import numpy as np
+import pytest
+
+from src.utils.grib_utils import iter_group_means
+
+
+def _write_seasonal_grib(path, groups, members):
+    """Write ensemble fcmean messages, from the GRIB1 sample, for each group."""
+    sample = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib1")
+    shape = (eccodes.codes_get(sample, "Nj"), eccodes.codes_get(sample, "Ni"))
+    with open(path, "wb") as f:
+        for data_date, forecast_month in groups:
+            for number in range(members):
+                gid = eccodes.codes_clone(sample)
+                eccodes.codes_set(gid, "localDefinitionNumber", 16)
+                eccodes.codes_set(gid, "dataDate", data_date)
+                eccodes.codes_set(gid, "forecastMonth", forecast_month)
+                eccodes.codes_set(gid, "number", number)
+                eccodes.codes_set(gid, "numberOfForecastsInEnsemble", members)
+                values = np.full(shape, forecast_month * 10 + number, dtype=float)
+                eccodes.codes_set_values(gid, values.ravel())
+                eccodes.codes_write(gid, f)
+                eccodes.codes_release(gid)
+    eccodes.codes_release(sample)
+    return shape
+
+
+def test_iter_group_means(tmp_path):
+    path = tmp_path / "tprate.grib"
+    groups = [(20200101, 1), (20200101, 2), (20200201, 1)]
+    shape = _write_seasonal_grib(path, groups, members=5)
+
+    means = list(iter_group_means(path, ("dataDate", "forecastMonth")))
+
+    assert [key for key, _ in means] == groups
+    for (_, forecast_month), da in means:
+        assert da.shape == shape
+        assert da.dtype == np.float32
+        assert da.attrs["messages"] == 5
+        # Mean of the members 0 to 4
+        np.testing.assert_allclose(da.values, forecast_month * 10 + 2)
+    da = means[0][1]
+    assert da.latitude[0] > da.latitude[-1]
+    assert da.latitude[0] == pytest.approx(60)
+
+
+def test_iter_group_means_filters_and_flushes_incomplete_groups(tmp_path):
+    path = tmp_path / "tprate.grib"
+    _write_seasonal_grib(path, [(20200101, 1)], members=3)
+    # Drop the last member, so the group never completes
+    with open(path, "rb") as f:
+        messages = [eccodes.codes_grib_new_from_file(f) for _ in range(3)]
+    with open(path, "wb") as f:
+        for gid in messages[:2]:
+            eccodes.codes_write(gid, f)
+            eccodes.codes_release(gid)
+    eccodes.codes_release(messages[2])
+
+    ((key, da),) = list(iter_group_means(path, ("dataDate",)))
+    assert key == (20200101,)
+    assert da.attrs["messages"] == 2
+
+    assert list(iter_group_means(path, ("dataDate",), {"dataDate": 20200201})) == []
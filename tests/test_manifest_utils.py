@@ -0,0 +1,39 @@
+import pytest
+
+from src.utils.manifest_utils import (
+    manifest_entry,
+    read_local_manifest,
+    update_local_manifest,
+)
+
+
+@pytest.mark.parametrize(
+    "filename, expected_date, expected_leadtime",
+    [
+        ("precip_em_i2024-09-01_lt4.tif", "2024-09-01", 4),
+        ("precip_reanalysis_v2020-06-01.tif", "2020-06-01", None),
+        ("aer_area_300s_v2025-01-02_v05r01.tif", "2025-01-02", None),
+    ],
+)
+def test_manifest_entry(filename, expected_date, expected_leadtime):
+    entry = manifest_entry(filename, size=10, etag="0x1")
+    assert entry == {
+        "date": expected_date,
+        "leadtime": expected_leadtime,
+        "size": 10,
+        "etag": "0x1",
+    }
+
+
+def test_update_local_manifest(tmp_path):
+    manifest_path = tmp_path / "_manifest.json"
+    assert read_local_manifest(manifest_path) is None
+
+    first = {"precip_reanalysis_v2020-06-01.tif": manifest_entry("v2020-06-01.tif")}
+    second = {"precip_reanalysis_v2020-07-01.tif": manifest_entry("v2020-07-01.tif")}
+    update_local_manifest(manifest_path, first)
+    update_local_manifest(manifest_path, second)
+    assert set(read_local_manifest(manifest_path)["files"]) == {*first, *second}
+
+    update_local_manifest(manifest_path, second, replace=True)
+    assert set(read_local_manifest(manifest_path)["files"]) == set(second)
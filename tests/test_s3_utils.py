@@ -0,0 +1,42 @@
+import pytest
+
+from src.utils.s3_utils import fetch_s3_objects, s3_filesystem
+
+moto_server = pytest.importorskip("moto.server")
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    fs = s3_filesystem(
+        client_kwargs={"endpoint_url": f"http://{host}:{port}"},
+        skip_instance_cache=True,
+    )
+    fs.mkdir("ecmwf-forecasts")
+    yield fs
+    server.stop()
+
+
+def test_fetch_s3_objects(s3, tmp_path):
+    for fc_month in range(3, 10):
+        s3.pipe(f"ecmwf-forecasts/ecmwf/T8L0301{fc_month:02}", b"GRIB" * fc_month)
+    files = {
+        f"s3://ecmwf-forecasts/ecmwf/T8L0301{fc_month:02}": tmp_path
+        / f"{fc_month}.grib"
+        for fc_month in range(3, 11)
+    }
+
+    errors = fetch_s3_objects(s3, files, max_concurrency=3)
+
+    # The missing object fails alone, and leaves no partial file behind
+    assert list(errors) == ["s3://ecmwf-forecasts/ecmwf/T8L030110"]
+    assert isinstance(errors["s3://ecmwf-forecasts/ecmwf/T8L030110"], FileNotFoundError)
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        f"{fc_month}.grib" for fc_month in range(3, 10)
+    )
+    assert (tmp_path / "5.grib").read_bytes() == b"GRIB" * 5
@@ -0,0 +1,175 @@
+from unittest.mock import patch
+
+import dask
+import numpy as np
+import pandas as pd
+import pytest
+import rioxarray  # noqa: F401
+import xarray as xr
+
+from src.pipelines.seas5_pipeline import TPRATE_TO_MM_DAY, SEAS5Pipeline
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path_factory):
+    for variable in ("ECMWF_API_URL", "ECMWF_API_KEY", "ECMWF_API_EMAIL"):
+        monkeypatch.setenv(variable, "dummy")
+    pipeline = SEAS5Pipeline(
+        mode="local",
+        is_update=False,
+        start_year=2020,
+        end_year=2020,
+        log_level="INFO",
+        container_name="test-container",
+        raw_path="test-raw",
+        processed_path="test-processed",
+        use_cache=False,
+        backfill=False,
+        metadata={},
+        coverage={},
+        bbox={"local": [0, 0, 30, 60]},
+        grib_decoder="eccodes",
+        ensemble_products={"spread": True, "percentiles": [50]},
+    )
+    # Keep local outputs and the manifest out of the repo
+    pipeline.local_processed_dir = tmp_path_factory.mktemp("processed")
+    return pipeline
+
+
+def _write_seasonal_grib(path, members):
+    # Imported after rasterio, see `grib_utils`
+    import eccodes
+
+    sample = eccodes.codes_grib_new_from_samples("regular_ll_sfc_grib1")
+    with open(path, "wb") as f:
+        for forecast_month in (1, 2):
+            for number in range(members):
+                gid = eccodes.codes_clone(sample)
+                eccodes.codes_set(gid, "localDefinitionNumber", 16)
+                eccodes.codes_set(gid, "dataDate", 20200301)
+                eccodes.codes_set(gid, "forecastMonth", forecast_month)
+                eccodes.codes_set(gid, "number", number)
+                eccodes.codes_set(gid, "numberOfForecastsInEnsemble", members)
+                values = np.full(16 * 31, (number + 1) / TPRATE_TO_MM_DAY)
+                eccodes.codes_set_values(gid, values)
+                eccodes.codes_write(gid, f)
+                eccodes.codes_release(gid)
+    eccodes.codes_release(sample)
+
+
+def test_stream_data_saves_ensemble_products(pipeline, tmp_path):
+    pipeline.local_raw_dir = tmp_path
+    _write_seasonal_grib(tmp_path / "tprate_2020.grib", members=5)
+    thresholds = xr.Dataset(
+        {
+            "lower": (("month", "latitude"), np.full((12, 31), 1.5)),
+            "upper": (("month", "latitude"), np.full((12, 31), 4.5)),
+        },
+        coords={"month": np.arange(1, 13), "latitude": np.linspace(60, 0, 31)},
+    ).expand_dims(longitude=np.linspace(0, 30, 16), axis=2)
+    thresholds.to_netcdf(tmp_path / "terciles.nc")
+    pipeline.ensemble_products["tercile_thresholds"] = "terciles.nc"
+
+    with patch.object(pipeline, "save_processed_data") as save_processed_data:
+        pipeline.process_data("tprate_2020.grib", 2020)
+
+    saved = {
+        (c.args[2], c.args[1]): c.args[0] for c in save_processed_data.call_args_list
+    }
+    assert set(saved) == {
+        (folder, f"precip_em_i2020-03-01_lt{leadtime}.tif")
+        for folder in (None, "spread", "percentiles", "terciles")
+        for leadtime in (0, 1)
+    }
+    mean = saved[(None, "precip_em_i2020-03-01_lt0.tif")]
+    np.testing.assert_allclose(mean["total precipitation"], 3, rtol=1e-5)
+    spread = saved[("spread", "precip_em_i2020-03-01_lt0.tif")]
+    np.testing.assert_allclose(
+        spread["total precipitation"], np.std([1, 2, 3, 4, 5], ddof=1), rtol=1e-5
+    )
+    percentiles = saved[("percentiles", "precip_em_i2020-03-01_lt1.tif")]
+    np.testing.assert_allclose(percentiles["p50"], 3, rtol=1e-5)
+    terciles = saved[("terciles", "precip_em_i2020-03-01_lt0.tif")]
+    np.testing.assert_allclose(terciles["below normal"], 0.2, rtol=1e-5)
+    np.testing.assert_allclose(terciles["above normal"], 0.2, rtol=1e-5)
+    assert terciles.attrs["units"] == "probability"
+    assert all(ds.rio.crs.to_epsg() == 4326 for ds in saved.values())
+
+
+def test_process_data_reduces_cfgrib_members_lazily(pipeline):
+    pipeline.grib_decoder = "cfgrib"
+    members = np.arange(1, 6).reshape(5, 1, 1) * np.ones((5, 31, 16))
+    ds = xr.Dataset(
+        {"tprate": (("number", "latitude", "longitude"), members / TPRATE_TO_MM_DAY)},
+        coords={
+            "number": np.arange(5),
+            "latitude": np.linspace(60, 0, 31),
+            "longitude": np.linspace(0, 30, 16),
+            "time": np.datetime64("2024-03-01", "ns"),
+            "valid_time": np.datetime64("2024-05-01", "ns"),
+        },
+    )
+    lazy = []
+    save_processed_outputs = pipeline.save_processed_outputs
+
+    def record_outputs(outputs):
+        lazy.extend(dask.is_dask_collection(output[0]) for output in outputs)
+        save_processed_outputs(outputs)
+
+    with (
+        patch("src.pipelines.seas5_pipeline.xr.open_dataset", return_value=ds),
+        patch.object(pipeline, "save_processed_outputs", side_effect=record_outputs),
+        patch.object(pipeline, "save_processed_data") as save_processed_data,
+    ):
+        pipeline.process_data("tprate_2024_03_04.grib", 2024)
+
+    # The ensemble is only reduced by the shared compute of the outputs
+    assert lazy == [True, True, True]
+    saved = {c.args[2]: c.args[0] for c in save_processed_data.call_args_list}
+    assert set(saved) == {None, "spread", "percentiles"}
+    np.testing.assert_allclose(saved[None]["total precipitation"], 3, rtol=1e-5)
+    np.testing.assert_allclose(
+        saved["spread"]["total precipitation"],
+        np.std([1, 2, 3, 4, 5], ddof=1),
+        rtol=1e-5,
+    )
+    np.testing.assert_allclose(saved["percentiles"]["p50"], 3, rtol=1e-5)
+
+
+def test_unit_outputs_include_ensemble_products(pipeline):
+    outputs = pipeline._unit_outputs({"year": 2024, "issued_month": 3, "fc_month": 4})
+    assert outputs == [
+        "precip_em_i2024-03-01_lt1.tif",
+        "spread/precip_em_i2024-03-01_lt1.tif",
+        "percentiles/precip_em_i2024-03-01_lt1.tif",
+    ]
+
+
+def test_plan_backfill_coalesces_requests(pipeline):
+    missing = ["2019-01-01", "2019-05-01", "2020-02-01", "2024-03-01", "2024-03-01"]
+    units = pipeline._plan_backfill(pd.Timestamp(date) for date in missing)
+    # One MARS request per year, and each S3 file of 2024 once
+    assert units[:2] == [{"year": 2019}, {"year": 2020}]
+    assert units[2:] == [
+        {"year": 2024, "issued_month": 3, "fc_month": fc_month}
+        for fc_month in range(3, 10)
+    ]
+
+
+@patch("src.pipelines.seas5_pipeline.s3_filesystem")
+@patch("src.pipelines.seas5_pipeline.fetch_s3_objects", return_value={})
+@patch("src.pipelines.seas5_pipeline.SEAS5Pipeline.process_data")
+def test_run_work_units_prefetches_s3_files(
+    mock_process_data, mock_fetch_s3_objects, mock_s3_filesystem, pipeline
+):
+    pipeline.aws_bucket_name = "ecmwf-forecasts"
+    pipeline.run_work_units(
+        {"year": 2024, "issued_month": 3, "fc_month": fc_month}
+        for fc_month in range(3, 10)
+    )
+    # All seven files in one concurrent fetch, not one each in `query_api`
+    mock_fetch_s3_objects.assert_called_once()
+    files = mock_fetch_s3_objects.call_args.args[1]
+    assert len(files) == 7
+    assert "s3://ecmwf-forecasts/ecmwf/T8L0301000003______1" in files
+    assert mock_process_data.call_count == 7
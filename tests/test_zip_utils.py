@@ -0,0 +1,140 @@
+import io
+import os
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import fsspec
+import pytest
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobServiceClient
+
+from src.utils import azure_utils
+from src.utils.azure_utils import blob_filesystem
+from src.utils.zip_utils import RemoteZip
+
+# Connection string of an Azurite instance to test against, eg.
+# "UseDevelopmentStorage=true"
+AZURITE_CONNECTION_STRING = os.getenv("AZURITE_CONNECTION_STRING")
+
+
+@pytest.fixture
+def remote_zip():
+    fs = fsspec.filesystem("memory")
+    members = {
+        "daily/a_20240301.tif": b"a" * 100_000,
+        "daily/b_20240302.tif": bytes(range(256)) * 400,
+    }
+    with fs.open("/archives/90days.zip", "wb") as f:
+        with ZipFile(f, "w") as zipobj:
+            for i, (name, data) in enumerate(members.items()):
+                compression = ZIP_DEFLATED if i == 0 else ZIP_STORED
+                zipobj.writestr(name, data, compress_type=compression)
+    yield fs, members
+    fs.rm("/archives", recursive=True)
+
+
+@pytest.fixture(
+    params=[
+        "fake",
+        pytest.param(
+            "azurite",
+            marks=pytest.mark.skipif(
+                not AZURITE_CONNECTION_STRING, reason="AZURITE_CONNECTION_STRING unset"
+            ),
+        ),
+    ]
+)
+def blob_zip(request, monkeypatch):
+    """
+    Zip of FloodScan-like members in the `raster` container, read through the
+    `abfs` filesystem of the pipelines, from a fake blob endpoint or Azurite.
+    """
+    members = {
+        "daily/a_20240301.tif": b"a" * 1_000_000,
+        "daily/b_20240302.tif": bytes(range(256)) * 400,
+    }
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w") as zipobj:
+        for i, (name, data) in enumerate(members.items()):
+            compression = ZIP_DEFLATED if i == 0 else ZIP_STORED
+            zipobj.writestr(name, data, compress_type=compression)
+    blob_path = "floodscan/90days.zip"
+
+    if request.param == "fake":
+        endpoint = request.getfixturevalue("blob_endpoint")
+        endpoint.blobs[f"raster/{blob_path}"] = buffer.getvalue()
+        yield blob_filesystem("dev"), f"raster/{blob_path}", members
+        return
+
+    monkeypatch.setattr(
+        azure_utils, "STORAGE_CONNECTION_STRING_DEV", AZURITE_CONNECTION_STRING
+    )
+    monkeypatch.setattr(azure_utils, "_service_clients", {})
+    container = BlobServiceClient.from_connection_string(
+        AZURITE_CONNECTION_STRING
+    ).get_container_client("raster")
+    try:
+        container.create_container()
+    except ResourceExistsError:
+        pass
+    container.upload_blob(blob_path, buffer.getvalue(), overwrite=True)
+    yield blob_filesystem("dev"), f"raster/{blob_path}", members
+    container.delete_blob(blob_path)
+
+
+def test_remote_zip_reads_members(remote_zip):
+    fs, members = remote_zip
+    zipobj = RemoteZip(fs, "/archives/90days.zip")
+
+    assert zipobj.namelist() == list(members)
+    for name, data in members.items():
+        assert zipobj.read(name) == data
+
+
+def test_remote_zip_only_fetches_member_ranges(remote_zip, monkeypatch):
+    fs, members = remote_zip
+    zipobj = RemoteZip(fs, "/archives/90days.zip")
+    ranges = []
+    cat_file = fs.cat_file
+
+    def recording_cat_file(path, start=None, end=None, **kwargs):
+        ranges.append((start, end))
+        return cat_file(path, start, end, **kwargs)
+
+    monkeypatch.setattr(fs, "cat_file", recording_cat_file)
+    name = "daily/b_20240302.tif"
+    zipobj.read(name)
+
+    # The local header, then exactly the member's bytes
+    info = zipobj.members[name]
+    assert len(ranges) == 2
+    assert ranges[1][1] - ranges[1][0] == info.compress_size
+
+
+def test_remote_zip_reads_blob_members(blob_zip):
+    fs, path, members = blob_zip
+    zipobj = RemoteZip(fs, path)
+
+    assert zipobj.namelist() == list(members)
+    for name, data in members.items():
+        assert zipobj.read(name) == data
+
+
+def test_remote_zip_only_fetches_blob_member_ranges(blob_zip, monkeypatch):
+    fs, path, members = blob_zip
+    zipobj = RemoteZip(fs, path)
+    ranges = []
+    cat_file = fs.cat_file
+
+    def recording_cat_file(path, start=None, end=None, **kwargs):
+        ranges.append((start, end))
+        return cat_file(path, start, end, **kwargs)
+
+    monkeypatch.setattr(fs, "cat_file", recording_cat_file)
+    name = "daily/b_20240302.tif"
+    assert zipobj.read(name) == members[name]
+
+    # Only the member was read, not the rest of the zip
+    info = zipobj.members[name]
+    assert len(ranges) == 2
+    assert ranges[1][1] - ranges[1][0] == info.compress_size
+    assert sum(end - start for start, end in ranges) < info.compress_size + 1024